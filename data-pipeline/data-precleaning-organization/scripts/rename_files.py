@@ -99,7 +99,7 @@ module_map = {
     "Polytique de sécurité": "PS",  
     "Sécurité des logiciels": "SL",
     "Sécurité liée aux infrastructures": "SLI",
-    "Technique d'intrusion et défense": "TID"
+    "Technique d'intrusion et défense": "TID",
 
     # 3CS – S1 (IA)
     "BI": "BI",
@@ -108,7 +108,7 @@ module_map = {
     "NLP": "NLP",
     "NoSQL": "NoSQL",
     "RFAI": "RFAI",
-    "RL": "RL"
+    "RL": "RL",
 
 }
 
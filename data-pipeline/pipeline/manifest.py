@@ -0,0 +1,99 @@
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Content hash of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def config_hash(config: Dict[str, Any]) -> str:
+    """Stable hash of the settings that affect the outputs (pipeline version, model params, ...)"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+class Manifest:
+    """
+    SQLite record of what the pipeline already produced, keyed by file content hash
+    and configuration hash. A file is "done" once all its outputs were written; the
+    cleaned content of each page is stored as soon as it is ready, so an interrupted
+    run resumes without re-sending finished pages to the models.
+
+    One connection per process; several worker processes may share the database.
+    """
+
+    def __init__(self, path: str, config: Dict[str, Any]):
+        self.path = path
+        self.config_key = config_hash(config)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_hash TEXT NOT NULL,
+                config_key TEXT NOT NULL,
+                filename TEXT,
+                status TEXT NOT NULL,
+                pages INTEGER,
+                chunks INTEGER,
+                updated_at TEXT,
+                PRIMARY KEY (file_hash, config_key)
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                file_hash TEXT NOT NULL,
+                config_key TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                cleaned TEXT NOT NULL,
+                PRIMARY KEY (file_hash, config_key, page)
+            );
+        """)
+        self.conn.commit()
+
+    def file_record(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT filename, status, pages, chunks, updated_at FROM files WHERE file_hash = ? AND config_key = ?",
+            (file_hash, self.config_key)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("filename", "status", "pages", "chunks", "updated_at"), row))
+
+    def start_file(self, file_hash: str, filename: str, force: bool = False):
+        """Mark a file as in progress; with `force`, forget the pages cleaned by earlier runs"""
+        with self.conn:
+            if force:
+                self.conn.execute("DELETE FROM pages WHERE file_hash = ? AND config_key = ?", (file_hash, self.config_key))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, 'in_progress', NULL, NULL, ?)",
+                (file_hash, self.config_key, filename, time.strftime("%Y-%m-%d %H:%M:%S"))
+            )
+
+    def finish_file(self, file_hash: str, pages: int, chunks: int):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE files SET status = 'done', pages = ?, chunks = ?, updated_at = ? WHERE file_hash = ? AND config_key = ?",
+                (pages, chunks, time.strftime("%Y-%m-%d %H:%M:%S"), file_hash, self.config_key)
+            )
+
+    def cleaned_page(self, file_hash: str, page: int) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute(
+            "SELECT cleaned FROM pages WHERE file_hash = ? AND config_key = ? AND page = ?",
+            (file_hash, self.config_key, page)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_page(self, file_hash: str, cleaned_page: Dict[str, Any]):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)",
+                (file_hash, self.config_key, cleaned_page["page"], json.dumps(cleaned_page, ensure_ascii=False))
+            )
+
+    def close(self):
+        self.conn.close()
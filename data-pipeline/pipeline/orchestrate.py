@@ -1,15 +1,25 @@
+import argparse
 import os
 import sys
 import json
 import time
 import re
+import multiprocessing
+import queue
+import textwrap
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Set, Tuple
 
 # Add utils to path for imports
 current_dir = os.path.dirname(os.path.abspath(__file__))
 utils_dir = os.path.join(os.path.dirname(current_dir), "utils")
 sys.path.insert(0, utils_dir)
+sys.path.insert(0, current_dir)
 
 # import the components
 from load.pdf_loader import PDFLoader
@@ -18,6 +28,137 @@ from transform.image_cleanup import ImageCleanup
 from transform.model import Model, ModelParams
 from transform.table_cleanup import TableCleanup
 from transform.text_cleanup import TextCleanup
+from manifest import Manifest, file_sha256
+
+# Bump when a change to loading, cleaning or splitting should invalidate earlier outputs
+PIPELINE_VERSION = "2"
+
+
+# -------------------------------
+# Streaming helpers
+# -------------------------------
+_END = object()
+
+
+def background_iter(iterable: Iterable, maxsize: int) -> Iterator:
+    """
+    Consume `iterable` on a background thread, at most `maxsize` items ahead of the
+    reader (the bounded queue gives backpressure). Errors are re-raised in the reader;
+    if the reader stops early, the producer is stopped and its iterable closed.
+    """
+    items = queue.Queue(maxsize=max(1, maxsize))
+    stop = threading.Event()
+    
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            put(_END)
+        except BaseException as e:
+            put(e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+    
+    threading.Thread(target=produce, name="pipeline-stage", daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class DocumentWriter:
+    """
+    Writes the raw, cleaned, chunked and final JSON outputs of one document page by
+    page. Files are written under a `.part` name and renamed once the document is
+    complete, so an interrupted run never leaves a truncated output behind.
+    """
+    
+    def __init__(self, output_folder: str, filename: str):
+        self.filename = filename
+        self.paths = self.output_paths(output_folder, filename)
+        self.files = {}
+        self.counts = {"raw": 0, "cleaned": 0, "chunked": 0, "final": 0}
+        self.total_pages = 0
+        self.total_chunks = 0
+        self.chunk_types = {"text": 0, "table": 0, "image": 0}
+    
+    @staticmethod
+    def output_paths(output_folder: str, filename: str) -> Dict[str, str]:
+        base_name = os.path.splitext(filename)[0]
+        return {
+            "raw": os.path.join(output_folder, "raw_extracted", f"{base_name}_raw.json"),
+            "cleaned": os.path.join(output_folder, "cleaned", f"{base_name}_cleaned.json"),
+            "chunked": os.path.join(output_folder, "chunked", f"{base_name}_chunks.json"),
+            "final": os.path.join(output_folder, "final", f"{base_name}_final.json")
+        }
+    
+    def __enter__(self):
+        for name, path in self.paths.items():
+            self.files[name] = open(path + ".part", "w", encoding="utf-8")
+        for name in ("raw", "cleaned", "chunked"):
+            self.files[name].write("[")
+        header = json.dumps({
+            "source_file": self.filename,
+            "processing_timestamp": time.strftime("%Y-%m-%d %H:%M:%S")
+        }, indent=2, ensure_ascii=False)
+        self.files["final"].write(header[:-2] + ',\n  "chunks": [')
+        return self
+    
+    def _append(self, name: str, item: Any, level: int):
+        separator = ",\n" if self.counts[name] else "\n"
+        self.files[name].write(separator + textwrap.indent(json.dumps(item, indent=2, ensure_ascii=False), "  " * level))
+        self.counts[name] += 1
+    
+    def tap_raw(self, pages: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Pass raw pages through, writing each one to the raw output"""
+        for page_data in pages:
+            self._append("raw", page_data, 1)
+            yield page_data
+    
+    def write_page(self, cleaned_page: Dict[str, Any], chunks: List[Dict[str, Any]]):
+        self._append("cleaned", cleaned_page, 1)
+        for chunk in chunks:
+            self._append("chunked", chunk, 1)
+            self._append("final", chunk, 2)
+            self.total_chunks += 1
+            self.chunk_types[chunk["type"]] = self.chunk_types.get(chunk["type"], 0) + 1
+        self.total_pages += 1
+    
+    def __exit__(self, exc_type, exc, tb):
+        for name in ("raw", "cleaned", "chunked"):
+            self.files[name].write("\n]" if self.counts[name] else "]")
+        summary = json.dumps({
+            "total_pages": self.total_pages,
+            "total_chunks": self.total_chunks,
+            "chunk_types": self.chunk_types
+        }, indent=2, ensure_ascii=False)
+        self.files["final"].write(("\n  ]," if self.total_chunks else "],") + summary[1:])
+        
+        for name, file in self.files.items():
+            file.close()
+            if exc_type is None:
+                os.replace(self.paths[name] + ".part", self.paths[name])
+            else:
+                os.remove(self.paths[name] + ".part")
+        return False
 
 
 class DataPipelineOrchestrator:
@@ -31,7 +172,33 @@ class DataPipelineOrchestrator:
                  table_model: str = "qwen3:4b",           
                  image_model: str = "granite3.2-vision:latest", 
                  input_folder: str = None, 
-                 output_folder: str = None):
+                 output_folder: str = None,
+                 text_concurrency: int = 2,
+                 table_concurrency: int = 2,
+                 image_concurrency: int = 1,
+                 pages_in_flight: int = 4,
+                 prefetch_pages: int = 2,
+                 force: bool = False,
+                 manifest_path: str = None,
+                 limiters: Dict[str, Any] = None):
+        
+        # Constructor arguments, used to build an identical orchestrator in each worker process
+        self._config = {
+            "text_model": text_model,
+            "table_model": table_model,
+            "image_model": image_model,
+            "input_folder": input_folder,
+            "output_folder": output_folder,
+            "text_concurrency": text_concurrency,
+            "table_concurrency": table_concurrency,
+            "image_concurrency": image_concurrency,
+            "pages_in_flight": pages_in_flight,
+            "prefetch_pages": prefetch_pages,
+            "force": force,
+            "manifest_path": manifest_path
+        }
+        # Shared per-model semaphores ("text"/"table"/"image") capping LLM requests across processes
+        limiters = limiters or {}
         
         # Initialize specialized models
         self.text_model_params = ModelParams(
@@ -39,14 +206,14 @@ class DataPipelineOrchestrator:
             temperature=0.3, 
             num_ctx=4096
         )
-        self.text_model = Model(self.text_model_params)
+        self.text_model = Model(self.text_model_params, limiter=limiters.get("text"))
         
         self.table_model_params = ModelParams(
             model=table_model,
             temperature=0.2,  
             num_ctx=2048
         )
-        self.table_model = Model(self.table_model_params)
+        self.table_model = Model(self.table_model_params, limiter=limiters.get("table"))
         
         self.image_model_params = ModelParams(
             model=image_model,
@@ -54,30 +221,92 @@ class DataPipelineOrchestrator:
             num_ctx=2048,
             think=False
         )
-        self.image_model = Model(self.image_model_params)
+        self.image_model = Model(self.image_model_params, limiter=limiters.get("image"))
         
         # Initialize components
         self.splitter = HierarchicalSplitter()
         
+        # One pool per model: its size is the number of concurrent requests sent to that model
+        # (keep it at or below the Ollama server's OLLAMA_NUM_PARALLEL)
+        self.concurrency = {"text": text_concurrency, "table": table_concurrency, "image": image_concurrency}
+        self._pools = {
+            kind: ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{kind}-cleanup")
+            for kind, workers in self.concurrency.items()
+        }
+        self._stats_lock = threading.Lock()
+        
+        # Streaming bounds: pages being cleaned at once, and pages extracted ahead of cleaning
+        self.pages_in_flight = pages_in_flight
+        self.prefetch_pages = prefetch_pages
+        
         # Setup folders
         self.input_folder = input_folder or "/home/melissa-ghemari/estin-chatbot/data-pipeline/sample-data"
         self.output_folder = output_folder or "outputs"
         self._ensure_output_folder()
         
+        # Manifest of finished files and pages: unchanged files are skipped and interrupted
+        # files resume from their last cleaned page, unless `force` is set
+        self.force = force
+        self.manifest = Manifest(manifest_path or os.path.join(self.output_folder, "manifest.sqlite"), self._output_config())
+        
         # Statistics
-        self.stats = {
+        self.stats = self._new_stats()
+    
+    def _output_config(self) -> Dict[str, Any]:
+        """Settings the outputs depend on; a change to any of them invalidates the manifest"""
+        def params(model_params: ModelParams) -> Dict[str, Any]:
+            return {k: v for k, v in asdict(model_params).items() if k != "host"}
+        return {
+            "pipeline_version": PIPELINE_VERSION,
+            "text_model": params(self.text_model_params),
+            "table_model": params(self.table_model_params),
+            "image_model": params(self.image_model_params)
+        }
+    
+    def _new_stats(self) -> Dict[str, Any]:
+        return {
             "files_processed": 0,
+            "files_skipped": 0,
+            "pages_reused": 0,
             "total_pages": 0,
             "total_chunks": 0,
             "total_time": 0,
             "models_used": {
-                "text": text_model,
-                "table": table_model,
-                "image": image_model
+                "text": self.text_model_params.model,
+                "table": self.table_model_params.model,
+                "image": self.image_model_params.model
+            },
+            "transform": {
+                "pages": 0,
+                "time": 0.0,
+                "pages_per_sec": 0.0,
+                "concurrency": dict(self.concurrency),
+                "queue_wait": {
+                    kind: {"jobs": 0, "total": 0.0, "avg": 0.0, "max": 0.0}
+                    for kind in self.concurrency
+                }
             },
+            "llm_cache": {},
             "errors": []
         }
     
+    def _cache_counters(self) -> Dict[str, Dict[str, int]]:
+        """Per-model hits/misses of the response cache shared by this process's models"""
+        counters = {}
+        for cache in {id(m.cache): m.cache for m in (self.text_model, self.table_model, self.image_model) if m.cache}.values():
+            counters.update(cache.counters())
+        return counters
+    
+    def _add_cache_stats(self, counters: Dict[str, Dict[str, int]], before: Dict[str, Dict[str, int]] = None):
+        """Add cache hits/misses (minus `before`) to self.stats and refresh the hit rates"""
+        before = before or {}
+        for model, counts in counters.items():
+            entry = self.stats["llm_cache"].setdefault(model, {"hits": 0, "misses": 0, "hit_rate": 0.0})
+            for key in ("hits", "misses"):
+                entry[key] += counts[key] - before.get(model, {}).get(key, 0)
+            lookups = entry["hits"] + entry["misses"]
+            entry["hit_rate"] = entry["hits"] / lookups if lookups else 0.0
+    
     def _ensure_output_folder(self):
         """Create output folder structure if it doesn't exist"""
         Path(self.output_folder).mkdir(parents=True, exist_ok=True)
@@ -86,93 +315,148 @@ class DataPipelineOrchestrator:
         Path(os.path.join(self.output_folder, "chunked")).mkdir(exist_ok=True)
         Path(os.path.join(self.output_folder, "final")).mkdir(exist_ok=True)
     
-    def _load_pdf(self, pdf_path: str) -> List[Dict[str, Any]]:
-        """Load and extract content from PDF"""
+    def _load_pdf(self, pdf_path: str) -> Iterator[Dict[str, Any]]:
+        """Load and extract content from PDF, one page at a time"""
         print(f"Loading PDF: {os.path.basename(pdf_path)}")
         loader = PDFLoader(pdf_path)
-        return loader.analyse()
+        try:
+            yield from loader.iter_pages()
+        finally:
+            loader.close()
     
-    def _transform_content(self, pages_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Transform and clean extracted content"""
-        print("Transforming content...")
+    def _timed_job(self, kind: str, submitted: float, job, *args):
+        """Run a cleanup job on a model's pool, recording how long it waited for a free slot"""
+        wait = time.time() - submitted
+        with self._stats_lock:
+            wait_stats = self.stats["transform"]["queue_wait"][kind]
+            wait_stats["jobs"] += 1
+            wait_stats["total"] += wait
+            wait_stats["max"] = max(wait_stats["max"], wait)
+        return job(*args)
 
-        transformed_pages = []
-        
-        for page_data in pages_data:
-            page_num = page_data["page"]
-            print(f"Processing page {page_num}...")
-            
-            transformed_page = {
+    def _submit(self, kind: str, job, *args) -> Future:
+        return self._pools[kind].submit(self._timed_job, kind, time.time(), job, *args)
+
+    # The cleanup jobs return (result, fell_back): fell_back is True when the model
+    # failed and the raw content was kept instead
+
+    def _clean_text(self, page_data: Dict[str, Any]) -> Tuple[str, bool]:
+        try:
+            text_cleaner = TextCleanup(page_data["plain_text"], self.text_model)
+            result = text_cleaner.process()
+            print(f"✓ Page {page_data['page']}: text cleaned with {self.text_model_params.model} ({len(result)} chars)")
+            return result, False
+        except Exception as e:
+            print(f" ⚠️ Page {page_data['page']}: text cleaning failed: {e}")
+            return page_data["plain_text"], True  # Fallback to original
+
+    def _clean_table(self, page_data: Dict[str, Any], table: Dict[str, Any], index: int) -> Tuple[Dict[str, Any], bool]:
+        table_id = table.get("table", index + 1)
+        try:
+            table_cleaner = TableCleanup(
+                table_data=table.get("data", table),  # The actual table data
+                context=page_data.get("plain_text", ""),  # Page text as context
+                model=self.table_model  # The model instance
+            )
+            cleaned_data = table_cleaner.process()
+            fell_back = False
+        except Exception as e:
+            print(f" ⚠️ Page {page_data['page']}: table {table_id} cleaning failed: {e}")
+            cleaned_data = str(table.get("data", "Table data not available"))  # Fallback with safe structure
+            fell_back = True
+        return {"table_id": table_id, "cleaned_data": cleaned_data}, fell_back
+
+    def _clean_image(self, page_data: Dict[str, Any], image: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        try:
+            image_cleaner = ImageCleanup(
+                image_data=image,  # The complete image data (contains ext, base64, etc.)
+                context=page_data.get("plain_text", ""),
+                model=self.image_model
+            )
+            description = image_cleaner.process()
+            fell_back = False
+        except Exception as e:
+            print(f" ⚠️ Page {page_data['page']}: image {image.get('image_id')} processing failed: {e}")
+            description = f"Image {image.get('image_id')} (processing failed)"  # Fallback without base64 data
+            fell_back = True
+        return {
+            "image_id": image.get("image_id"),
+            "description": description,
+            "original_ext": image.get("ext", "unknown")
+        }, fell_back
+
+    def _transform_pages(self, pages: Iterable[Dict[str, Any]], reuse=None, fallback_pages: Set[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Transform and clean extracted content as it arrives.
+
+        The text, tables and images of up to `pages_in_flight` pages are submitted at
+        once to the pool of their model (at most `*_concurrency` requests in flight per
+        model), so the models work in parallel instead of waiting on each other.
+        Cleaned pages are yielded in page order; a failed item falls back to its raw
+        content. Reading a new page waits for the oldest one to be cleaned, which
+        bounds the number of pages held in memory. `reuse(page_num)` may return a page
+        cleaned by an earlier run, which is then passed through without model calls.
+        The numbers of pages where any item fell back are added to `fallback_pages`.
+        """
+        start_time = time.time()
+        pending = deque()
+        # Pages actually sent to the models; reused pages are not counted in the throughput
+        count = 0
+        reused_count = 0
+        
+        def assemble(page_num, text, tables, images, reused) -> Dict[str, Any]:
+            nonlocal count, reused_count
+            if reused is not None:
+                reused_count += 1
+                return reused
+            count += 1
+            cleaned_text, text_fell_back = text.result() if text is not None else ("", False)
+            cleaned_tables = [future.result() for future in tables]
+            cleaned_images = [future.result() for future in images]
+            if fallback_pages is not None and (text_fell_back or any(fell_back for _, fell_back in cleaned_tables + cleaned_images)):
+                fallback_pages.add(page_num)
+            return {
                 "page": page_num,
-                "cleaned_text": "",
-                "cleaned_tables": [],
-                "cleaned_images": []
+                "cleaned_text": cleaned_text,
+                "cleaned_tables": [table for table, _ in cleaned_tables],
+                "cleaned_images": [image for image, _ in cleaned_images]
             }
-            
-            # Clean text with specialized text model
-            if page_data["plain_text"]:
-                try:
-                    text_cleaner = TextCleanup(page_data["plain_text"], self.text_model)
-                    result = text_cleaner.process()
-                    transformed_page["cleaned_text"] = result
-                    print(f"✓ Text cleaned with {self.text_model_params.model} ({len(transformed_page['cleaned_text'])} chars)")
-                except Exception as e:
-                    print(f" ⚠️ Text cleaning failed: {e}")
-                    transformed_page["cleaned_text"] = page_data["plain_text"]  # Fallback to original
-            
-            # Clean tables with specialized table model
-            if page_data["tables"]:
-                try:
-                    for i, table in enumerate(page_data["tables"]):
-                        table_cleaner = TableCleanup(
-                            table_data=table.get("data", table),  # The actual table data
-                            context=page_data.get("plain_text", ""),  # Page text as context
-                            model=self.table_model  # The model instance
-                        )
-                        cleaned_table = table_cleaner.process()
-                        transformed_page["cleaned_tables"].append({
-                            "table_id": table.get("table", i + 1),
-                            "cleaned_data": cleaned_table  # Fix: Use `cleaned_table` directly
-                        })
-                    print(f"✓ {len(page_data['tables'])} tables cleaned with {self.table_model_params.model}")
-                except Exception as e:
-                    print(f" ⚠️ Table cleaning failed: {e}")
-                    # Fallback with safe structure
-                    for i, table in enumerate(page_data["tables"]):
-                        transformed_page["cleaned_tables"].append({
-                            "table_id": table.get("table", i + 1),
-                            "cleaned_data": str(table.get("data", "Table data not available"))
-                        })
-            
-            # Clean images with specialized vision model
-            if page_data["images"]:
-                try:
-                    for image in page_data["images"]:
-                        image_cleaner = ImageCleanup(
-                            image_data=image,  # The complete image data (contains ext, base64, etc.)
-                            context=page_data.get("plain_text", ""),  
-                            model=self.image_model  
-                        )
-                        cleaned_image = image_cleaner.process()
-                        transformed_page["cleaned_images"].append({
-                            "image_id": image["image_id"],
-                            "description": cleaned_image,
-                            "original_ext": image["ext"]
-                        })
-                    print(f"✓ {len(page_data['images'])} images described with {self.image_model_params.model}")
-                except Exception as e:
-                    print(f" ⚠️ Image processing failed: {e}")
-                    # Fallback without base64 data
-                    for image in page_data["images"]:
-                        transformed_page["cleaned_images"].append({
-                            "image_id": image["image_id"],
-                            "description": f"Image {image['image_id']} (processing failed)",
-                            "original_ext": image.get("ext", "unknown")
-                        })
-            
-            transformed_pages.append(transformed_page)
         
-        return transformed_pages
+        try:
+            for page_data in pages:
+                cleaned_page = reuse(page_data["page"]) if reuse is not None else None
+                if cleaned_page is not None:
+                    pending.append((page_data["page"], None, [], [], cleaned_page))
+                    continue
+                text = self._submit("text", self._clean_text, page_data) if page_data["plain_text"] else None
+                tables = [self._submit("table", self._clean_table, page_data, table, i) for i, table in enumerate(page_data["tables"] or [])]
+                images = [self._submit("image", self._clean_image, page_data, image) for image in page_data["images"] or []]
+                pending.append((page_data["page"], text, tables, images, None))
+                while len(pending) >= self.pages_in_flight:
+                    yield assemble(*pending.popleft())
+            while pending:
+                yield assemble(*pending.popleft())
+        finally:
+            for _, text, tables, images, _ in pending:
+                for future in [text, *tables, *images]:
+                    if future is not None:
+                        future.cancel()
+            
+            elapsed = time.time() - start_time
+            with self._stats_lock:
+                transform_stats = self.stats["transform"]
+                transform_stats["pages"] += count
+                transform_stats["time"] += elapsed
+                transform_stats["pages_per_sec"] = transform_stats["pages"] / transform_stats["time"] if transform_stats["time"] else 0.0
+                for wait_stats in transform_stats["queue_wait"].values():
+                    wait_stats["avg"] = wait_stats["total"] / wait_stats["jobs"] if wait_stats["jobs"] else 0.0
+            reused_note = f", {reused_count} reused" if reused_count else ""
+            print(f"✓ {count} pages transformed in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.2f} pages/s{reused_note})")
+    
+    def _transform_content(self, pages_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Transform and clean extracted content"""
+        print(f"Transforming content ({len(pages_data)} pages)...")
+        return list(self._transform_pages(pages_data))
 
     def _extract_filename_metadata(self, filename: str) -> Dict[str, Any]:
         """Extract metadata from filename pattern: LEVEL_SEMESTER_MODULE_TYPE_YEAR_..."""
@@ -209,139 +493,157 @@ class DataPipelineOrchestrator:
         
         return metadata
 
-    def _split_content(self, transformed_pages: List[Dict[str, Any]], filename: str) -> List[Dict[str, Any]]:
-        """Split cleaned content into chunks with enhanced metadata"""
-        print("Splitting content into chunks...")
-        all_chunks = []
-        
-        file_metadata = self._extract_filename_metadata(filename)
-        
-        for page_data in transformed_pages:
-            page_num = page_data["page"]
-            
-            if page_data["cleaned_text"]:
-                text_chunks = self.splitter.split_text(page_data["cleaned_text"])
-                for i, chunk in enumerate(text_chunks):
-                    all_chunks.append({
-                        "chunk_id": f"page_{page_num}_text_{i+1}",
-                        "page": page_num,
-                        "type": "text",
-                        "content": chunk,
-                        "metadata": {
-                            "chunk_index": i,
-                            "total_chunks_in_page": len(text_chunks),
-                            **file_metadata,
-                            "content_type": "text"
-                        }
-                    })
-            
-            for table in page_data["cleaned_tables"]:
-                all_chunks.append({
-                    "chunk_id": f"page_{page_num}_table_{table['table_id']}",
-                    "page": page_num,
-                    "type": "table",
-                    "content": table["cleaned_data"],
-                    "metadata": {
-                        "table_id": table["table_id"],
-                        **file_metadata,
-                        "content_type": "table"
-                    }
-                })
-            
-            for image in page_data["cleaned_images"]:
-                all_chunks.append({
-                    "chunk_id": f"page_{page_num}_image_{image['image_id']}",
+    def _split_page(self, page_data: Dict[str, Any], file_metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Split the cleaned content of one page into chunks with enhanced metadata"""
+        chunks = []
+        page_num = page_data["page"]
+        
+        if page_data["cleaned_text"]:
+            text_chunks = self.splitter.split_text(page_data["cleaned_text"])
+            for i, chunk in enumerate(text_chunks):
+                chunks.append({
+                    "chunk_id": f"page_{page_num}_text_{i+1}",
                     "page": page_num,
-                    "type": "image",
-                    "content": image["description"],
+                    "type": "text",
+                    "content": chunk,
                     "metadata": {
-                        "image_id": image["image_id"],
-                        "original_ext": image["original_ext"],
+                        "chunk_index": i,
+                        "total_chunks_in_page": len(text_chunks),
                         **file_metadata,
-                        "content_type": "image"
+                        "content_type": "text"
                     }
                 })
         
+        for table in page_data["cleaned_tables"]:
+            chunks.append({
+                "chunk_id": f"page_{page_num}_table_{table['table_id']}",
+                "page": page_num,
+                "type": "table",
+                "content": table["cleaned_data"],
+                "metadata": {
+                    "table_id": table["table_id"],
+                    **file_metadata,
+                    "content_type": "table"
+                }
+            })
+        
+        for image in page_data["cleaned_images"]:
+            chunks.append({
+                "chunk_id": f"page_{page_num}_image_{image['image_id']}",
+                "page": page_num,
+                "type": "image",
+                "content": image["description"],
+                "metadata": {
+                    "image_id": image["image_id"],
+                    "original_ext": image["original_ext"],
+                    **file_metadata,
+                    "content_type": "image"
+                }
+            })
+        
+        return chunks
+
+    def _split_content(self, transformed_pages: List[Dict[str, Any]], filename: str) -> List[Dict[str, Any]]:
+        """Split cleaned content into chunks with enhanced metadata"""
+        print("Splitting content into chunks...")
+        file_metadata = self._extract_filename_metadata(filename)
+        all_chunks = []
+        for page_data in transformed_pages:
+            all_chunks.extend(self._split_page(page_data, file_metadata))
+        
         print(f"Created {len(all_chunks)} total chunks")
         return all_chunks
 
-    def _save_outputs(self, filename: str, raw_data: List[Dict], cleaned_data: List[Dict], chunks: List[Dict]):
-        """Save outputs to different folders"""
-        base_name = os.path.splitext(filename)[0]
-        
-        # Save raw extracted data
-        raw_path = os.path.join(self.output_folder, "raw_extracted", f"{base_name}_raw.json")
-        with open(raw_path, 'w', encoding='utf-8') as f:
-            json.dump(raw_data, f, indent=2, ensure_ascii=False)
-        
-        # Save cleaned data
-        cleaned_path = os.path.join(self.output_folder, "cleaned", f"{base_name}_cleaned.json")
-        with open(cleaned_path, 'w', encoding='utf-8') as f:
-            json.dump(cleaned_data, f, indent=2, ensure_ascii=False)
-        
-        # Save chunked data
-        chunked_path = os.path.join(self.output_folder, "chunked", f"{base_name}_chunks.json")
-        with open(chunked_path, 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, indent=2, ensure_ascii=False)
-        
-        # Save final enriched data
-        final_data = {
-            "source_file": filename,
-            "processing_timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-            "total_pages": len(cleaned_data),
-            "total_chunks": len(chunks),
-            "chunk_types": {
-                "text": len([c for c in chunks if c["type"] == "text"]),
-                "table": len([c for c in chunks if c["type"] == "table"]),
-                "image": len([c for c in chunks if c["type"] == "image"])
-            },
-            "chunks": chunks
-        }
+    def process_file(self, pdf_path: str) -> Dict[str, Any]:
+        """
+        Process a single PDF file through the complete pipeline.
         
-        final_path = os.path.join(self.output_folder, "final", f"{base_name}_final.json")
-        with open(final_path, 'w', encoding='utf-8') as f:
-            json.dump(final_data, f, indent=2, ensure_ascii=False)
+        The stages are streamed: pages are extracted on a background thread into a
+        bounded queue, cleaned a few pages at a time, then split and appended to the
+        output files right away, so memory stays flat regardless of document size.
         
-        print(f"Outputs saved to: {self.output_folder}")
-
-    def process_file(self, pdf_path: str) -> Dict[str, Any]:
-        """Process a single PDF file through the complete pipeline"""
+        Files already processed with the same content and settings are skipped, and
+        pages cleaned before an interruption are reused (see Manifest), unless `force`.
+        """
         filename = os.path.basename(pdf_path)
         print(f"\n{'='*60}")
         print(f"Processing: {filename}")
         print(f"{'='*60}")
         
         start_time = time.time()
+        file_metadata = self._extract_filename_metadata(filename)
+        pages = 0
+        reused = 0
+        fallback_pages = set()
+        cache_before = self._cache_counters()
         
         try:
-            # Step 1: Load
-            raw_data = self._load_pdf(pdf_path)
-            self.stats["total_pages"] += len(raw_data)
+            file_hash = file_sha256(pdf_path)
+            record = self.manifest.file_record(file_hash)
+            if (not self.force and record and record["status"] == "done"
+                    and all(os.path.exists(path) for path in DocumentWriter.output_paths(self.output_folder, filename).values())):
+                print(f"⏭️ Skipped: {filename} is unchanged since {record['updated_at']}")
+                self.stats["files_skipped"] += 1
+                return {
+                    "success": True,
+                    "skipped": True,
+                    "filename": filename,
+                    "pages": record["pages"],
+                    "chunks": record["chunks"],
+                    "processing_time": time.time() - start_time
+                }
+            self.manifest.start_file(file_hash, filename, force=self.force)
             
-            # Step 2: Transform
-            cleaned_data = self._transform_content(raw_data)
+            def reuse(page_num: int):
+                nonlocal reused
+                cleaned_page = self.manifest.cleaned_page(file_hash, page_num)
+                if cleaned_page is not None:
+                    reused += 1
+                return cleaned_page
             
-            # Step 3: Split (now with filename metadata)
-            chunks = self._split_content(cleaned_data, filename)
-            self.stats["total_chunks"] += len(chunks)
-            
-            # Step 4: Save outputs
-            self._save_outputs(filename, raw_data, cleaned_data, chunks)
+            with DocumentWriter(self.output_folder, filename) as writer:
+                # Step 1: Load (background thread, at most `prefetch_pages` pages ahead)
+                raw_pages = background_iter(self._load_pdf(pdf_path), self.prefetch_pages)
+                
+                # Step 2: Transform (raw pages are written out as they go through)
+                for cleaned_page in self._transform_pages(writer.tap_raw(raw_pages), reuse, fallback_pages):
+                    # Pages holding raw fallback content are cleaned again by the next run
+                    if cleaned_page["page"] not in fallback_pages:
+                        self.manifest.save_page(file_hash, cleaned_page)
+                    
+                    # Step 3: Split (now with filename metadata)
+                    chunks = self._split_page(cleaned_page, file_metadata)
+                    
+                    # Step 4: Save outputs
+                    writer.write_page(cleaned_page, chunks)
+                    pages += 1
             
+            # With fallback pages the file stays in progress, so the next run retries it
+            if not fallback_pages:
+                self.manifest.finish_file(file_hash, pages, writer.total_chunks)
+            self.stats["total_pages"] += pages
+            self.stats["pages_reused"] += reused
+            self.stats["total_chunks"] += writer.total_chunks
             processing_time = time.time() - start_time
             self.stats["total_time"] += processing_time
             self.stats["files_processed"] += 1
             
             result = {
                 "success": True,
+                "skipped": False,
                 "filename": filename,
-                "pages": len(raw_data),
-                "chunks": len(chunks),
+                "pages": pages,
+                "pages_reused": reused,
+                "fallback_pages": sorted(fallback_pages),
+                "chunks": writer.total_chunks,
                 "processing_time": processing_time
             }
             
+            print(f"Outputs saved to: {self.output_folder}")
             print(f"✅ Completed: {filename}")
-            print(f" {len(raw_data)} pages → {len(chunks)} chunks")
+            print(f" {pages} pages → {writer.total_chunks} chunks" + (f" ({reused} pages reused from an earlier run)" if reused else ""))
+            if fallback_pages:
+                print(f" ⚠️ Raw content kept on pages {sorted(fallback_pages)}: they will be cleaned again on the next run")
             print(f" Processing time: {processing_time:.2f}s")
             
             return result
@@ -355,10 +657,12 @@ class DataPipelineOrchestrator:
                 "filename": filename,
                 "error": str(e)
             }
+        finally:
+            self._add_cache_stats(self._cache_counters(), cache_before)
     
     
-    def process_folder(self) -> Dict[str, Any]:
-        """Process all PDF files in the input folder"""
+    def process_folder(self, workers: int = 1) -> Dict[str, Any]:
+        """Process all PDF files in the input folder, in `workers` processes when greater than 1"""
         print(f"\nScanning folder: {self.input_folder}")
         
         # Find all PDF files
@@ -372,19 +676,23 @@ class DataPipelineOrchestrator:
             return {"success": False, "message": "No PDF files found"}
         
         print(f"Found {len(pdf_files)} PDF files")
-        print(f"Models used:")
+        print("Models used:")
         print(f"Text: {self.text_model_params.model}")
         print(f"Tables: {self.table_model_params.model}")
         print(f"Images: {self.image_model_params.model}")
         print(f"Output folder: {self.output_folder}")
+        print(f"Worker processes: {workers}")
         
         overall_start = time.time()
         results = []
         
         # Process each file
-        for pdf_path in pdf_files:
-            result = self.process_file(pdf_path)
-            results.append(result)
+        if workers > 1:
+            results = self._process_files_parallel(pdf_files, workers)
+        else:
+            for pdf_path in pdf_files:
+                result = self.process_file(pdf_path)
+                results.append(result)
         
         # Final summary
         total_time = time.time() - overall_start
@@ -395,24 +703,102 @@ class DataPipelineOrchestrator:
             "total_files": len(pdf_files),
             "successful": len([r for r in results if r["success"]]),
             "failed": len([r for r in results if not r["success"]]),
+            "processed": len([r for r in results if r["success"] and not r.get("skipped")]),
+            "skipped": len([r for r in results if r.get("skipped")]),
             "results": results,
             "stats": self.stats
         }
     
+    def _merge_stats(self, stats: Dict[str, Any]):
+        """Add the statistics of a worker process to this orchestrator's"""
+        for key in ("files_processed", "files_skipped", "pages_reused", "total_pages", "total_chunks", "total_time"):
+            self.stats[key] += stats[key]
+        self.stats["errors"].extend(stats["errors"])
+        self._add_cache_stats(stats["llm_cache"])
+        
+        transform_stats = self.stats["transform"]
+        transform_stats["pages"] += stats["transform"]["pages"]
+        transform_stats["time"] += stats["transform"]["time"]
+        transform_stats["pages_per_sec"] = transform_stats["pages"] / transform_stats["time"] if transform_stats["time"] else 0.0
+        for kind, wait_stats in transform_stats["queue_wait"].items():
+            other = stats["transform"]["queue_wait"][kind]
+            wait_stats["jobs"] += other["jobs"]
+            wait_stats["total"] += other["total"]
+            wait_stats["max"] = max(wait_stats["max"], other["max"])
+            wait_stats["avg"] = wait_stats["total"] / wait_stats["jobs"] if wait_stats["jobs"] else 0.0
+    
+    def _process_files_parallel(self, pdf_files: List[str], workers: int) -> List[Dict[str, Any]]:
+        """
+        Process files in a pool of `workers` processes, each with its own orchestrator
+        (and so its own PDFLoader and cleanup pools). LLM requests of all workers share
+        one semaphore per model, so the per-model concurrency limits hold globally.
+        A file that fails, or whose worker dies, is reported as failed without
+        stopping the others. A dying worker breaks the whole pool, so every file lost
+        with it is retried once, alone in a fresh single-process pool: only the file
+        that really crashes its worker fails.
+        """
+        results = {}
+        
+        def fail(pdf_path: str, error: str):
+            filename = os.path.basename(pdf_path)
+            print(f"❌ Error processing {filename}: {error}")
+            self.stats["errors"].append(f"Error processing {filename}: {error}")
+            results[pdf_path] = {"success": False, "filename": filename, "error": error}
+        
+        def run_pool(paths: List[str], pool_size: int, limiters: Dict[str, Any]) -> List[str]:
+            """Process `paths` in a new pool and return the files lost with a crashed worker"""
+            crashed = []
+            with ProcessPoolExecutor(
+                max_workers=pool_size,
+                initializer=_init_worker,
+                initargs=(self._config, limiters)
+            ) as pool:
+                futures = {pool.submit(_process_file_in_worker, pdf_path): pdf_path for pdf_path in paths}
+                for future in as_completed(futures):
+                    pdf_path = futures[future]
+                    try:
+                        result, stats = future.result()
+                    except BrokenProcessPool:
+                        crashed.append(pdf_path)
+                        continue
+                    except Exception as e:
+                        fail(pdf_path, str(e))
+                        continue
+                    self._merge_stats(stats)
+                    results[pdf_path] = result
+            return crashed
+        
+        with multiprocessing.Manager() as manager:
+            limiters = {kind: manager.BoundedSemaphore(limit) for kind, limit in self.concurrency.items()}
+            crashed = run_pool(pdf_files, min(workers, len(pdf_files)), limiters)
+            if crashed:
+                print(f"⚠️ A worker process died, retrying {len(crashed)} file(s) one at a time...")
+            for pdf_path in crashed:
+                if run_pool([pdf_path], 1, limiters):
+                    fail(pdf_path, "worker process died")
+        
+        return [results[pdf_path] for pdf_path in pdf_files]
+    
     def _print_final_summary(self, results: List[Dict], total_time: float):
         """Print final processing summary"""
         successful = [r for r in results if r["success"]]
         failed = [r for r in results if not r["success"]]
         
         print(f"\n{'='*60}")
-        print(f"PIPELINE PROCESSING SUMMARY")
+        print("PIPELINE PROCESSING SUMMARY")
         print(f"{'='*60}")
         print(f"Total files: {len(results)}")
-        print(f"✅ Successful: {len(successful)}")
+        print(f"✅ Successful: {len(successful)} ({self.stats['files_processed']} processed, {self.stats['files_skipped']} skipped as unchanged)")
         print(f"❌ Failed: {len(failed)}")
-        print(f"Total pages processed: {self.stats['total_pages']}")
+        print(f"Total pages processed: {self.stats['total_pages']} ({self.stats['pages_reused']} reused from earlier runs)")
         print(f"Total chunks created: {self.stats['total_chunks']}")
         print(f"Total processing time: {total_time:.2f}s")
+        transform_stats = self.stats["transform"]
+        print(f"Transform throughput: {transform_stats['pages_per_sec']:.2f} pages/s")
+        for kind, wait_stats in transform_stats["queue_wait"].items():
+            print(f"   {kind} model queue wait: avg {wait_stats['avg']:.2f}s, max {wait_stats['max']:.2f}s over {wait_stats['jobs']} jobs")
+        for model, cache_stats in self.stats["llm_cache"].items():
+            print(f"   {model} response cache: {cache_stats['hit_rate']:.0%} hit rate ({cache_stats['hits']} hits, {cache_stats['misses']} misses)")
         print(f"Average time per file: {total_time/len(results):.2f}s")
         
         if successful:
@@ -420,7 +806,7 @@ class DataPipelineOrchestrator:
             print(f"Average chunks per file: {avg_chunks:.1f}")
         
         if failed:
-            print(f"\nFailed files:")
+            print("\nFailed files:")
             for result in failed:
                 print(f"   - {result['filename']}: {result['error']}")
         
@@ -428,18 +814,46 @@ class DataPipelineOrchestrator:
         print(f"{'='*60}")
 
 
+# -------------------------------
+# Worker processes (process_folder with workers > 1)
+# -------------------------------
+_worker_orchestrator = None
+
+
+def _init_worker(config: Dict[str, Any], limiters: Dict[str, Any]):
+    global _worker_orchestrator
+    _worker_orchestrator = DataPipelineOrchestrator(**config, limiters=limiters)
+
+
+def _process_file_in_worker(pdf_path: str):
+    """Process one file in a worker and return its result with the statistics it produced"""
+    _worker_orchestrator.stats = _worker_orchestrator._new_stats()
+    result = _worker_orchestrator.process_file(pdf_path)
+    return result, _worker_orchestrator.stats
+
+
 def main():
     """Main function to run the complete pipeline with specialized models"""
+    parser = argparse.ArgumentParser(description="Run the data pipeline over a folder of PDFs")
+    parser.add_argument("--input", default="/home/melissa-ghemari/estin-chatbot/data-pipeline/sample-data", help="Folder of PDF files")
+    parser.add_argument("--output", default="specialized_pipeline_outputs", help="Output folder")
+    parser.add_argument("--workers", type=int, default=1, help="Files processed in parallel (separate processes)")
+    parser.add_argument("--force", action="store_true", help="Reprocess every file, ignoring the manifest of earlier runs")
+    parser.add_argument("--manifest", default=None, help="Manifest database (default: <output>/manifest.sqlite)")
+    args = parser.parse_args()
+    
     orchestrator = DataPipelineOrchestrator(
         text_model="qwen3:4b",                    
         table_model="qwen3:4b",                   
         image_model="granite3.2-vision:latest",       
-        input_folder="/home/melissa-ghemari/estin-chatbot/data-pipeline/sample-data",
-        output_folder="specialized_pipeline_outputs"
+        input_folder=args.input,
+        output_folder=args.output,
+        force=args.force,
+        manifest_path=args.manifest
     )
     
     # Run the complete pipeline
-    results = orchestrator.process_folder()
+    results = orchestrator.process_folder(workers=args.workers)
     
     return results
 
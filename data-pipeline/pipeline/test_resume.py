@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+
+# Add the current directory to sys.path to import orchestrate
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import orchestrate
+from manifest import file_sha256
+from orchestrate import DataPipelineOrchestrator
+
+
+PAGES = [
+    {"page": 1, "plain_text": "Introduction aux circuits électriques.", "tables": [], "images": []},
+    {"page": 2, "plain_text": "Loi des mailles et loi des nœuds.", "tables": [], "images": []},
+    {"page": 3, "plain_text": "Théorème de Thévenin.", "tables": [{"table": 1, "data": [["R", "U"], ["10", "5"]]}], "images": []},
+]
+
+
+class FakeLoader:
+    def __init__(self, pdf_path: str):
+        self.pdf_path = pdf_path
+
+    def iter_pages(self):
+        for page in PAGES:
+            yield dict(page)
+
+    def close(self):
+        pass
+
+
+class FlakyCleanup:
+    """Stands in for TextCleanup/TableCleanup: fails on the contents listed in `failing`"""
+    failing = set()
+    calls = []
+
+    def __init__(self, text=None, model=None, table_data=None, context=None):
+        self.content = text if table_data is None else table_data
+
+    def process(self):
+        key = str(self.content)
+        FlakyCleanup.calls.append(key)
+        if key in FlakyCleanup.failing:
+            raise RuntimeError("model unavailable")
+        return f"cleaned: {key}" if isinstance(self.content, str) else self.content
+
+
+def run_pipeline(folder: str, pdf_path: str) -> tuple:
+    """Process the file with a new orchestrator, as a new run would; returns (result, orchestrator)"""
+    FlakyCleanup.calls = []
+    orchestrator = DataPipelineOrchestrator(input_folder=folder, output_folder=os.path.join(folder, "out"))
+    try:
+        return orchestrator.process_file(pdf_path), orchestrator
+    finally:
+        orchestrator.manifest.close()
+
+
+def test_fallback_pages_are_retried_on_the_next_run():
+    """Pages where a cleanup step fell back to raw content are not saved, and the file is not marked done"""
+    patched = {"PDFLoader": FakeLoader, "TextCleanup": FlakyCleanup, "TableCleanup": FlakyCleanup}
+    originals = {name: getattr(orchestrate, name) for name in patched}
+    for name, value in patched.items():
+        setattr(orchestrate, name, value)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            pdf_path = os.path.join(folder, "1CP_S2_ELEC_COURS_2024.pdf")
+            with open(pdf_path, "wb") as f:
+                f.write(b"%PDF-1.4 fake")
+            file_hash = file_sha256(pdf_path)
+
+            # First run: page 2's text and page 3's table fall back to their raw content
+            FlakyCleanup.failing = {PAGES[1]["plain_text"], str(PAGES[2]["tables"][0]["data"])}
+            result, orchestrator = run_pipeline(folder, pdf_path)
+            assert result["success"] and result["pages"] == 3
+            assert result["fallback_pages"] == [2, 3]
+            manifest = orchestrate.Manifest(orchestrator.manifest.path, orchestrator._output_config())
+            assert manifest.file_record(file_hash)["status"] == "in_progress"
+            assert manifest.cleaned_page(file_hash, 1) is not None
+            assert manifest.cleaned_page(file_hash, 2) is None
+            assert manifest.cleaned_page(file_hash, 3) is None
+            manifest.close()
+
+            # Second run: the models work again, only the fallback pages are cleaned
+            FlakyCleanup.failing = set()
+            result, orchestrator = run_pipeline(folder, pdf_path)
+            assert result["success"] and not result["skipped"]
+            assert result["pages_reused"] == 1 and result["fallback_pages"] == []
+            assert PAGES[0]["plain_text"] not in FlakyCleanup.calls
+            assert PAGES[1]["plain_text"] in FlakyCleanup.calls
+            assert orchestrator.stats["transform"]["pages"] == 2
+
+            # Third run: the file is done and skipped
+            result, _ = run_pipeline(folder, pdf_path)
+            assert result["skipped"]
+            assert FlakyCleanup.calls == []
+    finally:
+        for name, value in originals.items():
+            setattr(orchestrate, name, value)
+
+
+if __name__ == "__main__":
+    test_fallback_pages_are_retried_on_the_next_run()
+    print("✅ Resume after fallback pages works")
@@ -1,5 +1,6 @@
 import pymupdf
 import base64
+import hashlib
 
 
 class PDFLoader:
@@ -59,24 +60,35 @@ class PDFLoader:
                     "image_id": n + 1,
                     "base64": image_b64,  # Now it's a string, not bytes
                     "ext": img_data["ext"],
+                    "sha256": hashlib.sha256(img_data["image"]).hexdigest(),
                 }
             )
 
         return imgs
 
-    def analyse(self):
+    def iter_pages(self):
         """
-        Analyze the entire PDF document and extract all content.
-        Returns List of dictionaries, one per page, containing: page number, plain text, tables, images
+        Extract the document one page at a time.
+        Yields a dictionary per page containing: page number, plain text, tables, images
         """
-        pages = []
         for p in self.doc:
             text_and_tables = self._extract_texts_tables_from_page(p.number)
-            page_data = {
+            yield {
                 "page": p.number + 1,
                 "plain_text": text_and_tables[0],
                 "tables": text_and_tables[1],
                 "images": self._extract_images_from_page(p.number),
             }
-            pages.append(page_data)
-        return pages
+
+    def page_count(self) -> int:
+        return self.doc.page_count
+
+    def close(self):
+        self.doc.close()
+
+    def analyse(self):
+        """
+        Analyze the entire PDF document and extract all content.
+        Returns List of dictionaries, one per page, containing: page number, plain text, tables, images
+        """
+        return list(self.iter_pages())
@@ -24,6 +24,8 @@ class ImageCleanup:
                 raise ValueError("image 'base64' must be a base64 string representation.")
             self.img = image_data["base64"]
             self.ext = image_data["ext"]
+            # Digest of the image bytes computed by the loader, used as its cache key
+            self.digest = image_data.get("sha256")
         else:
             raise ValueError("Image data must be a dictionary with 'base64' and 'ext' keys.")
 
@@ -48,4 +50,4 @@ class ImageCleanup:
                 "images": [self.img],
             },
         ]
-        return self.model.generate(messages).message.content
+        return self.model.generate(messages, image_digests=[self.digest] if self.digest else None).message.content
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class LLMCache:
+    """
+    Disk-backed cache of model responses, keyed by a hash of (model, messages,
+    options, think). Images are keyed by their digest, so a page image is never
+    re-hashed from its base64 text when the loader already computed one.
+
+    The cache is a SQLite file shared by every process and thread using it. Once
+    it grows past `max_bytes`, the least recently used responses are evicted down
+    to 90% of the limit. Hits and misses are counted per model (for this process).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._size = 0
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["LLMCache"]:
+        """The cache configured by LLM_CACHE_ENABLED / LLM_CACHE_PATH / LLM_CACHE_MAX_MB, or None when disabled"""
+        if os.getenv("LLM_CACHE_ENABLED", "true").lower() != "true":
+            return None
+        path = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".cache", "estin-chat", "llm_cache.sqlite"))
+        return cls(path, int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024))
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked worker processes: reopen after a fork
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+            self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], options: Dict[str, Any], think: Any, image_digests: List[str] = None) -> str:
+        digests = iter(image_digests or [])
+        keyed_messages = []
+        for message in messages:
+            message = dict(message)
+            if message.get("images"):
+                message["images"] = [
+                    next(digests, None) or hashlib.sha256(str(image).encode()).hexdigest()
+                    for image in message["images"]
+                ]
+            keyed_messages.append(message)
+        payload = {"model": model, "messages": keyed_messages, "options": options, "think": think}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+
+    def _count(self, model: str, outcome: str):
+        counters = self._counters.setdefault(model, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    def get(self, key: str, model: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(model, "misses")
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self._count(model, "hits")
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        size = len(response.encode())
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, model, response, size, time.time()))
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop least recently used responses until the cache is back under 90% of its limit"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        if total > target:
+            doomed = []
+            for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                if total <= target:
+                    break
+                doomed.append((key,))
+                total -= size
+            with conn:
+                conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        self._size = total
+
+    def counters(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {model: dict(counts) for model, counts in self._counters.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate per model, plus the size of the cache on disk"""
+        per_model = {
+            model: {**counts, "hit_rate": counts["hits"] / (counts["hits"] + counts["misses"]) if counts["hits"] + counts["misses"] else 0.0}
+            for model, counts in self.counters().items()
+        }
+        return {"path": self.path, "size_bytes": self._size, "max_bytes": self.max_bytes, "models": per_model}
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache() -> Optional[LLMCache]:
+    """The process-wide cache used by every Model by default (see LLMCache.from_env)"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMCache.from_env() or False
+        return _shared_cache or None
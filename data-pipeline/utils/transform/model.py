@@ -1,6 +1,11 @@
 ﻿from ollama import Client, ChatResponse
 from dataclasses import dataclass
 
+try:
+    from .llm_cache import LLMCache, shared_cache
+except ImportError:  # imported as a top-level module (transform/ on sys.path)
+    from llm_cache import LLMCache, shared_cache
+
 
 @dataclass
 class ModelParams:
@@ -14,9 +19,14 @@ class ModelParams:
 
 
 class Model:
-    def __init__(self, params: ModelParams):
+    def __init__(self, params: ModelParams, limiter=None, cache: LLMCache | bool | None = None):
         self.params = params
         self.base = Client(host=self.params.host)
+        # Optional semaphore-like context manager shared by every Model calling the same
+        # server (possibly across processes), capping the requests in flight
+        self.limiter = limiter
+        # Response cache: None uses the shared on-disk cache (LLM_CACHE_* settings), False disables it
+        self.cache = shared_cache() if cache is None else (cache or None)
 
     def _get_valid_params(self):
         return {
@@ -29,7 +39,30 @@ class Model:
             if v is not None
         }
 
-    def generate(self, prompts) -> ChatResponse:
+    def generate(self, prompts, image_digests: list[str] | None = None) -> ChatResponse:
+        """
+        Chat with the model, answering from the response cache when the same request
+        was already made. `image_digests` (one per image in `prompts`, in order) are
+        used in the cache key instead of hashing the base64 images.
+        """
+        if self.cache is None:
+            return self._limited_chat(prompts)
+
+        key = LLMCache.make_key(self.params.model, prompts, self._get_valid_params(), self.params.think, image_digests)
+        cached = self.cache.get(key, self.params.model)
+        if cached is not None:
+            return ChatResponse.model_validate_json(cached)
+        response = self._limited_chat(prompts)
+        self.cache.put(key, self.params.model, response.model_dump_json())
+        return response
+
+    def _limited_chat(self, prompts) -> ChatResponse:
+        if self.limiter is None:
+            return self._chat(prompts)
+        with self.limiter:
+            return self._chat(prompts)
+
+    def _chat(self, prompts) -> ChatResponse:
         return self.base.chat(
             model=self.params.model,
             messages=prompts,
@@ -25,8 +25,15 @@ schema = MilvusClient.create_schema()
 
 # Add fields to schema
 schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True, auto_id=True)
-schema.add_field(field_name="chunk", datatype=DataType.VARCHAR, max_length=512)
+schema.add_field(
+    field_name="chunk",
+    datatype=DataType.VARCHAR,
+    max_length=512,
+    enable_analyzer=True,  # tokenized for the BM25 function below
+    analyzer_params={"type": "standard"},
+)
 schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=1024)
+schema.add_field(field_name="sparse_vector", datatype=DataType.SPARSE_FLOAT_VECTOR)
 schema.add_field(field_name="level", datatype=DataType.VARCHAR, max_length=3)
 schema.add_field(field_name="semester", datatype=DataType.VARCHAR, max_length=2)
 schema.add_field(field_name="year_of_study", datatype=DataType.INT16)
@@ -65,6 +72,15 @@ embedding_function = Function(
 )
 schema.add_function(embedding_function)
 
+# Add BM25 function (full-text search on exact codes and formula names)
+bm25_function = Function(
+    name="chunk-bm25",
+    function_type=FunctionType.BM25,
+    input_field_names=["chunk"],
+    output_field_names=["sparse_vector"],
+)
+schema.add_function(bm25_function)
+
 # Indexing
 # Prepare index parameters
 index_params = client.prepare_index_params()
@@ -79,6 +95,13 @@ index_params.add_index(
     metric_type="COSINE",  # cosine score for similarity search
 )
 
+index_params.add_index(
+    field_name="sparse_vector",
+    index_name="sparse_bm25_index",
+    index_type="SPARSE_INVERTED_INDEX",
+    metric_type="BM25",
+)
+
 for field in [
     "level",
     "semester",
@@ -29,6 +29,10 @@ schema.add_field(
     field_name="chunk",
     datatype=DataType.VARCHAR,
     max_length=500,
+    enable_analyzer=True,  # tokenized for the BM25 function below
+    analyzer_params={
+        "type": "standard",  # course material mixes french and english
+    },
     description="Small piece of text from the original document",
 )
 schema.add_field(
@@ -37,6 +41,11 @@ schema.add_field(
     dim=768,
     description="Vector embedding of the text chunk",
 )
+schema.add_field(
+    field_name="sparse_vector",
+    datatype=DataType.SPARSE_FLOAT_VECTOR,
+    description="BM25 sparse representation of the text chunk",
+)
 schema.add_field(
     field_name="level",
     datatype=DataType.VARCHAR,
@@ -107,6 +116,16 @@ embedding_function = Function(
 )
 schema.add_function(embedding_function)
 
+# Add BM25 function (full-text search on exact codes and formula names)
+bm25_function = Function(
+    name="chunk-bm25",
+    function_type=FunctionType.BM25,
+    description="BM25 sparse vectors for text chunks",
+    input_field_names=["chunk"],
+    output_field_names=["sparse_vector"],
+)
+schema.add_function(bm25_function)
+
 
 # Indexing
 # Prepare index parameters
@@ -124,6 +143,14 @@ index_params.add_index(
     metric_type="COSINE",  # cosine score for similarity search
 )
 
+index_params.add_index(
+    field_name="sparse_vector",
+    index_name="sparse_bm25_index",
+    index_type="SPARSE_INVERTED_INDEX",
+    metric_type="BM25",
+    params={"inverted_index_algo": "DAAT_MAXSCORE"},
+)
+
 for field in [
     "level",
     "semester",
@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class StageLimiter:
+    """
+    Caps how many requests run one stage of the chain at a time (e.g. LLM slots
+    matching vLLM's max-num-seqs), so excess requests wait here instead of piling
+    up on the server. Waiting time and busy/waiting counts go to the metrics
+    registry as `stage_wait{stage}` and the `stage_active`/`stage_waiting` gauges;
+    `on_wait(seconds)` is also called with each waiting time.
+    """
+
+    def __init__(self, name: str, limit: int, metrics, on_wait=None):
+        self.name = name
+        self.limit = limit
+        self.metrics = metrics
+        self.on_wait = on_wait
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+
+    def _publish(self):
+        self.metrics.set_gauge("stage_active", self.active, stage=self.name)
+        self.metrics.set_gauge("stage_waiting", self.waiting, stage=self.name)
+
+    def __enter__(self):
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+            self._publish()
+        try:
+            self._semaphore.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self._publish()
+        with self._lock:
+            self.active += 1
+            self._publish()
+        wait = time.perf_counter() - start
+        self.metrics.observe("stage_wait", wait, stage=self.name)
+        if self.on_wait is not None:
+            self.on_wait(wait)
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.active -= 1
+            self._publish()
+        self._semaphore.release()
+        return False
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"limit": self.limit, "active": self.active, "waiting": self.waiting}
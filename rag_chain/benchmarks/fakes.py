@@ -0,0 +1,236 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+
+import numpy as np
+
+from llm_backend import BackendError, BackendParams, ChatResult, LLMBackend
+
+
+# Stand-ins for Milvus, the TEI server and the LLM servers, used by the load test
+# to exercise the chain's own overhead and concurrency without the real services.
+
+FILTER_CONDITION = re.compile(r'(\w+)\s*==\s*"([^"]*)"')
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def fake_embedding(text: str, dim: int = 64) -> np.ndarray:
+    """Deterministic hashed bag-of-words vector, so similar texts get similar vectors."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dim] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def synthetic_corpus(size: int = 500, seed: int = 0) -> list:
+    """Chunks spread over a few subjects/levels, shaped like the rows of `estin_docs`."""
+    rng = random.Random(seed)
+    subjects = {
+        "ELEC": ("1CP", "S2", ["circuit", "impédance", "Kirchhoff", "Thevenin", "condensateur", "bobine", "tension", "courant"]),
+        "ALG": ("1CP", "S1", ["matrice", "déterminant", "espace vectoriel", "valeur propre", "base", "rang"]),
+        "ASDS": ("1CP", "S1", ["algorithme", "pile", "file", "liste chaînée", "complexité", "tri"]),
+        "SE": ("2CS", "S1", ["processus", "thread", "ordonnancement", "sémaphore", "mémoire", "pagination"]),
+        "BDD": ("2CS", "S2", ["SQL", "relation", "normalisation", "jointure", "clé primaire", "index"]),
+    }
+    corpus = []
+    for i in range(size):
+        code = rng.choice(sorted(subjects))
+        level, semester, terms = subjects[code]
+        words = rng.choices(terms, k=12)
+        corpus.append({
+            "id": i,
+            "chunk": f"{code} — " + " ".join(f"La notion de {w} est définie dans ce cours." for w in words[:6]),
+            "title": f"{code} cours",
+            "page": rng.randint(1, 40),
+            "level": level,
+            "semester": semester,
+            "subject_code": code,
+        })
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    """Read chunks (one JSON object per line with the `estin_docs` scalar fields)."""
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    for i, row in enumerate(rows):
+        row.setdefault("id", i)
+    return rows
+
+
+class _FakeIterator:
+    def __init__(self, rows: list, batch_size: int):
+        self.rows = rows
+        self.batch_size = batch_size
+        self.offset = 0
+
+    def next(self) -> list:
+        batch = self.rows[self.offset:self.offset + self.batch_size]
+        self.offset += self.batch_size
+        return batch
+
+    def close(self):
+        pass
+
+
+class FakeMilvusClient:
+    """
+    In-memory replacement for the `MilvusClient` calls the chain makes.
+
+    Searches accept query texts (server-side embedding) or vectors, support the
+    `field == "value"` filters built by `build_milvus_filter`, and sleep for
+    `search_latency` seconds to model the network round trip.
+    """
+
+    def __init__(self, corpus: list, collection_name: str = "estin_docs", search_latency: float = 0.005, dim: int = 64):
+        self.collection_name = collection_name
+        self.search_latency = search_latency
+        self.dim = dim
+        self.rows = [dict(row, vector=fake_embedding(row["chunk"], dim)) for row in corpus]
+        self.matrix = np.stack([row["vector"] for row in self.rows]) if self.rows else np.zeros((0, dim))
+
+    # ----- collection management -----
+
+    def list_collections(self) -> list:
+        return [self.collection_name]
+
+    def describe_collection(self, collection_name: str, **kwargs) -> dict:
+        fields = ["id", "chunk", "title", "page", "level", "semester", "subject_code", "vector", "sparse_vector"]
+        return {"collection_name": collection_name, "collection_id": 1, "fields": [{"name": name} for name in fields]}
+
+    def get_collection_stats(self, collection_name: str, **kwargs) -> dict:
+        return {"row_count": len(self.rows)}
+
+    def get_load_state(self, collection_name: str) -> dict:
+        return {"state": "<LoadState: Loaded>"}
+
+    def load_collection(self, collection_name: str):
+        pass
+
+    # ----- queries -----
+
+    def _matches(self, expr: str | None) -> np.ndarray:
+        mask = np.ones(len(self.rows), dtype=bool)
+        for name, value in FILTER_CONDITION.findall(expr or ""):
+            mask &= np.array([str(row.get(name)) == value for row in self.rows], dtype=bool)
+        return mask
+
+    def _select(self, row: dict, output_fields: list | None) -> dict:
+        fields = output_fields or [name for name in row if name not in ("id", "vector")]
+        return {name: row.get(name) for name in fields}
+
+    def _search_one(self, query, expr: str | None, limit: int, output_fields: list | None) -> list:
+        vector = fake_embedding(query, self.dim) if isinstance(query, str) else np.asarray(query, dtype=np.float32)[: self.dim]
+        scores = np.where(self._matches(expr), self.matrix @ vector, -np.inf)
+        order = np.argsort(-scores)[:limit]
+        return [
+            {"id": self.rows[i]["id"], "distance": float(scores[i]), "entity": self._select(self.rows[i], output_fields)}
+            for i in order
+            if np.isfinite(scores[i])
+        ]
+
+    def search(self, collection_name: str, data: list, anns_field: str = None, filter: str = "", output_fields: list = None, limit: int = 10, **kwargs) -> list:
+        time.sleep(self.search_latency)
+        return [self._search_one(query, filter, limit, output_fields) for query in data]
+
+    def hybrid_search(self, collection_name: str, reqs: list, ranker=None, output_fields: list = None, limit: int = 10, **kwargs) -> list:
+        # Dense and sparse sub-searches would rank the same way here: run the first one
+        time.sleep(self.search_latency)
+        request = reqs[0]
+        return [self._search_one(query, request.expr, limit, output_fields) for query in request.data]
+
+    def query(self, collection_name: str, filter: str = "", output_fields: list = None, limit: int = None, **kwargs) -> list:
+        rows = [row for row, keep in zip(self.rows, self._matches(filter)) if keep][:limit]
+        return [dict(self._select(row, output_fields), id=row["id"]) for row in rows]
+
+    def query_iterator(self, collection_name: str, batch_size: int = 1000, filter: str = "", output_fields: list = None, **kwargs) -> _FakeIterator:
+        return _FakeIterator(self.query(collection_name, filter, output_fields), batch_size)
+
+
+class FakeEmbeddingClient:
+    """Replacement for the TEI `InferenceClient`, returning `fake_embedding` vectors."""
+
+    def __init__(self, latency: float = 0.01, dim: int = 64):
+        self.latency = latency
+        self.dim = dim
+
+    def feature_extraction(self, text, **kwargs) -> np.ndarray:
+        time.sleep(self.latency)
+        texts = [text] if isinstance(text, str) else list(text)
+        return np.stack([fake_embedding(t, self.dim) for t in texts])
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    LLM backend that answers with canned text at a configurable speed.
+
+    Each call waits `ttft` seconds before the first token and `token_latency` seconds
+    per following token, at most `max_concurrency` calls run at once (like vLLM's
+    max-num-seqs), and a fraction `error_rate` of calls fails with a BackendError.
+    """
+
+    def __init__(
+        self,
+        reply: str = None,
+        ttft: float = 0.2,
+        token_latency: float = 0.02,
+        max_tokens: int = 64,
+        max_concurrency: int = 5,
+        error_rate: float = 0.0,
+        model: str = "fake",
+    ):
+        super().__init__(BackendParams(kind="fake", base_url="fake://", model=model, max_retries=0, max_concurrency=max_concurrency))
+        self.reply = reply
+        self.ttft = ttft
+        self.token_latency = token_latency
+        self.max_tokens = max_tokens
+        self.error_rate = error_rate
+
+    def _ensure_client(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.params.max_concurrency)
+
+    def _tokens(self, max_tokens: int | None) -> list:
+        if self.reply is not None:
+            return [self.reply]
+        count = min(self.max_tokens, max_tokens or self.max_tokens)
+        return [f"token{i} " for i in range(count)]
+
+    def _maybe_fail(self):
+        if self.error_rate and random.random() < self.error_rate:
+            error = BackendError("fake backend error")
+            error.retryable = False
+            raise error
+
+    async def achat(self, messages: list, max_tokens: int = None, temperature: float = None, json_schema: dict = None) -> ChatResult:
+        self._ensure_client()
+        tokens = self._tokens(max_tokens)
+        async with self._semaphore:
+            await asyncio.sleep(self.ttft + self.token_latency * (len(tokens) - 1))
+            self._maybe_fail()
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        return ChatResult(content="".join(tokens), prompt_tokens=prompt_tokens, completion_tokens=len(tokens))
+
+    async def astream(self, messages: list, max_tokens: int = None, temperature: float = None):
+        self._ensure_client()
+        tokens = self._tokens(max_tokens)
+        async with self._semaphore:
+            await asyncio.sleep(self.ttft)
+            self._maybe_fail()
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(self.token_latency)
+                yield {"content": token, "done": False, "prompt_tokens": None, "completion_tokens": None}
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        yield {"content": "", "done": True, "prompt_tokens": prompt_tokens, "completion_tokens": len(tokens)}
+
+    async def awarmup(self):
+        pass
+
+    async def aclose(self):
+        pass
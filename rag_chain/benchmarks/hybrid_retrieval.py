@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# Allow running the benchmark directly and import the RAG chain next to it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_pipeline_v2 as rag
+from stats import summarize
+
+
+def load_qrels(path: str) -> list:
+    """
+    Read relevance judgements, one JSON object per line:
+    {"query": "...", "relevant_ids": [...], "filters": {...}}  (filters optional)
+    """
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(qrels: list, mode: str, k: int, runs: int) -> dict:
+    latencies = []
+    recalls = []
+    for _ in range(runs):
+        for item in qrels:
+            relevant = set(item["relevant_ids"])
+            start = time.perf_counter()
+            hits = rag.search_hits(item["query"], item.get("filters"), k, mode=mode)
+            latencies.append(time.perf_counter() - start)
+            found = {hit["id"] for hit in hits}
+            recalls.append(len(found & relevant) / len(relevant) if relevant else 0.0)
+    return {"recall": sum(recalls) / len(recalls), **summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare recall@k and latency of dense-only and hybrid retrieval")
+    parser.add_argument("qrels", help="JSONL file with queries and the ids of their relevant chunks")
+    parser.add_argument("-k", type=int, nargs="+", default=[3, 5, 10], help="Cut-offs to evaluate")
+    parser.add_argument("--runs", type=int, default=3, help="Passes over the query set (latency only)")
+    args = parser.parse_args()
+
+    qrels = load_qrels(args.qrels)
+    print(f"Evaluating {len(qrels)} queries, ranker: {rag.HYBRID_RANKER}")
+
+    print(f"\n{'='*72}")
+    print(f"{'mode':>8} {'k':>4} {'recall@k':>10} {'p50 ms':>10} {'p95 ms':>10} {'mean ms':>10}")
+    for k in args.k:
+        for mode in ("dense", "hybrid"):
+            result = evaluate(qrels, mode, k, args.runs)
+            print(
+                f"{mode:>8} {k:>4} {result['recall']:>10.3f} {result['p50']*1000:>10.1f} "
+                f"{result['p95']*1000:>10.1f} {result['mean']*1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Allow running the benchmark directly and import the RAG chain next to it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_pipeline_v2 as rag
+from fakes import FakeEmbeddingClient, FakeLLMBackend, FakeMilvusClient, load_corpus, synthetic_corpus
+from metrics import metrics
+from stats import summarize
+
+
+# The default query mix is generated from these, so that (like real traffic) few
+# requests repeat a question another request is already asking
+QUERY_TEMPLATES = [
+    "Comment calculer {a} ?",
+    "Qu'est-ce que {a} ?",
+    "Expliquer le lien entre {a} et {b}",
+    "Donner un exemple de {a} avec {b}",
+    "What is the difference between {a} and {b}?",
+    "Exercice : {a}, {b} et {c}, par où commencer ?",
+    "Pourquoi utilise-t-on {a} dans ce cours ?",
+]
+QUERY_TERMS = [
+    "un circuit RLC", "l'impédance", "les lois de Kirchhoff", "le théorème de Thevenin", "un condensateur",
+    "une bobine", "la tension", "le courant", "une matrice", "le déterminant", "un espace vectoriel",
+    "une valeur propre", "une base", "le rang", "un algorithme", "une pile", "une file", "une liste chaînée",
+    "la complexité", "le tri", "un processus", "un thread", "l'ordonnancement", "un sémaphore", "la mémoire",
+    "la pagination", "SQL", "une relation", "la normalisation", "une jointure", "une clé primaire", "un index",
+]
+
+
+def generate_query_mix(size: int, rng: random.Random) -> list:
+    """`size` distinct queries built from QUERY_TEMPLATES and QUERY_TERMS, all weighted 1."""
+    queries = set()
+    while len(queries) < size:
+        a, b, c = rng.sample(QUERY_TERMS, 3)
+        queries.add(rng.choice(QUERY_TEMPLATES).format(a=a, b=b, c=c))
+    return [(query, 1.0) for query in sorted(queries)]
+
+
+def load_query_mix(path: str) -> list:
+    """
+    Read a query mix: one query per line, optionally prefixed by a weight and a tab
+    ("3\\tWhat is a semaphore?" is sent three times as often as an unweighted line).
+    """
+    mix = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            weight, _, query = line.partition("\t")
+            if query and weight.strip().replace(".", "", 1).isdigit():
+                mix.append((query.strip(), float(weight)))
+            else:
+                mix.append((line.strip(), 1.0))
+    return mix
+
+
+def install_fakes(args):
+    """Swap the chain's Milvus, TEI and LLM clients for local stand-ins, as selected."""
+    if args.milvus == "fake":
+        corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.corpus_size, args.seed)
+        rag._milvus_client = FakeMilvusClient(corpus, rag.COLLECTION_NAME, search_latency=args.search_latency)
+    elif args.milvus_uri:
+        # A Milvus server URL or a local Milvus Lite file (e.g. ./estin_docs.db)
+        rag.MILVUS_HOST = args.milvus_uri
+
+    if args.embedding == "fake":
+        rag.embedding_client = FakeEmbeddingClient(latency=args.embed_latency)
+        rag.query_embedder.client = rag.embedding_client
+
+    if args.llm == "fake":
+        rag.classifier_llm = FakeLLMBackend(
+            reply="{}",
+            ttft=args.classifier_latency,
+            max_concurrency=args.llm_slots,
+            error_rate=args.llm_error_rate,
+        )
+        rag.generator_llm = FakeLLMBackend(
+            ttft=args.ttft,
+            token_latency=args.token_latency,
+            max_tokens=args.answer_tokens,
+            max_concurrency=args.llm_slots,
+            error_rate=args.llm_error_rate,
+        )
+
+
+def stage_report(snapshot: dict) -> dict:
+    """Pick the per-stage and per-request latency summaries out of a metrics snapshot."""
+    return {
+        name: {key: summary[key] for key in ("count", "p50", "p95", "p99")}
+        for name, summary in snapshot["latency_seconds"].items()
+        if name.startswith(("stage{", "request{"))
+    }
+
+
+def run_level(queries: list, weights: list, concurrency: int, requests: int, rng: random.Random) -> dict:
+    """Send `requests` queries through `rag_respond` with `concurrency` in flight."""
+    metrics.reset()
+    rag.answer_cache.clear()
+    rag.query_embedder.clear()
+    sample = rng.choices(queries, weights=weights, k=requests)
+
+    def one(query: str):
+        start = time.perf_counter()
+        try:
+            rag.rag_respond(query)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, sample))
+    wall_time = time.perf_counter() - start
+
+    latencies = [latency for latency, error in outcomes if error is None]
+    errors = [error for _, error in outcomes if error is not None]
+    snapshot = metrics.snapshot()
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "wall_time": wall_time,
+        "throughput_rps": requests / wall_time if wall_time else None,
+        "errors": len(errors),
+        "error_rate": len(errors) / requests if requests else 0.0,
+        "error_samples": sorted(set(errors))[:5],
+        "distinct_queries": len(set(sample)),
+        "coalesced": sum(value for name, value in snapshot["counters"].items() if name.startswith("coalescing{") and 'outcome="joined"' in name),
+        "latency": summarize(latencies),
+        "stages": stage_report(snapshot),
+        "counters": snapshot["counters"],
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test rag_respond against real services or local stand-ins")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16], help="Concurrent requests per level")
+    parser.add_argument("--requests", type=int, default=100, help="Requests sent per concurrency level")
+    parser.add_argument("--queries", metavar="FILE", help="Query mix: one query per line, optionally 'weight<TAB>query'")
+    parser.add_argument("--query-count", type=int, default=1000, help="Distinct generated queries when no --queries file is given")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--semantic-cache", action="store_true", help="Keep the semantic answer cache on (off by default)")
+    parser.add_argument("--coalesce", action="store_true", help="Keep request coalescing on (off by default: duplicates would share one run)")
+    parser.add_argument("--output", metavar="FILE", help="Write the results as JSON")
+
+    services = parser.add_argument_group("services")
+    services.add_argument("--milvus", choices=["real", "fake"], default="fake")
+    services.add_argument("--milvus-uri", help="With --milvus real: server URL or Milvus Lite file (default MILVUS_HOST)")
+    services.add_argument("--embedding", choices=["real", "fake"], default="fake")
+    services.add_argument("--llm", choices=["real", "fake"], default="fake")
+
+    fakes = parser.add_argument_group("stand-ins")
+    fakes.add_argument("--corpus", metavar="FILE", help="JSONL chunks for the fake Milvus (default: synthetic)")
+    fakes.add_argument("--corpus-size", type=int, default=500, help="Size of the synthetic corpus")
+    fakes.add_argument("--search-latency", type=float, default=0.005, help="Fake Milvus search time (s)")
+    fakes.add_argument("--embed-latency", type=float, default=0.01, help="Fake TEI embedding time (s)")
+    fakes.add_argument("--classifier-latency", type=float, default=0.3, help="Fake classifier call time (s)")
+    fakes.add_argument("--ttft", type=float, default=0.2, help="Fake generator time to first token (s)")
+    fakes.add_argument("--token-latency", type=float, default=0.02, help="Fake generator time per token (s)")
+    fakes.add_argument("--answer-tokens", type=int, default=64, help="Tokens per fake answer")
+    fakes.add_argument("--llm-slots", type=int, default=5, help="Concurrent fake LLM calls (vLLM max-num-seqs)")
+    fakes.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction of fake LLM calls that fail")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.queries:
+        mix = load_query_mix(args.queries)
+    else:
+        mix = generate_query_mix(args.query_count, rng)
+    queries, weights = [q for q, _ in mix], [w for _, w in mix]
+
+    install_fakes(args)
+    rag.SEMANTIC_CACHE_ENABLED = args.semantic_cache
+    rag.COALESCE_REQUESTS = args.coalesce
+
+    print("Warming up...")
+    with contextlib.redirect_stdout(io.StringIO()):
+        warmup = rag.warmup()
+
+    results = []
+    for concurrency in args.concurrency:
+        print(f"▶️ {args.requests} requests at concurrency {concurrency}...")
+        # The chain logs every step; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_level(queries, weights, concurrency, args.requests, rng)
+        results.append(result)
+        latency = result["latency"]
+        p50 = f"{latency['p50']*1000:8.1f}" if latency["p50"] is not None else "     n/a"
+        p95 = f"{latency['p95']*1000:8.1f}" if latency["p95"] is not None else "     n/a"
+        print(
+            f"   {result['throughput_rps']:6.2f} req/s | p50 {p50} ms | p95 {p95} ms | errors {result['error_rate']:.1%}"
+            f" | {result['distinct_queries']} distinct queries, {result['coalesced']:.0f} coalesced"
+        )
+
+    print(f"\n{'='*60}")
+    for result in results:
+        print(f"Concurrency {result['concurrency']} — per-stage latency (ms):")
+        for name, summary in result["stages"].items():
+            print(f"  {name:<32} n={summary['count']:<5} p50 {summary['p50']*1000:8.1f} | p95 {summary['p95']*1000:8.1f} | p99 {summary['p99']*1000:8.1f}")
+
+    if args.output:
+        report = {
+            "timestamp": time.time(),
+            "commit": git_commit(),
+            "config": vars(args),
+            "warmup": warmup,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
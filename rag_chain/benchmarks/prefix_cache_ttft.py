@@ -0,0 +1,98 @@
+import argparse
+import os
+import sys
+import time
+import uuid
+
+# Allow running the benchmark directly and import the RAG chain next to it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import prompts
+from llm_backend import BackendParams, create_backend
+from stats import summarize
+
+
+DEFAULT_QUESTIONS = [
+    "Comment calculer l'impédance d'un circuit RLC série ?",
+    "Énoncer les lois de Kirchhoff",
+    "What is the Thevenin equivalent of a circuit?",
+    "Comment déterminer la puissance active et réactive ?",
+    "Quelle est la différence entre un condensateur et une bobine ?",
+]
+
+# Stand-in for the retrieved documents, so the variable tail has a realistic size
+SAMPLE_CONTEXT = "\n\n".join(
+    f"[Electricité, p.{page}] Dans un circuit RLC série, l'impédance complexe vaut Z = R + j(Lω - 1/(Cω)). "
+    "Le module |Z| dépend de la pulsation et la résonance est atteinte lorsque Lω = 1/(Cω)."
+    for page in range(1, 6)
+)
+
+SAMPLE_FILTER_FIELDS = {
+    "level": ["1CP", "2CP", "1CS", "2CS", "3CS"],
+    "semester": ["S1", "S2"],
+    "subject_code": sorted(["ALG", "ANA", "ARCHI", "ASDS", "BDD", "ELEC", "ELECTRO", "GL", "LOG", "MEC", "POO", "PROBA", "RO", "RX", "SE", "SFSD", "SI"]),
+}
+
+
+def build_messages(kind: str, question: str, cold: bool) -> list:
+    if kind == "answer":
+        messages = prompts.answer_messages(SAMPLE_CONTEXT, question)
+    else:
+        messages = prompts.classifier_messages(question, SAMPLE_FILTER_FIELDS)
+    if cold:
+        # A unique first token invalidates every cached block of the prefix
+        messages[0] = {"role": "system", "content": f"[{uuid.uuid4().hex}] {messages[0]['content']}"}
+    return messages
+
+
+def time_to_first_token(backend, messages: list) -> float:
+    start = time.perf_counter()
+    first_token = None
+    # Read the (short) answer to the end so the next request starts on an idle server
+    for part in backend.stream(messages, max_tokens=8, temperature=0.0):
+        if first_token is None and (part["content"] or part["done"]):
+            first_token = time.perf_counter() - start
+    return first_token if first_token is not None else time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare time-to-first-token with a cold and a warm prompt prefix")
+    parser.add_argument("--base-url", default=os.getenv("GENERATOR_BASE_URL", "http://localhost:8000"), help="OpenAI-compatible server (e.g. vLLM)")
+    parser.add_argument("--model", default=os.getenv("GENERATOR_MODEL", "Qwen/Qwen3-1.7B"))
+    parser.add_argument("--api-key", default=os.getenv("GENERATOR_API_KEY"))
+    parser.add_argument("--prompt", choices=["answer", "classifier"], default="answer", help="Which prompt layout to send")
+    parser.add_argument("--runs", type=int, default=5, help="Passes over the question set per mode")
+    args = parser.parse_args()
+
+    backend = create_backend(BackendParams(
+        kind="openai",
+        base_url=args.base_url,
+        model=args.model,
+        api_key=args.api_key,
+        max_concurrency=1,
+        think=False,
+    ))
+
+    # Load the model and put the static prefix in the cache once
+    backend.chat(build_messages(args.prompt, DEFAULT_QUESTIONS[0], cold=False), max_tokens=1)
+
+    report = {}
+    for mode, cold in (("cold", True), ("warm", False)):
+        latencies = [
+            time_to_first_token(backend, build_messages(args.prompt, question, cold))
+            for _ in range(args.runs)
+            for question in DEFAULT_QUESTIONS
+        ]
+        report[mode] = summarize(latencies)
+
+    print(f"\n{'='*60}")
+    print(f"TTFT, '{args.prompt}' prompt, {len(DEFAULT_QUESTIONS)} questions x {args.runs} runs against {args.base_url}")
+    for mode, stats in report.items():
+        print(f"{mode:>6}: p50 {stats['p50']*1000:8.1f} ms | p95 {stats['p95']*1000:8.1f} ms | mean {stats['mean']*1000:8.1f} ms")
+    gain = report["cold"]["p50"] - report["warm"]["p50"]
+    print(f"p50 saved by prefix reuse: {gain*1000:.1f} ms ({gain / report['cold']['p50']:.0%})")
+    print("(the server must have prefix caching enabled, e.g. vLLM's enable-prefix-caching)")
+
+
+if __name__ == "__main__":
+    main()
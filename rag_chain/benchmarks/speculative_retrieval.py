@@ -0,0 +1,82 @@
+import argparse
+import os
+import sys
+import time
+
+# Allow running the benchmark directly and import the RAG chain next to it
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rag_pipeline_v2 as rag
+from stats import summarize
+
+
+# No course name or keyword: the local router is unsure, so these reach the LLM
+# classifier, whose latency speculative retrieval is meant to hide
+DEFAULT_QUERIES = [
+    "Peux-tu m'expliquer la méthode vue en cours pour ce genre d'exercice ?",
+    "Quelle est la démarche à suivre pour résoudre l'exercice 3 du TD ?",
+    "What are the main points to revise before the exam?",
+    "Comment justifier ce résultat dans une copie d'examen ?",
+    "Donne-moi un exemple simple pour comprendre cette notion",
+]
+
+
+def run_pass(queries: list, speculative: bool, with_generation: bool) -> list:
+    # Start cold: otherwise the second mode would reuse the query vectors of the first
+    rag.query_embedder.clear()
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        if with_generation:
+            rag.rag_respond(query, speculative=speculative)
+        else:
+            rag.prepare_context(query, speculative=speculative)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial and speculative retrieval latency")
+    parser.add_argument("--queries", metavar="FILE", help="Text file with one query per line")
+    parser.add_argument("--runs", type=int, default=3, help="Passes over the query set per mode")
+    parser.add_argument("--with-generation", action="store_true", help="Include answer generation (end-to-end)")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    # Repeated queries would otherwise be answered from the semantic cache
+    rag.SEMANTIC_CACHE_ENABLED = False
+
+    # Count the queries the local router could not settle
+    classifier_calls = []
+    classify = rag.classify_query_filters
+
+    def counting_classify(query: str) -> dict:
+        classifier_calls.append(query)
+        return classify(query)
+
+    rag.classify_query_filters = counting_classify
+
+    # Alternate which mode goes first, so neither always runs against warmer services
+    modes = [("serial", False), ("speculative", True)]
+    latencies = {mode: [] for mode, _ in modes}
+    for i in range(args.runs):
+        for mode, speculative in (modes if i % 2 == 0 else modes[::-1]):
+            latencies[mode] += run_pass(queries, speculative, args.with_generation)
+    report = {mode: summarize(values) for mode, values in latencies.items()}
+
+    print(f"\n{'='*60}")
+    print(f"{len(queries)} queries x {args.runs} runs ({'end-to-end' if args.with_generation else 'classify + retrieve'})")
+    print(f"LLM classifier reached by {len(classifier_calls)}/{2 * len(queries) * args.runs} requests")
+    for mode, stats in report.items():
+        print(f"{mode:>12}: p50 {stats['p50']*1000:8.1f} ms | p95 {stats['p95']*1000:8.1f} ms | mean {stats['mean']*1000:8.1f} ms")
+    for stat in ("p50", "p95"):
+        gain = report["serial"][stat] - report["speculative"][stat]
+        print(f"{stat} improvement: {gain*1000:.1f} ms ({gain / report['serial'][stat]:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import threading
+
+
+class TokenCounter:
+    """
+    Counts tokens with the serving model's tokenizer (a Hugging Face `tokenizers`
+    model id or local tokenizer.json). Falls back to a characters/4 estimate when the
+    tokenizer cannot be loaded, so packing still works without the dependency.
+    """
+
+    def __init__(self, tokenizer_name: str | None):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.tokenizer_name:
+                return
+            try:
+                from tokenizers import Tokenizer
+
+                if self.tokenizer_name.endswith(".json"):
+                    self._tokenizer = Tokenizer.from_file(self.tokenizer_name)
+                else:
+                    self._tokenizer = Tokenizer.from_pretrained(self.tokenizer_name)
+            except Exception as e:
+                print(f"⚠️ Could not load tokenizer '{self.tokenizer_name}', estimating token counts: {e}")
+
+    def __call__(self, text: str) -> int:
+        if not self._loaded:
+            self._load()
+        if self._tokenizer is None:
+            return (len(text) + 3) // 4
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def merge_overlapping(first: str, second: str, min_overlap: int = 20) -> str | None:
+    """
+    Merge two chunks cut from the same text if one contains the other or the end of
+    one repeats the start of the other (HierarchicalSplitter overlaps chunks by up
+    to 60 characters). Returns None when they do not overlap.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for a, b in ((first, second), (second, first)):
+        for size in range(min(len(a), len(b)) - 1, min_overlap - 1, -1):
+            if a.endswith(b[:size]):
+                return a + b[size:]
+    return None
+
+
+class ContextPacker:
+    """
+    Turns retrieved hits into LLM context under a token budget.
+
+    Hits from the same `title`/`page` are merged when they are adjacent or overlap,
+    so repeated overlap text is sent once; the merged blocks are then added in rank
+    order until `budget` tokens are used.
+    """
+
+    def __init__(self, count_tokens, min_overlap: int = 20):
+        self.count_tokens = count_tokens
+        self.min_overlap = min_overlap
+
+    def _merge_hits(self, hits: list) -> list:
+        blocks = []  # [source key, text], in order of the best-ranked member
+        for hit in hits:
+            text = (hit.get("chunk") or "").strip()
+            if not text:
+                continue
+            key = (hit.get("title") or "Unknown", hit.get("page"))
+            for block in blocks:
+                if block[0] != key:
+                    continue
+                merged = merge_overlapping(block[1], text, self.min_overlap)
+                if merged is not None:
+                    block[1] = merged
+                    break
+            else:
+                blocks.append([key, text])
+        return blocks
+
+    @staticmethod
+    def _label(key: tuple) -> str:
+        title, page = key
+        return f"[{title}, p.{page}]" if page is not None else f"[{title}]"
+
+    def pack(self, hits: list, budget: int) -> list:
+        """Return the context blocks ("[title, p.N] text") that fit in `budget` tokens."""
+        packed = []
+        used = 0
+        for key, text in self._merge_hits(hits):
+            block = f"{self._label(key)} {text}"
+            tokens = self.count_tokens(block) + 2  # blank line separator
+            if used + tokens > budget:
+                continue
+            packed.append(block)
+            used += tokens
+
+        if not packed and hits:
+            # Even the best block is over budget: keep a truncated piece of it
+            key, text = self._merge_hits(hits)[0]
+            block = f"{self._label(key)} {text}"
+            ratio = budget / max(1, self.count_tokens(block))
+            packed.append(block[: max(0, int(len(block) * ratio) - 1)])
+        return packed
@@ -0,0 +1,105 @@
+import re
+import threading
+import time
+from collections import deque
+
+from session import content_terms
+
+
+def split_sentences(text: str) -> list:
+    return [s.strip() for s in re.split(r"(?<=[.!?;:])\s+|\n+", text) if s.strip()]
+
+
+def cite(entity: dict) -> str:
+    """"Title, p. N" reference of a hit."""
+    title = entity.get("title") or "Unknown document"
+    page = entity.get("page")
+    return f"{title}, p. {page}" if page not in (None, "") else title
+
+
+def best_excerpt(query_terms: set, text: str, max_chars: int) -> str:
+    """The run of consecutive sentences of `text` sharing the most terms with the query, cut at `max_chars`."""
+    sentences = split_sentences(text)
+    if not sentences:
+        return ""
+    scores = [len(query_terms & content_terms(s)) for s in sentences]
+    start = max(range(len(sentences)), key=lambda i: (scores[i], -i))
+
+    excerpt = sentences[start]
+    for sentence in sentences[start + 1:]:
+        if len(excerpt) + 1 + len(sentence) > max_chars:
+            break
+        excerpt += " " + sentence
+    if len(excerpt) > max_chars:
+        excerpt = excerpt[:max_chars].rstrip() + "…"
+    return excerpt
+
+
+def extractive_answer(query: str, entities: list, max_excerpts: int = 3, max_chars: int = 400) -> str:
+    """
+    Answer without the LLM: the most relevant passage of each of the top chunks
+    (in retrieval/rerank order), each followed by its title/page citation.
+    """
+    query_terms = content_terms(query)
+    lines = ["The assistant is busy right now, so here are the most relevant passages from your course documents:", ""]
+    for entity in entities[:max_excerpts]:
+        excerpt = best_excerpt(query_terms, entity.get("chunk") or "", max_chars)
+        if excerpt:
+            lines.append(f"- \"{excerpt}\" ({cite(entity)})")
+    return "\n".join(lines)
+
+
+class OverloadDetector:
+    """
+    Decides when to skip the LLM. Overloaded means too many requests waiting for
+    an LLM slot right now, or a recent p95 LLM slot wait or generation latency
+    above its threshold. Samples older than `window` seconds are forgotten, so
+    once degraded requests stop feeding the LLM the mode switches itself off.
+    A threshold of 0 disables that signal.
+    """
+
+    def __init__(self, max_waiting: int = 0, max_wait: float = 0.0, max_latency: float = 0.0, window: float = 30.0):
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.max_latency = max_latency
+        self.window = window
+        self._waits = deque(maxlen=256)
+        self._latencies = deque(maxlen=256)
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self._waits.append((time.monotonic(), seconds))
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append((time.monotonic(), seconds))
+
+    def _recent_p95(self, samples: deque) -> float | None:
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            ordered = sorted(value for _, value in samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))]
+
+    def reason(self, waiting: int) -> str | None:
+        """Why the LLM should be skipped (`waiting` = requests queued for a slot), or None."""
+        if self.max_waiting and waiting >= self.max_waiting:
+            return "llm_queue"
+        wait = self._recent_p95(self._waits)
+        if self.max_wait and wait is not None and wait >= self.max_wait:
+            return "llm_wait"
+        latency = self._recent_p95(self._latencies)
+        if self.max_latency and latency is not None and latency >= self.max_latency:
+            return "llm_latency"
+        return None
+
+    def status(self, waiting: int) -> dict:
+        return {
+            "reason": self.reason(waiting),
+            "wait_p95": self._recent_p95(self._waits),
+            "latency_p95": self._recent_p95(self._latencies),
+        }
@@ -0,0 +1,253 @@
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+# Module names and their subject codes, mirrored from `module_map` in
+# data-pipeline/data-precleaning-organization/scripts/rename_files.py, plus the
+# topic keywords students actually type in their questions.
+SUBJECT_ALIASES = {
+    "ALG": ["algebre", "algebra", "matrice", "matrix", "espace vectoriel", "vector space", "determinant"],
+    "ASDS": ["algorithmique", "structures de donnees", "data structure", "algorithm", "pile", "stack", "file d'attente", "linked list", "liste chainee"],
+    "ANA": ["analyse mathematique", "mathematical analysis", "integrale", "integral", "derivee", "derivative", "suite numerique"],
+    "ARCHI": ["architecture des ordinateurs", "computer architecture", "processeur", "processor", "assembleur", "assembly"],
+    "BW": ["bureautique", "html", "css"],
+    "ELEC": ["electricite", "electricity", "electrical", "circuit", "resistance", "resistor", "condensateur", "capacitor", "bobine", "inductor", "rlc", "kirchhoff", "thevenin", "norton", "impedance", "courant", "current", "tension", "voltage", "ohm"],
+    "ENG": ["english"],
+    "SE": ["systeme d'exploitation", "operating system", "ordonnancement", "scheduling", "processus", "thread", "semaphore"],
+    "ELECTRO": ["electronique fondamentale", "electronics", "diode", "transistor", "amplificateur", "amplifier", "ampli op"],
+    "MEC": ["mecanique du point", "mechanics", "cinematique", "kinematics", "dynamique", "newton"],
+    "TECX": ["techniques d'expression", "expression ecrite"],
+    "ECON": ["economie", "economics"],
+    "PROBA": ["probabilites", "statistiques", "probability", "statistics", "variable aleatoire", "random variable", "esperance", "variance"],
+    "SFSD": ["structure fichiers", "file structure", "hachage", "hashing", "b-arbre", "b-tree"],
+    "SI": ["systemes d'information", "information system", "merise", "uml"],
+    "LOG": ["logique mathematique", "mathematical logic", "predicat", "predicate", "calcul propositionnel"],
+    "OOE": ["optique", "optics", "ondes electromagnetiques", "electromagnetic wave", "maxwell"],
+    "POO": ["programmation orientee objet", "object oriented", "oop", "heritage", "inheritance", "polymorphisme", "polymorphism"],
+    "BDD": ["base de donnees", "database", "sql", "relationnel", "relational", "normalisation"],
+    "GL": ["genie logiciel", "software engineering"],
+    "RO": ["recherche operationnelle", "operations research", "simplexe", "simplex"],
+    "RX": ["reseaux", "network", "tcp", "routage", "routing"],
+    "IA": ["intelligence artificielle", "artificial intelligence"],
+    "ANUM": ["analyse numerique", "numerical analysis"],
+    "CRYPTO": ["cryptographie", "cryptography", "chiffrement", "encryption"],
+    "ML": ["machine learning", "apprentissage automatique"],
+    "DL": ["deep learning", "neural network", "reseau de neurones"],
+    "NLP": ["natural language processing", "traitement du langage"],
+    "RL": ["reinforcement learning", "apprentissage par renforcement"],
+    "NoSQL": ["nosql", "mongodb"],
+}
+
+# Codes in the collection are an alias-table code plus a course number or variant letter (ALG2, ANAD)
+CODE_SUFFIX_PATTERN = re.compile(r"\d+|[A-Z]")
+LEVEL_PATTERN = re.compile(r"\b([1-5])\s*-?\s*(cp|cs)\b")
+SEMESTER_PATTERN = re.compile(r"\b(?:s|semestre|semester)\s*-?\s*([12])\b")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and strip accents, keeping word boundaries."""
+    text = unicodedata.normalize("NFKD", text).encode("ASCII", "ignore").decode()
+    return re.sub(r"\s+", " ", text.lower())
+
+
+@dataclass
+class RouteResult:
+    filters: dict
+    confidence: float
+    source: str
+    scores: dict = field(default_factory=dict)
+
+
+class FilterRouter:
+    """
+    In-process filter inference for `level`, `semester` and `subject_code`.
+
+    Subjects are matched first against keyword/alias tables, then against centroid
+    embeddings of each subject's chunks. `level` and `semester` come from explicit
+    mentions in the query or, when a subject is found, from the scopes that subject
+    actually has in the collection. The returned confidence lets the caller decide
+    whether to fall back to the LLM classifier.
+    """
+
+    def __init__(
+        self,
+        filter_fields: dict,
+        subject_scopes: dict = None,
+        centroids: dict = None,
+        aliases: dict = SUBJECT_ALIASES,
+    ):
+        self.filter_fields = filter_fields
+        self.subject_scopes = subject_scopes or {}
+        self.centroids = centroids or {}
+        # alias-table code -> (keyword pattern, every collection code it stands for)
+        self.alias_patterns = self._build_alias_patterns(aliases, filter_fields.get("subject_code", []))
+        # Codes are matched case-sensitively: "SE", "EN" or "SI" are also everyday French words
+        self.code_patterns = {
+            code: re.compile(rf"\b{re.escape(code)}\b") for code in filter_fields.get("subject_code", [])
+        }
+
+    @staticmethod
+    def _resolve_codes(alias_code: str, subject_codes: list) -> list:
+        """Every code of the collection an alias-table code stands for (ALG -> ALG1, ALG2, ALG3)."""
+        if alias_code in subject_codes:
+            return [alias_code]
+        return [
+            code for code in subject_codes
+            if code.startswith(alias_code) and CODE_SUFFIX_PATTERN.fullmatch(code[len(alias_code):])
+        ]
+
+    def _build_alias_patterns(self, aliases: dict, subject_codes: list) -> dict:
+        patterns = {}
+        for alias_code, keywords in aliases.items():
+            codes = self._resolve_codes(alias_code, subject_codes)
+            if not codes:
+                continue
+            terms = sorted({normalize_text(k) for k in keywords}, key=len, reverse=True)
+            pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\b")
+            patterns[alias_code] = (pattern, codes)
+        return patterns
+
+    @classmethod
+    def from_collection(cls, client, collection_name: str, with_centroids: bool = True, sample_size: int = 200, batch_size: int = 1000):
+        """
+        Build a router from the distinct scalar values actually stored in the collection.
+
+        Scans `level`, `semester` and `subject_code` of every row once, and, when
+        `with_centroids` is set, averages up to `sample_size` stored vectors per
+        subject into a centroid.
+        """
+        filter_fields = {"level": set(), "semester": set(), "subject_code": set()}
+        subject_scopes = {}
+
+        iterator = client.query_iterator(
+            collection_name=collection_name,
+            batch_size=batch_size,
+            filter="",
+            output_fields=["level", "semester", "subject_code"],
+        )
+        try:
+            while True:
+                rows = iterator.next()
+                if not rows:
+                    break
+                for row in rows:
+                    scope = subject_scopes.setdefault(row["subject_code"], set())
+                    scope.add((row["level"], row["semester"]))
+                    for name in filter_fields:
+                        if row.get(name):
+                            filter_fields[name].add(row[name])
+        finally:
+            iterator.close()
+
+        centroids = {}
+        if with_centroids:
+            for code in filter_fields["subject_code"]:
+                rows = client.query(
+                    collection_name=collection_name,
+                    filter=f'subject_code == "{code}"',
+                    output_fields=["vector"],
+                    limit=sample_size,
+                )
+                vectors = [row["vector"] for row in rows if row.get("vector") is not None]
+                if vectors:
+                    centroid = np.mean(np.asarray(vectors, dtype=np.float32), axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[code] = centroid / norm if norm else centroid
+
+        return cls(
+            filter_fields={name: sorted(values) for name, values in filter_fields.items()},
+            subject_scopes=subject_scopes,
+            centroids=centroids,
+        )
+
+    def _match_subject_keywords(self, query: str, text: str) -> dict:
+        scores = {}
+        for code, pattern in self.code_patterns.items():
+            hits = len(pattern.findall(query))
+            if hits:
+                scores[code] = scores.get(code, 0) + hits
+        # A keyword counts for every course of its subject (ALG1..ALG3); route() disambiguates
+        for pattern, codes in self.alias_patterns.values():
+            hits = len(pattern.findall(text))
+            for code in codes if hits else []:
+                scores[code] = scores.get(code, 0) + hits
+        return scores
+
+    def _in_scope(self, code: str, filters: dict) -> bool:
+        """Whether a subject is taught at the level/semester already found in the query."""
+        return any(
+            filters.get("level", level) == level and filters.get("semester", semester) == semester
+            for level, semester in self.subject_scopes.get(code, set())
+        )
+
+    def _match_subject_centroids(self, embedding) -> dict:
+        if embedding is None or not self.centroids:
+            return {}
+        query_vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query_vector)
+        if not norm:
+            return {}
+        query_vector = query_vector / norm
+        return {code: float(np.dot(query_vector, centroid)) for code, centroid in self.centroids.items()}
+
+    def route(self, query: str, embedding=None) -> RouteResult:
+        """Infer filters for a query; `embedding` enables the centroid stage."""
+        text = normalize_text(query)
+        filters = {}
+
+        level_match = LEVEL_PATTERN.search(text)
+        if level_match:
+            level = f"{level_match.group(1)}{level_match.group(2).upper()}"
+            if level in self.filter_fields.get("level", []):
+                filters["level"] = level
+
+        semester_match = SEMESTER_PATTERN.search(text)
+        if semester_match:
+            semester = f"S{semester_match.group(1)}"
+            if semester in self.filter_fields.get("semester", []):
+                filters["semester"] = semester
+
+        subject, confidence, source = None, 0.0, "none"
+        scores = self._match_subject_keywords(query, text)
+        if scores:
+            best = max(scores.values())
+            candidates = sorted(code for code, score in scores.items() if score == best)
+            # An explicit level/semester can tell apart courses sharing keywords (ALG1 vs ALG3)
+            in_scope = [code for code in candidates if self._in_scope(code, filters)]
+            if in_scope:
+                candidates = in_scope
+            source = "keywords"
+            # A keyword hit naming one course is near-certain; one shared by several is not
+            if len(candidates) == 1:
+                subject, confidence = candidates[0], 0.95
+            else:
+                confidence = 0.5
+        else:
+            scores = self._match_subject_centroids(embedding)
+            if scores:
+                ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+                best_score = ranked[0][1]
+                margin = best_score - ranked[1][1] if len(ranked) > 1 else best_score
+                subject = ranked[0][0]
+                source = "centroids"
+                # Similarity alone is poorly calibrated; the margin over the runner-up is what counts
+                confidence = float(min(1.0, max(0.0, margin * 10)) * max(0.0, best_score))
+
+        if subject is not None:
+            filters["subject_code"] = subject
+            scopes = self.subject_scopes.get(subject, set())
+            # Fill level/semester when the subject is only taught in one place
+            levels = {level for level, _ in scopes}
+            semesters = {semester for level, semester in scopes if filters.get("level", level) == level}
+            if "level" not in filters and len(levels) == 1:
+                filters["level"] = next(iter(levels))
+            if "semester" not in filters and len(semesters) == 1:
+                filters["semester"] = next(iter(semesters))
+        elif filters and source == "none":
+            source = "explicit"
+            confidence = 0.5
+
+        return RouteResult(filters=filters, confidence=confidence, source=source, scores=scores)
@@ -0,0 +1,333 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+
+import httpx
+
+
+@dataclass
+class BackendParams:
+    kind: str = "ollama"  # "ollama" or "openai" (any OpenAI-compatible server, e.g. vLLM)
+    base_url: str = "http://localhost:11434"
+    model: str = "qwen3:8b"
+    api_key: str | None = None
+    timeout: float = 120.0  # per-call timeout, in seconds
+    max_retries: int = 2
+    max_concurrency: int = 8
+    think: bool | None = None
+    keep_alive: str | None = None  # how long Ollama keeps the model loaded, e.g. "30m"
+
+
+@dataclass
+class ChatResult:
+    content: str
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    raw: dict = field(default_factory=dict)
+
+
+class BackendError(Exception):
+    pass
+
+
+# Status codes worth retrying: rate limited or the server is (temporarily) unhealthy
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LLMBackend:
+    """
+    Chat client for the RAG chain with a pooled async HTTP connection.
+
+    Concurrency is capped with a semaphore (and matching connection limits), every
+    call has its own timeout, and transport errors or retryable status codes are
+    retried with exponential backoff. The sync `chat`/`stream` wrappers run the async
+    calls on a background event loop so the connection pool survives between calls.
+    """
+
+    def __init__(self, params: BackendParams):
+        self.params = params
+        self._client = None
+        self._semaphore = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    # ----- request/response formats (overridden per server type) -----
+
+    def _chat_path(self) -> str:
+        raise NotImplementedError
+
+    def _payload(self, messages: list, stream: bool, max_tokens: int | None, temperature: float | None, json_schema: dict | None = None) -> dict:
+        """Request body; `json_schema` constrains decoding to JSON matching that schema."""
+        raise NotImplementedError
+
+    def _parse_result(self, data: dict) -> ChatResult:
+        raise NotImplementedError
+
+    def _parse_stream_line(self, line: str) -> dict | None:
+        """Turn one streamed line into {"content", "done", "prompt_tokens", "completion_tokens"}, or None."""
+        raise NotImplementedError
+
+    # ----- async API -----
+
+    def _ensure_client(self):
+        if self._client is None:
+            headers = {"Authorization": f"Bearer {self.params.api_key}"} if self.params.api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.params.base_url,
+                headers=headers,
+                timeout=self.params.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.params.max_concurrency,
+                    max_keepalive_connections=self.params.max_concurrency,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.params.max_concurrency)
+
+    async def _with_retries(self, send):
+        for attempt in range(self.params.max_retries + 1):
+            try:
+                return await send()
+            except (httpx.TransportError, BackendError) as e:
+                retryable = isinstance(e, httpx.TransportError) or getattr(e, "retryable", False)
+                if not retryable or attempt == self.params.max_retries:
+                    raise
+                await asyncio.sleep(0.5 * 2**attempt)
+
+    def _raise_for_status(self, response: httpx.Response, body: str):
+        if response.status_code >= 400:
+            error = BackendError(f"{self.params.kind} backend returned {response.status_code}: {body[:200]}")
+            error.retryable = response.status_code in RETRYABLE_STATUS
+            raise error
+
+    async def achat(self, messages: list, max_tokens: int = None, temperature: float = None, json_schema: dict = None) -> ChatResult:
+        self._ensure_client()
+        payload = self._payload(messages, False, max_tokens, temperature, json_schema)
+
+        async def send():
+            async with self._semaphore:
+                response = await self._client.post(self._chat_path(), json=payload)
+                self._raise_for_status(response, response.text)
+                return self._parse_result(response.json())
+
+        return await self._with_retries(send)
+
+    async def astream(self, messages: list, max_tokens: int = None, temperature: float = None):
+        """Yield {"content", "done", "prompt_tokens", "completion_tokens"} dicts as the answer is generated."""
+        self._ensure_client()
+        payload = self._payload(messages, True, max_tokens, temperature)
+
+        async with self._semaphore:
+            for attempt in range(self.params.max_retries + 1):
+                started = False
+                try:
+                    async with self._client.stream("POST", self._chat_path(), json=payload) as response:
+                        if response.status_code >= 400:
+                            self._raise_for_status(response, (await response.aread()).decode(errors="replace"))
+                        async for line in response.aiter_lines():
+                            part = self._parse_stream_line(line)
+                            if part is not None:
+                                started = True
+                                yield part
+                    return
+                except (httpx.TransportError, BackendError) as e:
+                    retryable = isinstance(e, httpx.TransportError) or getattr(e, "retryable", False)
+                    # Never retry once tokens were handed to the caller
+                    if started or not retryable or attempt == self.params.max_retries:
+                        raise
+                    await asyncio.sleep(0.5 * 2**attempt)
+
+    async def awarmup(self):
+        """Load the model on the server so the first real request does not pay for it."""
+        await self.achat([{"role": "user", "content": "ping"}], max_tokens=1)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ----- sync API (background event loop) -----
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name=f"llm-{self.params.kind}", daemon=True).start()
+        return self._loop
+
+    def chat(self, messages: list, max_tokens: int = None, temperature: float = None, json_schema: dict = None) -> ChatResult:
+        future = asyncio.run_coroutine_threadsafe(self.achat(messages, max_tokens, temperature, json_schema), self._ensure_loop())
+        return future.result()
+
+    def warmup(self):
+        asyncio.run_coroutine_threadsafe(self.awarmup(), self._ensure_loop()).result()
+
+    def stream(self, messages: list, max_tokens: int = None, temperature: float = None):
+        parts = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for part in self.astream(messages, max_tokens, temperature):
+                    parts.put(part)
+            except Exception as e:
+                parts.put(e)
+            finally:
+                parts.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._ensure_loop())
+        try:
+            while True:
+                part = parts.get()
+                if part is done:
+                    return
+                if isinstance(part, Exception):
+                    raise part
+                yield part
+        finally:
+            # Stop generating if the caller stopped reading
+            future.cancel()
+
+
+class OllamaBackend(LLMBackend):
+    def _chat_path(self) -> str:
+        return "/api/chat"
+
+    def _payload(self, messages, stream, max_tokens, temperature, json_schema=None) -> dict:
+        options = {}
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if temperature is not None:
+            options["temperature"] = temperature
+        payload = {"model": self.params.model, "messages": messages, "stream": stream, "options": options}
+        if json_schema is not None:
+            payload["format"] = json_schema
+        if self.params.think is not None:
+            payload["think"] = self.params.think
+        if self.params.keep_alive is not None:
+            payload["keep_alive"] = self.params.keep_alive
+        return payload
+
+    async def awarmup(self):
+        # An empty chat only loads the model (and applies keep_alive) without generating
+        self._ensure_client()
+        payload = {"model": self.params.model, "messages": []}
+        if self.params.keep_alive is not None:
+            payload["keep_alive"] = self.params.keep_alive
+
+        async def send():
+            async with self._semaphore:
+                response = await self._client.post(self._chat_path(), json=payload)
+                self._raise_for_status(response, response.text)
+
+        await self._with_retries(send)
+
+    def _parse_result(self, data: dict) -> ChatResult:
+        return ChatResult(
+            content=data["message"]["content"],
+            prompt_tokens=data.get("prompt_eval_count"),
+            completion_tokens=data.get("eval_count"),
+            raw=data,
+        )
+
+    def _parse_stream_line(self, line: str) -> dict | None:
+        if not line.strip():
+            return None
+        data = json.loads(line)
+        if "error" in data:
+            raise BackendError(data["error"])
+        return {
+            "content": data.get("message", {}).get("content", ""),
+            "done": data.get("done", False),
+            "prompt_tokens": data.get("prompt_eval_count"),
+            "completion_tokens": data.get("eval_count"),
+        }
+
+
+class OpenAIBackend(LLMBackend):
+    def _chat_path(self) -> str:
+        return "/v1/chat/completions"
+
+    def _payload(self, messages, stream, max_tokens, temperature, json_schema=None) -> dict:
+        payload = {"model": self.params.model, "messages": messages, "stream": stream}
+        if json_schema is not None:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "response", "schema": json_schema, "strict": True},
+            }
+        if stream:
+            payload["stream_options"] = {"include_usage": True}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if self.params.think is not None:
+            # Qwen3 chat template switch, honoured by vLLM
+            payload["chat_template_kwargs"] = {"enable_thinking": self.params.think}
+        return payload
+
+    def _parse_result(self, data: dict) -> ChatResult:
+        usage = data.get("usage") or {}
+        return ChatResult(
+            content=data["choices"][0]["message"]["content"] or "",
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+            raw=data,
+        )
+
+    def _parse_stream_line(self, line: str) -> dict | None:
+        if not line.startswith("data:"):
+            return None
+        body = line[len("data:"):].strip()
+        if body == "[DONE]":
+            return None
+        data = json.loads(body)
+        usage = data.get("usage") or {}
+        choices = data.get("choices") or []
+        content = ((choices[0].get("delta") or {}).get("content") or "") if choices else ""
+        return {
+            "content": content,
+            # With include_usage the final chunk carries the usage and no choices
+            "done": bool(usage) and not choices,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+        }
+
+
+BACKENDS = {"ollama": OllamaBackend, "openai": OpenAIBackend}
+
+
+def create_backend(params: BackendParams) -> LLMBackend:
+    if params.kind not in BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{params.kind}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[params.kind](params)
+
+
+def backend_from_env(prefix: str, **defaults) -> LLMBackend:
+    """
+    Build a backend from `<prefix>_BACKEND`, `_BASE_URL`, `_MODEL`, `_API_KEY`,
+    `_TIMEOUT`, `_MAX_RETRIES`, `_MAX_CONCURRENCY`, `_THINK` and `_KEEP_ALIVE` environment variables.
+    """
+    params = BackendParams(**defaults)
+
+    def env(name, cast=str):
+        value = os.getenv(f"{prefix}_{name}")
+        return cast(value) if value is not None else None
+
+    overrides = {
+        "kind": env("BACKEND"),
+        "base_url": env("BASE_URL"),
+        "model": env("MODEL"),
+        "api_key": env("API_KEY"),
+        "timeout": env("TIMEOUT", float),
+        "max_retries": env("MAX_RETRIES", int),
+        "max_concurrency": env("MAX_CONCURRENCY", int),
+        "think": env("THINK", lambda v: v.lower() == "true"),
+        "keep_alive": env("KEEP_ALIVE"),
+    }
+    for name, value in overrides.items():
+        if value is not None:
+            setattr(params, name, value)
+    return create_backend(params)
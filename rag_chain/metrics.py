@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Prometheus histogram buckets, in seconds (LLM stages easily take several seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _quantile(ordered: list, q: float):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))]
+
+
+def _labels_text(labels: tuple) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+
+class Histogram:
+    """Bucketed counts for Prometheus plus a bounded window of recent samples for quantiles."""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, window: int = 2048):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def summary(self) -> dict:
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": _quantile(ordered, 0.50),
+            "p95": _quantile(ordered, 0.95),
+            "p99": _quantile(ordered, 0.99),
+        }
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and latency histograms for the RAG chain.
+
+    Metrics are keyed by name plus optional labels. They can be read as a JSON
+    snapshot with p50/p95/p99, rendered in the Prometheus text format, served over
+    HTTP, or dumped to a JSON file periodically.
+    """
+
+    def __init__(self, prefix: str = "rag"):
+        self.prefix = prefix
+        self._counters: dict = {}
+        self._gauges: dict = {}
+        self._histograms: dict = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict | None) -> tuple:
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """Record the current value of something that goes up and down (queue depth, busy slots)."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Record the duration of the block in the `name` histogram (errors included)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> dict:
+        def display(key):
+            name, labels = key
+            return name + _labels_text(labels)
+
+        with self._lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {display(key): value for key, value in sorted(self._counters.items())},
+                "gauges": {display(key): value for key, value in sorted(self._gauges.items())},
+                "latency_seconds": {display(key): h.summary() for key, h in sorted(self._histograms.items())},
+            }
+
+    def prometheus_text(self) -> str:
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} counter")
+                    seen.add(metric)
+                lines.append(f"{metric}{_labels_text(labels)} {value}")
+
+            for (name, labels), value in sorted(self._gauges.items()):
+                metric = f"{self.prefix}_{name}"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} gauge")
+                    seen.add(metric)
+                lines.append(f"{metric}{_labels_text(labels)} {value}")
+
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                metric = f"{self.prefix}_{name}_seconds"
+                if metric not in seen:
+                    lines.append(f"# TYPE {metric} histogram")
+                    seen.add(metric)
+                for bound, count in zip(histogram.buckets, histogram.bucket_counts):
+                    lines.append(f"{metric}_bucket{_labels_text(labels + (('le', bound),))} {count}")
+                lines.append(f"{metric}_bucket{_labels_text(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{metric}_sum{_labels_text(labels)} {histogram.sum}")
+                lines.append(f"{metric}_count{_labels_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+        """Serve /metrics (Prometheus text) and /metrics.json from a background thread."""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry.prometheus_text(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(registry.snapshot(), indent=2), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+    def start_json_dump(self, path: str, interval: float = 60.0) -> threading.Event:
+        """Write the JSON snapshot to `path` every `interval` seconds; set the returned event to stop."""
+        stop = threading.Event()
+
+        def dump():
+            while not stop.wait(interval):
+                try:
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(self.snapshot(), f, indent=2)
+                except OSError as e:
+                    print(f"⚠️ Could not write metrics to {path}: {e}")
+
+        threading.Thread(target=dump, name="metrics-dump", daemon=True).start()
+        return stop
+
+
+# Shared by every module of the RAG chain
+metrics = MetricsRegistry()
@@ -0,0 +1,104 @@
+"""
+Prompt assembly for the RAG chain.
+
+Every message list built here starts with a byte-stable static prefix (system
+prompt, instructions, available filter values) and ends with the per-request
+content (retrieved documents, student question). Identical prefixes let the LLM
+server reuse its prefix/KV cache across requests, so only the variable tail has to
+be prefilled.
+"""
+
+# -------------------------------
+# Answer generation
+# -------------------------------
+
+ANSWER_SYSTEM_PROMPT = (
+    "You are a helpful study assistant for ESTIN engineering students. "
+    "Answer clearly and accurately based only on the provided context.\n\n"
+    "Answer the question based ONLY on the course documents given with it. "
+    "If the documents don't contain enough information to answer the question completely, "
+    "say so and provide what information is available.\n\n"
+    "Please provide a clear, structured answer based on the course material."
+)
+
+ANSWER_USER_TEMPLATE = (
+    "COURSE DOCUMENTS:\n"
+    "{context}\n\n"
+    "{conversation}"
+    "STUDENT QUESTION: {query}"
+)
+
+CONVERSATION_TEMPLATE = "CONVERSATION SO FAR:\n{summary}\n\n"
+
+
+def answer_messages(context_text: str, query: str, conversation: str = None) -> list:
+    """
+    Messages for answer generation: static instructions first, then the documents,
+    the conversation so far (follow-up questions) and the question.
+    """
+    conversation_text = CONVERSATION_TEMPLATE.format(summary=conversation) if conversation else ""
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": ANSWER_USER_TEMPLATE.format(context=context_text, conversation=conversation_text, query=query)},
+    ]
+
+
+# -------------------------------
+# Filter classification
+# -------------------------------
+
+CLASSIFIER_SYSTEM_PROMPT = (
+    "You are an intelligent academic classifier for an engineering education system. "
+    "Your task is to analyze student queries and intelligently determine which course filters apply.\n\n"
+    "INTELLIGENT INFERENCE GUIDELINES:\n"
+    "1. SUBJECT ANALYSIS: Understand the topic domain of the query\n"
+    "   - Map the concepts to the subject_code of the course that teaches them\n"
+    "   - Consider the scientific and engineering context\n"
+    "   - Think about what field of study the question belongs to\n\n"
+    "2. ACADEMIC LEVEL: Consider the complexity and context\n"
+    "   - Introductory/foundational questions → first-year levels\n\n"
+    "3. CURRICULUM TIMING: Think about when topics are typically taught\n"
+    "   - Only set a field when the query gives you a reason to\n\n"
+    "Respond with a JSON object giving a value for each field, or null when the query "
+    "gives no reason to set it.\n\n"
+    "Available course structure:\n"
+    "{filter_fields}"
+)
+
+CLASSIFIER_USER_TEMPLATE = "Classify this query: '{query}'"
+
+FILTER_FIELD_NOTES = {"level": "CP = preparatory cycle, CS = superior cycle"}
+
+
+def describe_filter_fields(filter_fields: dict) -> str:
+    """Render the available filter values in a fixed order, so the text only changes with the values."""
+    lines = []
+    for name in sorted(filter_fields):
+        line = f" - {name}: {sorted(filter_fields[name])}"
+        if name in FILTER_FIELD_NOTES:
+            line += f" ({FILTER_FIELD_NOTES[name]})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def classifier_messages(query: str, filter_fields: dict) -> list:
+    """Messages for the filter classifier; the query is the only variable part."""
+    return [
+        {"role": "system", "content": CLASSIFIER_SYSTEM_PROMPT.format(filter_fields=describe_filter_fields(filter_fields))},
+        {"role": "user", "content": CLASSIFIER_USER_TEMPLATE.format(query=query)},
+    ]
+
+
+def classifier_schema(filter_fields: dict) -> dict:
+    """
+    JSON schema the classifier's output is constrained to: every filter field, each
+    either one of the values present in the collection or null.
+    """
+    return {
+        "type": "object",
+        "properties": {
+            name: {"enum": sorted(filter_fields[name]) + [None]} for name in sorted(filter_fields)
+        },
+        "required": sorted(filter_fields),
+        "additionalProperties": False,
+    }
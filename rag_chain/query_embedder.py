@@ -0,0 +1,135 @@
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a query (NFC, collapsed whitespace); it is both the cache key and what gets embedded."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class QueryEmbedder:
+    """
+    Embeds queries on the client side through the TEI `/embed` endpoint.
+
+    Vectors are kept in an LRU cache keyed by the normalized query text, so retried
+    and repeated searches do not re-embed. Cache misses from concurrent callers are
+    collected for `batch_window` seconds and sent as one `/embed` call of at most
+    `max_batch` inputs; a text already being embedded is waited on, not re-sent.
+    """
+
+    def __init__(self, client, max_entries: int = 4096, max_batch: int = 32, batch_window: float = 0.005):
+        self.client = client
+        self.max_entries = max_entries
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+
+        self._vectors: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: dict[str, Future] = {}
+        self._queue: list[str] = []
+        self._flushing = False
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+        self.embedded = 0
+
+    def _call(self, texts: list) -> list:
+        vectors = np.asarray(self.client.feature_extraction(texts), dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        if len(vectors) != len(texts):
+            raise ValueError(f"TEI returned {len(vectors)} embeddings for {len(texts)} inputs")
+        return list(vectors)
+
+    def _flush(self):
+        """Send queued texts in batches until the queue is empty (run by one caller at a time)."""
+        time.sleep(self.batch_window)
+        while True:
+            with self._lock:
+                batch, self._queue = self._queue[: self.max_batch], self._queue[self.max_batch:]
+                if not batch:
+                    self._flushing = False
+                    return
+                futures = [self._pending[text] for text in batch]
+
+            try:
+                vectors = self._call(batch)
+                error = None
+            except Exception as e:
+                vectors, error = None, e
+
+            with self._lock:
+                self.batches += 1
+                for i, text in enumerate(batch):
+                    del self._pending[text]
+                    if error is None:
+                        self._store(text, vectors[i])
+                        self.embedded += 1
+            for i, future in enumerate(futures):
+                if error is None:
+                    future.set_result(vectors[i])
+                else:
+                    future.set_exception(error)
+
+    def _store(self, key: str, vector: np.ndarray):
+        self._vectors[key] = vector
+        self._vectors.move_to_end(key)
+        while len(self._vectors) > self.max_entries:
+            self._vectors.popitem(last=False)
+
+    def _submit(self, keys: list) -> tuple:
+        """Return (futures per key, whether this caller must flush the queue)."""
+        futures = []
+        with self._lock:
+            for key in keys:
+                vector = self._vectors.get(key)
+                if vector is not None:
+                    self._vectors.move_to_end(key)
+                    self.hits += 1
+                    future = Future()
+                    future.set_result(vector)
+                elif key in self._pending:
+                    self.hits += 1
+                    future = self._pending[key]
+                else:
+                    self.misses += 1
+                    future = self._pending[key] = Future()
+                    self._queue.append(key)
+                futures.append(future)
+            leader = bool(self._queue) and not self._flushing
+            if leader:
+                self._flushing = True
+        return futures, leader
+
+    def embed_many(self, texts: list) -> list:
+        """Embed several queries (cached ones are not sent); raises if TEI fails."""
+        futures, leader = self._submit([normalize_query(text) for text in texts])
+        if leader:
+            self._flush()
+        return [future.result() for future in futures]
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_many([text])[0]
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._vectors),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "batches": self.batches,
+                "avg_batch_size": self.embedded / self.batches if self.batches else 0.0,
+            }
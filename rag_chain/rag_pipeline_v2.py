@@ -1,158 +1,269 @@
 import os
-from pymilvus import MilvusClient
-import ollama
+from pymilvus import MilvusClient, AnnSearchRequest, RRFRanker, WeightedRanker
+from huggingface_hub import InferenceClient
 import json
-import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from context_packer import ContextPacker, TokenCounter
+from degraded import OverloadDetector, extractive_answer
+from filter_router import FilterRouter
+from llm_backend import backend_from_env
+from metrics import metrics
+import prompts
+from admission import StageLimiter
+from query_embedder import QueryEmbedder, normalize_query
+from reranker import CrossEncoderReranker
+from resilience import CircuitBreaker, CircuitOpenError, Deadline, Hedger, RetrievalUnavailable
+from semantic_cache import SemanticCache
+from session import SessionStore
+from single_flight import SingleFlight
 
 # -------------------------------
 # Milvus Setup (with auto-embedding)
 # -------------------------------
 MILVUS_HOST = os.getenv("MILVUS_HOST", "http://localhost:19530")
+# Optional second replica that slow or failing searches are hedged to
+MILVUS_HEDGE_HOST = os.getenv("MILVUS_HEDGE_HOST")
 COLLECTION_NAME = "estin_docs"
-client = MilvusClient(uri=MILVUS_HOST)
+_milvus_client = None
+_milvus_hedge_client = None
+_milvus_client_lock = threading.Lock()
+
+def get_client(replica: int = 0) -> MilvusClient:
+    """Return the shared Milvus client (replica 1 = MILVUS_HEDGE_HOST), connecting on first use."""
+    global _milvus_client, _milvus_hedge_client
+    if replica == 1:
+        if _milvus_hedge_client is None:
+            with _milvus_client_lock:
+                if _milvus_hedge_client is None:
+                    _milvus_hedge_client = MilvusClient(uri=MILVUS_HEDGE_HOST)
+        return _milvus_hedge_client
+    if _milvus_client is None:
+        with _milvus_client_lock:
+            if _milvus_client is None:
+                _milvus_client = MilvusClient(uri=MILVUS_HOST)
+    return _milvus_client
+
+def milvus_replicas() -> list:
+    return [0, 1] if MILVUS_HEDGE_HOST else [0]
 
 # -------------------------------
-# Candidate Filter Fields
+# LLM Backends (Ollama or OpenAI-compatible, e.g. the vLLM server in models/)
 # -------------------------------
-FILTER_FIELDS = {
-    "level": ["1CP"],
-    "semester": ["S1"],
-    "subject_code": ["ELEC"]
-}
+# Configured with CLASSIFIER_* and GENERATOR_* variables (BACKEND, BASE_URL, MODEL,
+# API_KEY, TIMEOUT, MAX_RETRIES, MAX_CONCURRENCY, THINK), so each role can target
+# whichever server has the better throughput.
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+classifier_llm = backend_from_env("CLASSIFIER", base_url=OLLAMA_HOST, model="qwen3:8b", timeout=30.0, keep_alive=LLM_KEEP_ALIVE, think=False)
+generator_llm = backend_from_env("GENERATOR", base_url=OLLAMA_HOST, model="qwen3:8b", timeout=120.0, keep_alive=LLM_KEEP_ALIVE)
+
+def record_llm_tokens(role: str, response):
+    """Count prompt/completion tokens reported by an LLM response (ChatResult or stream part)."""
+    usage = response if isinstance(response, dict) else vars(response)
+    for kind in ("prompt", "completion"):
+        if usage.get(f"{kind}_tokens"):
+            metrics.inc("llm_tokens", usage[f"{kind}_tokens"], role=role, kind=kind)
 
 # -------------------------------
-# Step 1: Use LLM to classify filter fields (Improved)
+# Query Embedding (same TEI server Milvus uses for the `vector` field)
 # -------------------------------
-def classify_query_filters(query: str) -> dict:
-    """Let the LLM intelligently infer which filter values are relevant to the user query."""
-    system_msg = (
-        "You are an intelligent academic classifier for an engineering education system. "
-        "Your task is to analyze student queries and intelligently determine which course filters apply.\n\n"
-        "Available course structure:\n"
-        f" - level: {FILTER_FIELDS['level']} (1st year engineering program)\n"
-        f" - semester: {FILTER_FIELDS['semester']} (first semester courses)\n"
-        f" - subject_code: {FILTER_FIELDS['subject_code']} (electrical engineering and electronics)\n\n"
-        "INTELLIGENT INFERENCE GUIDELINES:\n"
-        "1. SUBJECT ANALYSIS: Understand the topic domain of the query\n"
-        "   - Electrical/Electronics concepts → 'ELEC'\n"
-        "   - Consider the scientific and engineering context\n"
-        "   - Think about what field of study the question belongs to\n\n"
-        "2. ACADEMIC LEVEL: Consider the complexity and context\n"
-        "   - Introductory/foundational questions → '1CP' (1st year)\n"
-        "   - Basic engineering concepts → '1CP'\n\n"
-        "3. CURRICULUM TIMING: Think about when topics are typically taught\n"
-        "   - Fundamental concepts → 'S1' (first semester)\n"
-        "   - Basic theory and principles → 'S1'\n\n"
-        "Respond with ONLY a valid JSON object, no explanations or extra text."
-    )
+TEI_ENDPOINT = os.getenv("TEI_ENDPOINT", "http://localhost:5052")
+TEI_API_KEY = os.getenv("TEI_API_KEY", None)
+# How often (seconds) to re-read the collection version used to invalidate derived state
+COLLECTION_VERSION_REFRESH = float(os.getenv("COLLECTION_VERSION_REFRESH", "30"))
+# Client-side query vectors: LRU size, and how long/how many concurrent misses are batched per /embed call
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "4096"))
+QUERY_EMBED_BATCH_WINDOW = float(os.getenv("QUERY_EMBED_BATCH_WINDOW", "0.005"))
+QUERY_EMBED_MAX_BATCH = int(os.getenv("QUERY_EMBED_MAX_BATCH", "32"))
+
+embedding_client = InferenceClient(base_url=f"{TEI_ENDPOINT}/embed", api_key=TEI_API_KEY)
+query_embedder = QueryEmbedder(
+    embedding_client,
+    max_entries=QUERY_EMBED_CACHE_SIZE,
+    max_batch=QUERY_EMBED_MAX_BATCH,
+    batch_window=QUERY_EMBED_BATCH_WINDOW,
+)
+_collection_version = {"value": None, "checked_at": None, "fields": (), "error": None}
+_collection_version_lock = threading.Lock()
+
+def _read_collection_version(deadline: Deadline = None):
+    """Re-read the collection version through call_milvus, recording the failure if it fails."""
+    def read(client, timeout):
+        return (
+            client.describe_collection(COLLECTION_NAME, timeout=timeout),
+            client.get_collection_stats(COLLECTION_NAME, timeout=timeout),
+        )
 
     try:
-        response = ollama.chat(model="qwen3:8b", messages=[
-            {"role": "system", "content": system_msg},
-            {"role": "user", "content": f"Classify this query: '{query}'"}
-        ])
+        description, stats = call_milvus(read, deadline)
+    except Exception as e:
+        if _collection_version["value"] is not None:
+            print(f"⚠️ Could not re-read the version of '{COLLECTION_NAME}', keeping {_collection_version['value']}: {e}")
+        _collection_version["error"] = e if isinstance(e, RetrievalUnavailable) else RetrievalUnavailable(f"Milvus is unavailable: {e}")
+    else:
+        _collection_version["value"] = f"{description.get('collection_id')}:{stats.get('row_count', 0)}"
+        _collection_version["fields"] = tuple(f.get("name") for f in description.get("fields", []))
+        _collection_version["error"] = None
+    _collection_version["checked_at"] = time.monotonic()
 
-        content = response["message"]["content"].strip()
-        
-        # Remove any thinking tags or extra content
-        content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
-        content = content.strip()
-        
-        # Extract JSON from code blocks if present
-        if "```json" in content:
-            json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(1).strip()
-        elif "```" in content:
-            json_match = re.search(r'```\s*(.*?)\s*```', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(1).strip()
-        
-        # Try to find JSON pattern if other methods fail
-        if not content.startswith('{'):
-            json_match = re.search(r'\{[^}]*\}', content)
-            if json_match:
-                content = json_match.group(0)
-        
-        # Parse JSON
-        result = json.loads(content)
-        
-        # Validate and filter results
-        validated_result = {}
-        for k, v in result.items():
-            if k in FILTER_FIELDS and v in FILTER_FIELDS[k]:
-                validated_result[k] = v
-        
-        print(f"✅ Successfully parsed filters: {validated_result}")
-        return validated_result
-        
+def get_collection_version(deadline: Deadline = None) -> str:
+    """
+    Return a stamp that changes whenever `estin_docs` is re-created or re-imported.
+
+    Combines the collection id (new on every drop/create) with the row count (changes
+    on every import). The value is re-read at most every COLLECTION_VERSION_REFRESH
+    seconds, by one request at a time and through call_milvus (circuit breaker,
+    `deadline`); the others keep the last known version meanwhile. Failed reads are
+    remembered for the same period: the last known version is returned, or the
+    failure raised again when there is none yet.
+    """
+    def stale() -> bool:
+        checked_at = _collection_version["checked_at"]
+        return checked_at is None or time.monotonic() - checked_at > COLLECTION_VERSION_REFRESH
+
+    if stale() and _collection_version_lock.acquire(blocking=_collection_version["value"] is None):
+        try:
+            if stale():
+                _read_collection_version(deadline)
+        finally:
+            _collection_version_lock.release()
+    if _collection_version["value"] is None:
+        raise _collection_version["error"]
+    return _collection_version["value"]
+
+def embed_query(query: str):
+    """Embed a query with the TEI server (cached, and batched with concurrent callers)."""
+    with metrics.timer("stage", stage="embed"):
+        return query_embedder.embed(query)
+
+def try_embed_query(query: str):
+    """Embed a query, returning None when the TEI server is unavailable."""
+    try:
+        return embed_query(query)
     except Exception as e:
-        print(f"[Warning] Failed to parse classification: {e}")
-        print(f"Raw content: {response['message']['content'] if 'response' in locals() else 'No response'}")
-        
-        # Fallback: try to extract filters using keyword matching
-        fallback_filters = extract_filters_fallback(query)
-        print(f"🔄 Using fallback extraction: {fallback_filters}")
-        return fallback_filters
-
-def extract_filters_fallback(query: str) -> dict:
-    """Enhanced LLM-based fallback for filter extraction when primary classification fails."""
-    fallback_prompt = (
-        "You are a backup academic classifier. The primary classifier failed to process this query. "
-        "Please analyze this student question and determine the most appropriate academic filters.\n\n"
-        "Query to analyze: \"{}\"\n\n"
-        "Available options:\n"
-        f"- level: {FILTER_FIELDS['level']}\n"
-        f"- semester: {FILTER_FIELDS['semester']}\n"
-        f"- subject_code: {FILTER_FIELDS['subject_code']}\n\n"
-        "Think about:\n"
-        "1. What academic field does this question belong to?\n"
-        "2. What level of student would ask this question?\n"
-        "3. When in the curriculum would this topic be taught?\n\n"
-        "Provide only a JSON object with your analysis."
-    ).format(query)
-    
+        print(f"⚠️ Query embedding unavailable: {e}")
+        metrics.inc("fallback", path="embedding_unavailable")
+        return None
+
+def try_embed_queries(queries: list) -> list:
+    """Embed several queries in one /embed call; every entry is None when TEI is unavailable."""
     try:
-        response = ollama.chat(model="qwen3:8b", messages=[
-            {"role": "system", "content": "You are an academic classifier. Respond only with JSON."},
-            {"role": "user", "content": fallback_prompt}
-        ])
-        
-        content = response["message"]["content"].strip()
-        
-        # Clean up the response
-        content = re.sub(r'<think>.*?</think>', '', content, flags=re.DOTALL)
-        content = content.strip()
-        
-        if "```json" in content:
-            json_match = re.search(r'```json\s*(.*?)\s*```', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(1).strip()
-        elif "```" in content:
-            json_match = re.search(r'```\s*(.*?)\s*```', content, re.DOTALL)
-            if json_match:
-                content = json_match.group(1).strip()
-        
-        if not content.startswith('{'):
-            json_match = re.search(r'\{[^}]*\}', content)
-            if json_match:
-                content = json_match.group(0)
-        
-        result = json.loads(content)
-        
-        # Validate results
-        validated_result = {}
-        for k, v in result.items():
-            if k in FILTER_FIELDS and v in FILTER_FIELDS[k]:
-                validated_result[k] = v
-        
-        print(f"🔄 Fallback LLM classification: {validated_result}")
-        return validated_result
-        
+        with metrics.timer("stage", stage="embed"):
+            return query_embedder.embed_many(queries)
+    except Exception as e:
+        print(f"⚠️ Query embedding unavailable: {e}")
+        metrics.inc("fallback", len(queries), path="embedding_unavailable")
+        return [None] * len(queries)
+
+# -------------------------------
+# Semantic Answer Cache
+# -------------------------------
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+
+answer_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+    ttl=SEMANTIC_CACHE_TTL,
+)
+
+# -------------------------------
+# Candidate Filter Fields (read from the collection) and Local Filter Router
+# -------------------------------
+# Router results at or above this confidence skip the LLM classifier entirely
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.7"))
+# A schema-constrained {"level", "semester", "subject_code"} reply needs ~30 tokens
+CLASSIFIER_MAX_TOKENS = int(os.getenv("CLASSIFIER_MAX_TOKENS", "64"))
+
+FILTER_FIELDS = {"level": [], "semester": [], "subject_code": []}
+filter_router = FilterRouter(FILTER_FIELDS)
+_filter_router_version = {"value": None}
+# Held while a router is being built: one build at a time, whatever the number of requests
+_filter_router_build_lock = threading.Lock()
+
+def _build_filter_router(version: str) -> bool:
+    global filter_router
+    try:
+        router = FilterRouter.from_collection(get_client(), COLLECTION_NAME)
+    except Exception as e:
+        print(f"⚠️ Could not read filter values from '{COLLECTION_NAME}': {e}")
+        return False
+
+    # Update in place so every reference to FILTER_FIELDS sees the new values
+    FILTER_FIELDS.clear()
+    FILTER_FIELDS.update(router.filter_fields)
+    filter_router = router
+    _filter_router_version["value"] = version
+    print(f"🗂️ Filter fields loaded: { {k: len(v) for k, v in FILTER_FIELDS.items()} } values, {len(router.centroids)} subject centroids")
+    return True
+
+def _rebuild_filter_router_in_background(version: str):
+    try:
+        _build_filter_router(version)
+    finally:
+        _filter_router_build_lock.release()
+
+def refresh_filter_router(force: bool = False) -> bool:
+    """
+    (Re)build FILTER_FIELDS and the router from the collection when its version changed.
+
+    The first build (or a forced one) runs in the caller, and concurrent callers wait
+    for it. Once a router exists, a newer collection version is picked up by a
+    background rebuild while requests keep using the current router.
+    """
+    try:
+        version = get_collection_version()
     except Exception as e:
-        print(f"❌ Fallback LLM classification also failed: {e}")
-        # Last resort: return reasonable defaults for engineering queries
-        return {"subject_code": "ELEC", "level": "1CP", "semester": "S1"}
+        print(f"⚠️ Could not read filter values from '{COLLECTION_NAME}': {e}")
+        return False
+    if not force and version == _filter_router_version["value"]:
+        return True
+
+    if force or _filter_router_version["value"] is None:
+        with _filter_router_build_lock:
+            if not force and version == _filter_router_version["value"]:
+                return True
+            return _build_filter_router(version)
+
+    if _filter_router_build_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild_filter_router_in_background, args=(version,), name="filter-router-refresh", daemon=True).start()
+    return True
+
+# -------------------------------
+# Step 1: Use LLM to classify filter fields (Improved)
+# -------------------------------
+def classify_query_filters(query: str) -> dict:
+    """
+    Let the LLM infer which filter values are relevant to the user query.
+
+    Decoding is constrained to a JSON schema built from FILTER_FIELDS, with thinking
+    off and a small token cap, so the reply is always a parseable object of known
+    values. Returns {} (search the whole collection) if the call fails.
+    """
+    try:
+        response = classifier_llm.chat(
+            prompts.classifier_messages(query, FILTER_FIELDS),
+            max_tokens=CLASSIFIER_MAX_TOKENS,
+            temperature=0.0,
+            json_schema=prompts.classifier_schema(FILTER_FIELDS),
+        )
+        record_llm_tokens("classifier", response)
+        result = json.loads(response.content)
+    except Exception as e:
+        print(f"[Warning] Filter classification failed: {e}")
+        metrics.inc("fallback", path="classifier_failed")
+        return {}
+
+    # The schema already restricts values; this also drops the nulls
+    validated_result = {k: v for k, v in result.items() if k in FILTER_FIELDS and v in FILTER_FIELDS[k]}
+    print(f"✅ Successfully parsed filters: {validated_result}")
+    return validated_result
 
 # -------------------------------
 # Step 2: Perform semantic search in Milvus (Improved)
@@ -163,161 +274,893 @@ def build_milvus_filter(filters: dict) -> str:
         return None
     
     conditions = []
-    for field, value in filters.items():
+    for name, value in filters.items():
         # Use proper Milvus filter syntax
-        conditions.append(f'{field} == "{value}"')
+        conditions.append(f'{name} == "{value}"')
     
     return " and ".join(conditions)
 
-def retrieve_documents(query: str, filters: dict, top_k=5) -> list:
-    """Search Milvus using raw query text and filters."""
+# Scalar fields returned with every hit; level/semester/subject_code allow post-filtering
+SEARCH_OUTPUT_FIELDS = ["chunk", "title", "page", "level", "semester", "subject_code"]
+
+def hit_entity(hit) -> dict:
+    """Flatten a search hit into a dict of its output fields plus `id` and `distance`."""
+    # Handle different response formats
+    if isinstance(hit, dict) and isinstance(hit.get("entity"), dict):
+        entity = dict(hit["entity"])
+    elif hasattr(hit, 'entity'):
+        chunk_data = hit.entity
+        entity = dict(chunk_data) if isinstance(chunk_data, dict) else {
+            name: getattr(chunk_data, name, None) for name in SEARCH_OUTPUT_FIELDS
+        }
+    else:
+        entity = dict(hit)
+    entity.setdefault("id", hit.get("id") if isinstance(hit, dict) else getattr(hit, "id", None))
+    entity.setdefault("distance", hit.get("distance") if isinstance(hit, dict) else getattr(hit, "distance", None))
+    return entity
+
+def format_chunk(entity: dict) -> str:
+    """Render a hit as the "[title] chunk" text passed to the LLM."""
+    return f"[{entity.get('title') or 'Unknown'}] {entity.get('chunk', '')}"
+
+# "hybrid" fuses dense (TEI `vector`) and BM25 (`sparse_vector`) searches, "dense" uses `vector` only;
+# hybrid falls back to dense on a collection without `sparse_vector` (see retrieval_mode)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# "rrf" (reciprocal-rank fusion) or "weighted" (dense_weight,sparse_weight from HYBRID_WEIGHTS)
+HYBRID_RANKER = os.getenv("HYBRID_RANKER", "rrf")
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+HYBRID_WEIGHTS = [float(w) for w in os.getenv("HYBRID_WEIGHTS", "0.7,0.3").split(",")]
+
+_retrieval_mode_warned = {"value": False}
+
+def retrieval_mode(mode: str = None) -> str:
+    """
+    The search mode to use (`mode`, else RETRIEVAL_MODE). Hybrid falls back to dense
+    when the collection has no `sparse_vector` field, e.g. one created before BM25.
+    """
+    mode = mode or RETRIEVAL_MODE
+    if mode != "hybrid":
+        return mode
     try:
-        # Build proper filter expression
-        filter_expr = build_milvus_filter(filters)
-        print(f"🔍 Milvus filter expression: {filter_expr}")
-        
-        # Try search with filters first
-        try:
-            results = client.search(
+        get_collection_version()
+    except Exception:
+        # Milvus is unreachable: the search itself will report it
+        return mode
+    if "sparse_vector" in _collection_version["fields"]:
+        return mode
+    if not _retrieval_mode_warned["value"]:
+        _retrieval_mode_warned["value"] = True
+        print(f"⚠️ '{COLLECTION_NAME}' has no sparse_vector field: using dense retrieval instead of hybrid")
+        metrics.inc("fallback", path="hybrid_without_sparse")
+    return "dense"
+
+def build_hybrid_ranker():
+    if HYBRID_RANKER == "weighted":
+        return WeightedRanker(*HYBRID_WEIGHTS)
+    return RRFRanker(HYBRID_RRF_K)
+
+def dense_search_data(queries: list, embeddings: list = None) -> list:
+    """
+    Query vectors for the `vector` field, embedded client-side (and cached). Falls
+    back to the raw texts, embedded by Milvus' TEI function, if TEI is unreachable.
+    """
+    if embeddings is None or any(embedding is None for embedding in embeddings):
+        embeddings = try_embed_queries(queries)
+    if any(embedding is None for embedding in embeddings):
+        return list(queries)
+    return [[float(x) for x in embedding] for embedding in embeddings]
+
+# Retrieval resilience: time budget per request, circuit breaker per replica, hedging
+RETRIEVAL_DEADLINE = float(os.getenv("RETRIEVAL_DEADLINE", "5.0"))
+MILVUS_BREAKER_FAILURES = int(os.getenv("MILVUS_BREAKER_FAILURES", "5"))
+MILVUS_BREAKER_RESET = float(os.getenv("MILVUS_BREAKER_RESET", "15.0"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+
+def _on_breaker_change(name: str, state: str):
+    print(f"🔌 Milvus circuit '{name}' is now {state}")
+    metrics.inc("circuit", breaker=name, state=state)
+
+milvus_breakers = {
+    replica: CircuitBreaker(f"replica{replica}", MILVUS_BREAKER_FAILURES, MILVUS_BREAKER_RESET, _on_breaker_change)
+    for replica in (0, 1)
+}
+search_hedger = Hedger(
+    percentile=HEDGE_PERCENTILE,
+    min_delay=HEDGE_MIN_DELAY,
+    on_hedge=lambda reason: metrics.inc("hedge", reason=reason),
+)
+
+def call_milvus(operation, deadline: Deadline = None):
+    """
+    Run `operation(client, timeout)` under the request deadline: replicas whose
+    circuit is open are skipped (no replica left fails immediately), and a second
+    replica, when configured, is hedged to once the first exceeds its p95 latency.
+    """
+    if deadline is None:
+        deadline = Deadline(RETRIEVAL_DEADLINE)
+    # Only peek here: a half-open replica's probe is claimed when its attempt starts,
+    # since the hedger may never run a backup (or any attempt, once past the deadline)
+    replicas = [replica for replica in milvus_replicas() if milvus_breakers[replica].available()]
+    if not replicas:
+        metrics.inc("fallback", path="milvus_circuit_open")
+        raise CircuitOpenError("Milvus is unavailable (circuit open)")
+
+    def attempt(replica: int):
+        def run():
+            return milvus_breakers[replica].call(
+                lambda: operation(get_client(replica), max(0.001, deadline.remaining())), deadline
+            )
+        return run
+
+    return search_hedger.run([attempt(replica) for replica in replicas], deadline)
+
+def search_hits_batch(queries: list, filters: dict, top_k: int, mode: str = None, embeddings: list = None, deadline: Deadline = None) -> list:
+    """Run one Milvus search (dense or hybrid) for several queries sharing the same filters."""
+    filter_expr = build_milvus_filter(filters) or ""
+    dense_data = dense_search_data(queries, embeddings)
+
+    if retrieval_mode(mode) == "hybrid":
+        # Both sub-searches fetch top_k so fusion can promote hits found by either one;
+        # BM25 needs the query text, the dense side takes the vectors
+        requests = [
+            AnnSearchRequest(data=dense_data, anns_field="vector", param={}, limit=top_k, expr=filter_expr),
+            AnnSearchRequest(data=list(queries), anns_field="sparse_vector", param={}, limit=top_k, expr=filter_expr),
+        ]
+
+        def operation(client, timeout):
+            return client.hybrid_search(
                 collection_name=COLLECTION_NAME,
-                data=[query],
-                filter=filter_expr,
-                output_fields=["chunk", "title"],
-                limit=top_k
+                reqs=requests,
+                ranker=build_hybrid_ranker(),
+                output_fields=SEARCH_OUTPUT_FIELDS,
+                limit=top_k,
+                timeout=timeout
             )
-        except Exception as filter_error:
-            print(f"⚠️ Search with filters failed: {filter_error}")
-            print("🔄 Trying search without filters...")
-            
-            # If partition key error, try without any filters
-            results = client.search(
+    else:
+        def operation(client, timeout):
+            return client.search(
                 collection_name=COLLECTION_NAME,
-                data=[query],
-                output_fields=["chunk", "title"],
-                limit=top_k
+                data=dense_data,
+                anns_field="vector",
+                filter=filter_expr,
+                output_fields=SEARCH_OUTPUT_FIELDS,
+                limit=top_k,
+                timeout=timeout
             )
-        
-        if results and len(results) > 0 and len(results[0]) > 0:
-            chunks = []
-            for hit in results[0]:
-                # Handle different response formats
-                if hasattr(hit, 'entity'):
-                    chunk_data = hit.entity
-                else:
-                    chunk_data = hit
-                
-                chunk_text = chunk_data.get("chunk", "") if isinstance(chunk_data, dict) else getattr(chunk_data, "chunk", "")
-                title = chunk_data.get("title", "Unknown") if isinstance(chunk_data, dict) else getattr(chunk_data, "title", "Unknown")
-                
-                if chunk_text:
-                    chunks.append(f"[{title}] {chunk_text}")
-            
-            print(f"✅ Found {len(chunks)} relevant documents")
-            return chunks
-        else:
-            print("⚠️ No search results returned")
-            return []
-            
+
+    with metrics.timer("stage", stage="search"):
+        results = call_milvus(operation, deadline)
+    results = results or []
+    return [
+        [entity for entity in (hit_entity(hit) for hit in query_hits) if entity.get("chunk")]
+        for query_hits in results
+    ] + [[] for _ in range(len(queries) - len(results))]
+
+def search_hits(query: str, filters: dict, top_k: int, mode: str = None, embedding=None, deadline: Deadline = None) -> list:
+    """Run a single Milvus search and return the hits as dicts."""
+    return search_hits_batch([query], filters, top_k, mode, None if embedding is None else [embedding], deadline)[0]
+
+def retrieve_hits(query: str, filters: dict, top_k=5, embedding=None, deadline: Deadline = None) -> list:
+    """
+    Search Milvus with the query and filters, returning hit dicts.
+
+    There are no sequential retries: a failing or open-circuit Milvus raises
+    RetrievalUnavailable right away, within the request's deadline.
+    """
+    print(f"🔍 Milvus filter expression: {build_milvus_filter(filters)}")
+    try:
+        hits = search_hits(query, filters, top_k, embedding=embedding, deadline=deadline)
+    except RetrievalUnavailable:
+        raise
     except Exception as e:
-        print(f"[Error] Milvus search failed: {e}")
-        print(f"Filter used: {filters}")
-        
-        # Last resort: try a basic search without any parameters
+        raise RetrievalUnavailable(f"Milvus search failed: {e}") from e
+
+    if hits:
+        print(f"✅ Found {len(hits)} relevant documents")
+    else:
+        print("⚠️ No search results returned")
+    return hits
+
+def retrieve_documents(query: str, filters: dict, top_k=5) -> list:
+    """Search Milvus using raw query text and filters."""
+    return [format_chunk(hit) for hit in retrieve_hits(query, filters, top_k)]
+
+# -------------------------------
+# Step 2b: Speculative retrieval (search while the filters are being inferred)
+# -------------------------------
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# The speculative unfiltered search fetches this many times top_k, to survive post-filtering
+SPECULATIVE_OVERFETCH = int(os.getenv("SPECULATIVE_OVERFETCH", "4"))
+
+# One worker per retrieval slot (RETRIEVAL_SLOTS), so concurrent requests do not queue behind each other
+SPECULATIVE_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", os.getenv("RETRIEVAL_SLOTS", "16")))
+
+_speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+
+def post_filter_hits(hits: list, filters: dict) -> list:
+    """Keep the hits whose scalar fields match every inferred filter."""
+    return [hit for hit in hits if all(hit.get(name) == value for name, value in (filters or {}).items())]
+
+def retrieve_speculative(query: str, embedding=None, top_k=5, deadline: Deadline = None) -> tuple:
+    """
+    Infer filters and retrieve hits, overlapping the unfiltered Milvus search with
+    filter inference.
+
+    If at least top_k speculative hits survive post-filtering they are used as is,
+    otherwise the regular filtered search runs. `deadline` bounds the speculative
+    search from the moment it starts running; a speculative search still waiting
+    for a worker once the filters are known is dropped. The filtered search gets a
+    fresh RETRIEVAL_DEADLINE budget. Returns (filters, hits).
+
+    In dense mode the kept hits are exactly the filtered top_k, since any closer
+    match would be among the unfiltered hits too. In hybrid mode they are only an
+    approximation: the fusion ranks each hit within the unfiltered dense and BM25
+    result lists, so the order (and the last few hits) may differ from a filtered
+    hybrid search.
+    """
+    if deadline is None:
+        deadline = Deadline(RETRIEVAL_DEADLINE)
+
+    def speculative_search():
+        deadline.restart()
+        return search_hits(query, None, top_k * SPECULATIVE_OVERFETCH, None, embedding, deadline)
+
+    future = _speculative_executor.submit(speculative_search)
+    filters = infer_filters(query, embedding)
+
+    if future.cancel():
+        print("⚠️ Speculative search never got a worker, searching with the filters instead")
+        metrics.inc("speculative", outcome="not_started")
+        speculative_hits = []
+    else:
         try:
-            print("🔄 Attempting basic search as last resort...")
-            results = client.search(
-                collection_name=COLLECTION_NAME,
-                data=[query],
-                limit=top_k
-            )
-            
-            if results and len(results) > 0:
-                chunks = []
-                for hit in results[0]:
-                    # Very basic chunk extraction
-                    if hasattr(hit, 'entity') and hasattr(hit.entity, 'chunk'):
-                        chunks.append(str(hit.entity.chunk))
-                    elif isinstance(hit, dict) and 'chunk' in hit:
-                        chunks.append(str(hit['chunk']))
-                
-                if chunks:
-                    print(f"✅ Basic search found {len(chunks)} documents")
-                    return chunks
-        except Exception as basic_error:
-            print(f"❌ Even basic search failed: {basic_error}")
-        
-        return []
+            speculative_hits = future.result(timeout=deadline.remaining())
+        except Exception as e:
+            print(f"⚠️ Speculative search failed: {e}")
+            speculative_hits = []
+
+    kept = post_filter_hits(speculative_hits, filters)[:top_k]
+    if len(kept) >= top_k:
+        print(f"⚡ Speculative search kept {len(kept)}/{len(speculative_hits)} hits after filtering")
+        metrics.inc("speculative", outcome="hit")
+        return filters, kept
+
+    metrics.inc("speculative", outcome="refetch")
+    print(f"\nStep 2: Only {len(kept)} speculative hits matched, searching with inferred filters: {filters}")
+    # Its own budget: `deadline` may have been spent waiting for filter inference
+    return filters, retrieve_hits(query, filters, top_k, embedding, Deadline(RETRIEVAL_DEADLINE))
+
+# -------------------------------
+# Step 2c: Optional cross-encoder reranking
+# -------------------------------
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# Size of the candidate pool retrieved for reranking, and how many chunks survive it
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "3"))
+DEFAULT_TOP_K = 5
+
+reranker = CrossEncoderReranker(model_name=RERANK_MODEL)
 
 # -------------------------------
 # Step 3: Send final context to LLM (Improved)
 # -------------------------------
-def generate_answer(query: str, context_chunks: list) -> str:
+# Context window of the serving model (vLLM `max-model-len`) and the part of it kept for the answer
+MAX_MODEL_LEN = int(os.getenv("MAX_MODEL_LEN", "3072"))
+ANSWER_TOKEN_RESERVE = int(os.getenv("ANSWER_TOKEN_RESERVE", "1024"))
+# Tokenizer of the serving model, used to count context tokens
+GENERATOR_TOKENIZER = os.getenv("GENERATOR_TOKENIZER", "Qwen/Qwen3-8B")
+
+count_tokens = TokenCounter(GENERATOR_TOKENIZER)
+context_packer = ContextPacker(count_tokens)
+
+def build_answer_messages(query: str, hits: list, conversation: str = None) -> list:
+    """Build the chat messages sent to the LLM, packing as much context as the window allows."""
+    # Budget = window - answer reserve - the prompt itself (plus a margin for the chat template)
+    overhead = sum(count_tokens(m["content"]) for m in prompts.answer_messages("", query, conversation)) + 16
+    budget = MAX_MODEL_LEN - ANSWER_TOKEN_RESERVE - overhead
+    blocks = context_packer.pack(hits, budget)
+    return prompts.answer_messages("\n\n".join(blocks), query, conversation)
+
+# Per-stage concurrency limits; LLM_SLOTS should match the generator's capacity
+# (max-num-seqs: 5 in models/vllm_inference_server/vllm-config.yaml)
+RETRIEVAL_SLOTS = int(os.getenv("RETRIEVAL_SLOTS", "16"))
+LLM_SLOTS = int(os.getenv("LLM_SLOTS", "5"))
+
+# Degraded mode: under overload, answer with cited excerpts of the retrieved chunks
+# instead of calling the LLM. "auto" switches on when requests queued for an LLM slot,
+# the recent p95 slot wait or the recent p95 generation time pass a threshold (0 = off);
+# "off" only degrades when a caller asks for it.
+DEGRADED_MODE = os.getenv("DEGRADED_MODE", "auto")
+DEGRADE_LLM_QUEUE = int(os.getenv("DEGRADE_LLM_QUEUE", str(2 * LLM_SLOTS)))
+DEGRADE_LLM_WAIT = float(os.getenv("DEGRADE_LLM_WAIT", "5.0"))
+DEGRADE_LLM_LATENCY = float(os.getenv("DEGRADE_LLM_LATENCY", "30.0"))
+DEGRADE_WINDOW = float(os.getenv("DEGRADE_WINDOW", "30"))
+DEGRADED_EXCERPTS = int(os.getenv("DEGRADED_EXCERPTS", "3"))
+
+overload = OverloadDetector(DEGRADE_LLM_QUEUE, DEGRADE_LLM_WAIT, DEGRADE_LLM_LATENCY, DEGRADE_WINDOW)
+retrieval_slots = StageLimiter("retrieval", RETRIEVAL_SLOTS, metrics)
+llm_slots = StageLimiter("llm", LLM_SLOTS, metrics, on_wait=overload.record_wait)
+
+def degrade_reason(requested: bool = None) -> str | None:
+    """Why this answer should skip the LLM ("requested", "llm_queue", "llm_wait", "llm_latency"), or None."""
+    if requested is not None:
+        return "requested" if requested else None
+    if DEGRADED_MODE != "auto":
+        return None
+    return overload.reason(llm_slots.waiting)
+
+def degraded_answer(query: str, hits: list, reason: str) -> str:
+    """Extractive answer from the top hits, citing title and page, without an LLM call."""
+    metrics.inc("degraded", reason=reason)
+    print(f"🪫 Degraded mode ({reason}): answering with excerpts of {min(len(hits), DEGRADED_EXCERPTS)} chunk(s)")
+    return extractive_answer(query, [hit_entity(hit) for hit in hits], DEGRADED_EXCERPTS)
+
+def generate_answer(query: str, hits: list, conversation: str = None) -> str:
     """Use LLM (Qwen) to generate the final answer."""
-    if not context_chunks:
+    if not hits:
         return "I couldn't find any relevant documents to answer your question."
     
-    context_text = "\n\n".join(context_chunks[:3])  # Limit to top 3 chunks
-    
-    prompt = (
-        "You are a helpful study assistant for ESTIN engineering students. "
-        "Answer the question based ONLY on the following course documents. "
-        "If the documents don't contain enough information to answer the question completely, "
-        "say so and provide what information is available.\n\n"
-        "COURSE DOCUMENTS:\n"
-        f"{context_text}\n\n"
-        f"STUDENT QUESTION: {query}\n\n"
-        "Please provide a clear, structured answer based on the course material above."
-    )
+    with llm_slots, metrics.timer("stage", stage="generate"):
+        start = time.perf_counter()
+        response = generator_llm.chat(build_answer_messages(query, hits, conversation), max_tokens=ANSWER_TOKEN_RESERVE)
+        overload.record_latency(time.perf_counter() - start)
+    record_llm_tokens("generator", response)
+    return response.content
 
+def generate_answer_stream(query: str, hits: list, conversation: str = None):
+    """Stream the final answer from the LLM, yielding {"content", "done", ...} parts as they arrive."""
+    if not hits:
+        yield {"content": "I couldn't find any relevant documents to answer your question.", "done": True}
+        return
     
-    response = ollama.chat(model="qwen3:8b", messages=[
-        {"role": "system", "content": "You are a helpful academic assistant. Answer clearly and accurately based only on the provided context."},
-        {"role": "user", "content": prompt}
-    ])
-    return response['message']['content']
+    # The slot is held for the whole stream: the sequence occupies the server until it ends
+    with llm_slots:
+        start = time.perf_counter()
+        yield from generator_llm.stream(build_answer_messages(query, hits, conversation), max_tokens=ANSWER_TOKEN_RESERVE)
+        overload.record_latency(time.perf_counter() - start)
 
 # -------------------------------
 # Step 4: Full RAG Chain (Improved)
 # -------------------------------
-def rag_respond(query: str):
+NO_DOCUMENTS_ANSWER = (
+    "I couldn't find any relevant documents to answer your question. "
+    "This might be due to collection configuration issues or the documents may not be indexed properly."
+)
+
+def cache_lookup(embedding, filters: dict, version: str = None) -> tuple:
+    """
+    Look the query embedding up in the semantic cache (for `version`, by default
+    the current collection version).
+
+    Returns (answer, cache_key); answer is None on a miss, cache_key is None when
+    the cache is disabled or unavailable and the answer should not be stored.
+    """
+    if not SEMANTIC_CACHE_ENABLED or embedding is None:
+        return None, None
+    if version is None:
+        try:
+            version = get_collection_version()
+        except Exception as e:
+            print(f"⚠️ Semantic cache unavailable: {e}")
+            return None, None
+
+    answer = answer_cache.lookup(embedding, filters, version)
+    metrics.inc("semantic_cache", outcome="hit" if answer is not None else "miss")
+    if answer is not None:
+        print(f"💾 Semantic cache hit ({answer_cache.stats()['hit_rate']:.0%} hit rate)")
+    return answer, (embedding, filters, version)
+
+def cache_store(cache_key: tuple, answer: str):
+    if cache_key is None or not answer:
+        return
+    embedding, filters, version = cache_key
+    answer_cache.store(embedding, filters, answer, version)
+
+def lookup_cached_answer(query: str) -> str | None:
+    """
+    Cheap answer path for overload: the semantic cache only, with filters from the
+    current local router and the last known collection version (no LLM or Milvus
+    call). None when nothing is cached, and right away when the router is not built
+    yet or no Milvus circuit is closed, so shedding stays fast.
+    """
+    version = _collection_version["value"]
+    if not SEMANTIC_CACHE_ENABLED or version is None or _filter_router_version["value"] is None:
+        return None
+    if not any(milvus_breakers[replica].state == "closed" for replica in milvus_replicas()):
+        return None
+    embedding = try_embed_query(query)
+    if embedding is None:
+        return None
+    filters = filter_router.route(query, embedding).filters
+    answer, _ = cache_lookup(embedding, filters, version)
+    return answer
+
+def infer_filters(query: str, embedding=None) -> dict:
+    """Infer filters with the local router, calling the LLM classifier only when it is unsure."""
     print(f"\n🔍 User Query: {query}")
     print("=" * 50)
 
-    # Step 1: Primary LLM-based filter classification
+    # Step 1: Local keyword/centroid routing (milliseconds, no LLM call)
+    refresh_filter_router()
+    with metrics.timer("stage", stage="route"):
+        route = filter_router.route(query, embedding)
+    print(f"🧭 Router ({route.source}, confidence {route.confidence:.2f}): {route.filters}")
+    if route.confidence >= ROUTER_CONFIDENCE_THRESHOLD:
+        metrics.inc("classification", path="router")
+        return route.filters
+
+    # Step 2: Schema-constrained LLM classification (one short call, no fallback needed)
     print("Step 1: Intelligent filter inference using LLM...")
-    filters = classify_query_filters(query)
-    print(f"🧠 Primary LLM Classification: {filters}")
-    
-    # Step 2: If primary classification is insufficient, use LLM fallback
-    if not filters or len(filters) == 0:
-        print("🔄 Primary classification empty, using enhanced LLM fallback...")
-        filters = extract_filters_fallback(query)
-        print(f"🎯 Fallback LLM Classification: {filters}")
-    
-    # Step 3: Search documents
-    print(f"\nStep 2: Searching documents with intelligently inferred filters: {filters}")
-    chunks = retrieve_documents(query, filters)
-    
-    if not chunks:
-        return "I couldn't find any relevant documents to answer your question. This might be due to collection configuration issues or the documents may not be indexed properly."
+    metrics.inc("classification", path="llm")
+    with metrics.timer("stage", stage="classify"):
+        filters = classify_query_filters(query)
+    print(f"🧠 LLM Classification: {filters}")
+    return filters
+
+@dataclass
+class RagContext:
+    filters: dict
+    chunks: list
+    hits: list = field(default_factory=list)
+    cached_answer: str | None = None
+    cache_key: tuple | None = None
+    timings: dict = field(default_factory=dict)
+    conversation: str | None = None
+
+# Multi-turn conversations: bounded per-session state, evicted by LRU/inactivity
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "4"))
+SESSION_MAX_HITS = int(os.getenv("SESSION_MAX_HITS", "30"))
+# Share of a follow-up's terms the retained chunks must contain to skip a new Milvus search
+SESSION_REUSE_MIN_COVERAGE = float(os.getenv("SESSION_REUSE_MIN_COVERAGE", "0.5"))
+
+sessions = SessionStore(
+    max_sessions=SESSION_MAX_SESSIONS,
+    ttl=SESSION_TTL,
+    max_turns=SESSION_MAX_TURNS,
+    max_hits=SESSION_MAX_HITS,
+)
+
+def prepare_followup_context(query: str, session, rerank: bool) -> RagContext | None:
+    """
+    Retrieval for a follow-up question, reusing the session's filters and chunks.
+
+    Classification is skipped unless the router is confident the subject changed
+    (then the session is reset and None is returned so the full chain runs). The
+    chunks already retrieved are re-ranked against the question first; Milvus is
+    only searched again when they do not cover enough of it.
+    """
+    timings = {}
+    embedding = try_embed_query(query)
+    refresh_filter_router()
+    with metrics.timer("stage", stage="route"):
+        route = filter_router.route(query, embedding)
+    subject = route.filters.get("subject_code")
+    if route.confidence >= ROUTER_CONFIDENCE_THRESHOLD and subject and subject != session.subject:
+        print(f"🔀 Subject changed ({session.subject} → {subject}), starting a new topic")
+        metrics.inc("session", outcome="topic_changed")
+        session.reset()
+        return None
+
+    filters = dict(session.filters)
+    metrics.inc("classification", path="session")
+    top_n = RERANK_TOP_N if rerank else DEFAULT_TOP_K
+
+    def rank(candidates: list, text: str) -> list:
+        if rerank and candidates:
+            try:
+                ranked, info = reranker.rerank(text, candidates, top_n)
+                timings["rerank"] = timings.get("rerank", 0.0) + info["latency"]
+                metrics.observe("stage", info["latency"], stage="rerank")
+                return ranked
+            except Exception as e:
+                print(f"⚠️ Reranking failed, keeping retrieval order: {e}")
+        return candidates[:top_n]
+
+    hits = rank(session.rank_hits(query), query)
+    if hits and session.coverage(query, hits) >= SESSION_REUSE_MIN_COVERAGE:
+        print(f"♻️ Follow-up answered from {len(hits)} chunks already retrieved in this conversation")
+        metrics.inc("session", outcome="reused_chunks")
+    else:
+        search_query = session.search_query(query)
+        print(f"\nStep 2: Follow-up search with the conversation's filters: {filters}")
+        metrics.inc("session", outcome="searched")
+        top_k = RERANK_CANDIDATES if rerank else DEFAULT_TOP_K
+        search_embedding = try_embed_query(search_query)
+        hits = rank(retrieve_hits(search_query, filters, top_k, search_embedding, Deadline(RETRIEVAL_DEADLINE)), search_query)
 
-    # Step 4: Generate answer
-    print(f"\nStep 3: Generating answer using {len(chunks)} document(s)...")
-    answer = generate_answer(query, chunks)
+    return RagContext(
+        filters=filters,
+        chunks=[format_chunk(hit) for hit in hits],
+        hits=hits,
+        timings=timings,
+        conversation=session.summary(),
+    )
+
+def prepare_context(query: str, speculative: bool = None, rerank: bool = None, session=None) -> RagContext:
+    """
+    Infer filters, consult the semantic cache and retrieve (and optionally rerank)
+    context chunks. `chunks` is empty on a cache hit. With a `session` that already
+    has turns, the question is handled as a follow-up (see prepare_followup_context).
+    Raises RetrievalUnavailable when Milvus cannot answer within RETRIEVAL_DEADLINE.
+    """
+    if speculative is None:
+        speculative = SPECULATIVE_RETRIEVAL
+    if rerank is None:
+        rerank = RERANK_ENABLED
+    if session is not None and session.has_history():
+        context = prepare_followup_context(query, session, rerank)
+        if context is not None:
+            return context
+    top_k = RERANK_CANDIDATES if rerank else DEFAULT_TOP_K
+    timings = {}
+    embedding = try_embed_query(query)
+
+    # The retrieval deadline only covers Milvus work, not filter inference
+    if speculative:
+        filters, hits = retrieve_speculative(query, embedding, top_k)
+        cached_answer, cache_key = cache_lookup(embedding, filters)
+    else:
+        filters = infer_filters(query, embedding)
+        cached_answer, cache_key = cache_lookup(embedding, filters)
+        hits = []
+        if cached_answer is None:
+            # Step 3: Search documents
+            print(f"\nStep 2: Searching documents with intelligently inferred filters: {filters}")
+            hits = retrieve_hits(query, filters, top_k, embedding, Deadline(RETRIEVAL_DEADLINE))
+
+    if cached_answer is not None:
+        return RagContext(filters=filters, chunks=[], cached_answer=cached_answer, cache_key=cache_key, timings=timings)
+
+    if rerank and hits:
+        try:
+            hits, info = reranker.rerank(query, hits, RERANK_TOP_N)
+            timings["rerank"] = info["latency"]
+            metrics.observe("stage", info["latency"], stage="rerank")
+            print(f"🎯 Reranked to {len(hits)} chunks in {info['latency']*1000:.0f} ms ({info['cached']} cached scores)")
+        except Exception as e:
+            print(f"⚠️ Reranking failed, keeping retrieval order: {e}")
+
+    return RagContext(
+        filters=filters,
+        chunks=[format_chunk(hit) for hit in hits],
+        hits=hits,
+        cache_key=cache_key,
+        timings=timings,
+    )
+
+# Identical concurrent questions (same normalized text, hence same inferred filters)
+# share one classify/search/generate run; conversation turns are never coalesced
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+in_flight = SingleFlight()
+
+def coalescing_key(query: str, speculative: bool, rerank: bool, degraded: bool = None) -> tuple:
+    return normalize_query(query), speculative, rerank, degraded
+
+def rag_respond(query: str, speculative: bool = None, rerank: bool = None, session=None, degraded: bool = None):
+    """
+    Answer a query; pass a `session` (see `sessions.get`) to answer it as part of a conversation.
+    `degraded=True` asks for the extractive no-LLM answer, False forbids it, None lets overload decide.
+    """
+    with metrics.timer("request", api="rag_respond"):
+        if session is not None:
+            with session.lock:
+                return _rag_respond(query, speculative, rerank, session, degraded)
+        if not COALESCE_REQUESTS:
+            return _rag_respond(query, speculative, rerank, None, degraded)
+
+        answer, joined = in_flight.do(
+            coalescing_key(query, speculative, rerank, degraded),
+            lambda: _rag_respond(query, speculative, rerank, None, degraded),
+        )
+        metrics.inc("coalescing", outcome="joined" if joined else "leader", api="rag_respond")
+        if joined:
+            print("🔗 Joined an identical in-flight request")
+        return answer
+
+def _rag_respond(query: str, speculative: bool, rerank: bool, session, degraded: bool = None):
+    with retrieval_slots, metrics.timer("stage", stage="retrieval"):
+        context = prepare_context(query, speculative, rerank, session)
+    reason = degrade_reason(degraded) if context.cached_answer is None and context.chunks else None
+    if context.cached_answer is not None:
+        answer = context.cached_answer
+    elif not context.chunks:
+        answer = NO_DOCUMENTS_ANSWER
+    elif reason is not None:
+        answer = degraded_answer(query, context.hits, reason)
+    else:
+        # Step 4: Generate answer
+        print(f"\nStep 3: Generating answer using {len(context.chunks)} document(s)...")
+        answer = generate_answer(query, context.hits, context.conversation)
+        cache_store(context.cache_key, answer)
+
+    if session is not None:
+        session.remember(query, answer, context.filters, context.hits)
     return answer
 
+def rag_respond_stream(query: str, speculative: bool = None, rerank: bool = None, session=None, degraded: bool = None):
+    """
+    Streaming variant of `rag_respond`.
+
+    Yields structured events (dicts with a "type" key):
+      - {"type": "retrieval", "filters", "num_chunks", "cached", "elapsed", "rerank_time"}: classification and search are done
+      - {"type": "token", "content"}: a piece of the answer, as produced by the LLM
+      - {"type": "done", "answer", "ttft", "generation_time", "tokens", "tokens_per_sec", "total_time", "degraded"}
+        where "degraded" is the reason the LLM was skipped (see `degrade_reason`), or None
+    """
+    if session is not None:
+        with session.lock:
+            yield from _rag_respond_stream(query, speculative, rerank, session, degraded)
+        return
+    if not COALESCE_REQUESTS:
+        yield from _rag_respond_stream(query, speculative, rerank, None, degraded)
+        return
+
+    events, joined = in_flight.stream(
+        coalescing_key(query, speculative, rerank, degraded),
+        lambda: _rag_respond_stream(query, speculative, rerank, None, degraded),
+    )
+    metrics.inc("coalescing", outcome="joined" if joined else "leader", api="rag_respond_stream")
+    if joined:
+        print("🔗 Joined an identical in-flight stream")
+    yield from events
+
+def _rag_respond_stream(query: str, speculative: bool, rerank: bool, session, degraded: bool = None):
+    start = time.perf_counter()
+    with retrieval_slots:
+        context = prepare_context(query, speculative, rerank, session)
+    chunks, cached_answer = context.chunks, context.cached_answer
+    retrieval_done = time.perf_counter()
+    metrics.observe("stage", retrieval_done - start, stage="retrieval")
+    yield {
+        "type": "retrieval",
+        "filters": context.filters,
+        "num_chunks": len(chunks),
+        "cached": cached_answer is not None,
+        "elapsed": retrieval_done - start,
+        "rerank_time": context.timings.get("rerank"),
+    }
+
+    reason = degrade_reason(degraded) if cached_answer is None and chunks else None
+    if cached_answer is not None or not chunks or reason is not None:
+        if cached_answer is not None:
+            answer = cached_answer
+        elif reason is not None:
+            answer = degraded_answer(query, context.hits, reason)
+        else:
+            answer = NO_DOCUMENTS_ANSWER
+        metrics.observe("request", time.perf_counter() - start, api="rag_respond_stream")
+        if session is not None:
+            session.remember(query, answer, context.filters, context.hits)
+        yield {"type": "token", "content": answer}
+        yield {
+            "type": "done",
+            "answer": answer,
+            "ttft": time.perf_counter() - retrieval_done,
+            "generation_time": 0.0,
+            "tokens": 0,
+            "tokens_per_sec": None,
+            "total_time": time.perf_counter() - start,
+            "degraded": reason,
+        }
+        return
+
+    print(f"\nStep 3: Streaming answer using {len(chunks)} document(s)...")
+    first_token_at = None
+    pieces = []
+    token_count = 0
+    completion_tokens = None
+
+    for part in generate_answer_stream(query, context.hits, context.conversation):
+        content = part["content"]
+        if content:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            pieces.append(content)
+            token_count += 1
+            yield {"type": "token", "content": content}
+        if part.get("completion_tokens"):
+            # Both backends report the exact token count with the final chunk
+            completion_tokens = part["completion_tokens"]
+            record_llm_tokens("generator", part)
+
+    end = time.perf_counter()
+    generation_time = end - retrieval_done
+    tokens = completion_tokens or token_count
+    if first_token_at is not None and end > first_token_at:
+        tokens_per_sec = tokens / (end - first_token_at)
+    else:
+        tokens_per_sec = None
+
+    ttft = first_token_at - retrieval_done if first_token_at is not None else None
+    metrics.observe("stage", generation_time, stage="generate")
+    if ttft is not None:
+        metrics.observe("ttft", ttft)
+    metrics.observe("request", end - start, api="rag_respond_stream")
+    answer = "".join(pieces)
+    cache_store(context.cache_key, answer)
+    if session is not None:
+        session.remember(query, answer, context.filters, context.hits)
+
+    yield {
+        "type": "done",
+        "answer": answer,
+        "ttft": ttft,
+        "generation_time": generation_time,
+        "tokens": tokens,
+        "tokens_per_sec": tokens_per_sec,
+        "total_time": end - start,
+        "degraded": None,
+    }
+
+# -------------------------------
+# Step 5: Batched multi-query API (evaluation runs, FAQ pre-generation)
+# -------------------------------
+# Maximum number of answers generated concurrently against the LLM server
+RAG_MANY_CONCURRENCY = int(os.getenv("RAG_MANY_CONCURRENCY", "4"))
+
+def rag_respond_many(queries: list, max_in_flight: int = None, rerank: bool = None) -> list:
+    """
+    Answer many queries at once and return the answers in input order.
+
+    Queries are grouped by inferred filters and each group is retrieved with one
+    multi-query Milvus search; answers are then generated concurrently with at
+    most `max_in_flight` requests outstanding. A query that fails gets its
+    exception in place of an answer instead of aborting the whole batch.
+    """
+    if max_in_flight is None:
+        max_in_flight = RAG_MANY_CONCURRENCY
+    if rerank is None:
+        rerank = RERANK_ENABLED
+    top_k = RERANK_CANDIDATES if rerank else DEFAULT_TOP_K
+    start = time.perf_counter()
+    answers = [None] * len(queries)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        # Step 1: Embed and infer filters (only low-confidence queries reach the LLM)
+        embeddings = try_embed_queries(queries)
+        filters_list = list(pool.map(infer_filters, queries, embeddings))
+
+        # Step 2: Semantic cache, then group the misses by filters
+        cache_keys = [None] * len(queries)
+        groups = {}
+        for i, (embedding, filters) in enumerate(zip(embeddings, filters_list)):
+            cached_answer, cache_keys[i] = cache_lookup(embedding, filters)
+            if cached_answer is not None:
+                answers[i] = cached_answer
+            else:
+                groups.setdefault(tuple(sorted(filters.items())), []).append(i)
+
+        # Step 3: One Milvus search per filter group
+        hits_list = [[] for _ in queries]
+        for filters_key, indices in groups.items():
+            filters = dict(filters_key)
+            print(f"🔍 Searching {len(indices)} queries with filters {filters}")
+            try:
+                group_hits = search_hits_batch([queries[i] for i in indices], filters, top_k, embeddings=[embeddings[i] for i in indices])
+            except Exception as e:
+                # Retrying one by one only helps against a healthy Milvus (e.g. one bad query);
+                # once a circuit is open every query of the group fails with the batch error
+                if not any(milvus_breakers[replica].state == "closed" for replica in milvus_replicas()):
+                    print(f"❌ Batched search failed ({e}) and Milvus is unavailable")
+                    error = e if isinstance(e, RetrievalUnavailable) else RetrievalUnavailable(f"Milvus search failed: {e}")
+                    for i in indices:
+                        answers[i] = error
+                    continue
+                print(f"⚠️ Batched search failed ({e}), retrieving queries one by one...")
+                group_hits = []
+                for i in indices:
+                    try:
+                        group_hits.append(retrieve_hits(queries[i], filters, top_k, embeddings[i], Deadline(RETRIEVAL_DEADLINE)))
+                    except Exception as query_error:
+                        print(f"❌ Query {i} failed: {query_error}")
+                        answers[i] = query_error
+                        group_hits.append([])
+            for i, hits in zip(indices, group_hits):
+                hits_list[i] = hits
+
+        # Step 4: Generate the answers concurrently
+        def answer(i: int):
+            hits = hits_list[i]
+            if rerank and hits:
+                hits, _ = reranker.rerank(queries[i], hits, RERANK_TOP_N)
+            if not hits:
+                return NO_DOCUMENTS_ANSWER
+            result = generate_answer(queries[i], hits)
+            cache_store(cache_keys[i], result)
+            return result
+
+        pending = [i for i in range(len(queries)) if answers[i] is None]
+        futures = {i: pool.submit(answer, i) for i in pending}
+        for i, future in futures.items():
+            try:
+                answers[i] = future.result()
+            except Exception as e:
+                print(f"❌ Query {i} failed: {e}")
+                answers[i] = e
+
+    elapsed = time.perf_counter() - start
+    cached = len(queries) - sum(len(indices) for indices in groups.values())
+    failed = sum(isinstance(answer, Exception) for answer in answers)
+    metrics.observe("request", elapsed, api="rag_respond_many")
+    metrics.inc("batched_queries", len(queries))
+    print(
+        f"📦 Answered {len(queries)} queries in {elapsed:.2f}s "
+        f"({len(queries) / elapsed if elapsed else 0:.2f} queries/s, "
+        f"{len(groups)} search groups, {cached} cached, {failed} failed)"
+    )
+    return answers
+
+# -------------------------------
+# Warm-up (run once per worker before serving students)
+# -------------------------------
+def warmup() -> dict:
+    """
+    Prime every dependency of the chain and return how long each step took (seconds).
+
+    Loads `estin_docs` into memory if needed, checks it supports the retrieval mode
+    (hybrid needs the BM25 `sparse_vector` field), sends a dummy search so the TEI
+    embedding and search paths are exercised, loads the LLMs with keep-alive, the
+    tokenizer and (when reranking is on) the cross-encoder, and reads the filter fields. A failing step is reported and does not stop the others.
+    """
+    timings = {}
+
+    def step(name: str, action):
+        start = time.perf_counter()
+        try:
+            action()
+            timings[name] = time.perf_counter() - start
+            print(f"🔥 Warm-up {name}: {timings[name]:.2f}s")
+        except Exception as e:
+            timings[name] = None
+            print(f"⚠️ Warm-up {name} failed after {time.perf_counter() - start:.2f}s: {e}")
+
+    def load_collection():
+        state = get_client().get_load_state(COLLECTION_NAME)
+        if "Loaded" not in str(state.get("state")):
+            get_client().load_collection(COLLECTION_NAME)
+
+    def load_llms():
+        generator_llm.warmup()
+        same_model = (classifier_llm.params.base_url, classifier_llm.params.model) == (
+            generator_llm.params.base_url, generator_llm.params.model
+        )
+        if not same_model:
+            classifier_llm.warmup()
+
+    step("collection_load", load_collection)
+    step("retrieval_mode", lambda: print(f"🔎 Retrieval mode: {retrieval_mode()}"))
+    step("tei_search", lambda: search_hits("warm-up", None, 1))
+    step("llm_load", load_llms)
+    step("tokenizer_load", lambda: count_tokens("warm-up"))
+    if RERANK_ENABLED:
+        # Loads the cross-encoder and runs its first (slowest) prediction
+        step("reranker_load", lambda: reranker.rerank("warm-up", [{"chunk": "warm-up"}], 1))
+    def load_filter_fields():
+        if not refresh_filter_router(force=True):
+            raise RuntimeError("filter fields could not be read from the collection")
+
+    step("filter_fields", load_filter_fields)
+    for name, seconds in timings.items():
+        if seconds is not None:
+            metrics.observe("warmup", seconds, step=name)
+    return timings
+
 # -------------------------------
 # Collection Info Helper
 # -------------------------------
 def check_collection_info():
     """Check if collection exists and get basic info."""
     try:
-        collections = client.list_collections()
+        collections = get_client().list_collections()
         print(f"Available collections: {collections}")
         
         if COLLECTION_NAME in collections:
             # Get collection stats
-            stats = client.get_collection_stats(COLLECTION_NAME)
+            stats = get_client().get_collection_stats(COLLECTION_NAME)
             print(f"Collection '{COLLECTION_NAME}' stats: {stats}")
             return True
         else:
@@ -333,13 +1176,24 @@ def check_collection_info():
 if __name__ == "__main__":
     print("RAG Chatbot (Milvus + Qwen) - Improved Version")
     print("=" * 50)
+
+    # Optional metrics exposure: Prometheus endpoint and/or periodic JSON dump
+    if os.getenv("METRICS_PORT"):
+        metrics.start_http_server(int(os.getenv("METRICS_PORT")))
+        print(f"📊 Metrics served on :{os.getenv('METRICS_PORT')}/metrics")
+    if os.getenv("METRICS_JSON_PATH"):
+        metrics.start_json_dump(os.getenv("METRICS_JSON_PATH"), float(os.getenv("METRICS_DUMP_INTERVAL", "60")))
     
     # Check collection status
     print("Checking collection status...")
     if not check_collection_info():
         print("⚠️ Collection issues detected. Continuing anyway...")
     
+    print("\nWarming up...")
+    warmup()
+    
     print("\nType 'exit' to quit, 'help' for commands\n")
+    session = sessions.get()
     
     while True:
         query = input("🧑‍🎓 You: ")
@@ -349,16 +1203,38 @@ if __name__ == "__main__":
             break
         elif query.lower() == "help":
             print("Available commands:")
-            print("- Ask any question about your ELEC course")
+            print("- Ask any question about your courses")
             print("- 'exit' or 'quit' to stop")
             print("- 'help' to see this message")
+            print("- 'new' to start a new conversation (follow-up questions reuse the current one)")
+            print("- 'stats' to see semantic cache statistics and stage latencies")
+            continue
+        elif query.lower() == "new":
+            session.reset()
+            print("🆕 New conversation started")
+            continue
+        elif query.lower() == "stats":
+            print(f"💾 Semantic cache: {answer_cache.stats()}")
+            print(f"🧮 Query embeddings: {query_embedder.stats()}")
+            print(f"📊 Metrics: {json.dumps(metrics.snapshot(), indent=2)}")
             continue
         elif not query.strip():
             continue
             
         try:
-            response = rag_respond(query)
-            print(f"\n🤖 Assistant: {response}")
+            answer_started = False
+            for event in rag_respond_stream(query, session=session):
+                if event["type"] == "token":
+                    if not answer_started:
+                        print("\n🤖 Assistant: ", end="", flush=True)
+                        answer_started = True
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "done":
+                    print()
+                    if event["ttft"] is not None:
+                        print(f"⏱️ Time to first token: {event['ttft']:.2f}s")
+                    if event["tokens_per_sec"] is not None:
+                        print(f"⚡ Generation rate: {event['tokens_per_sec']:.1f} tokens/s ({event['tokens']} tokens)")
             print("=" * 50)
         except Exception as e:
             print(f"❌ Error: {e}")
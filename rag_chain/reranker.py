@@ -0,0 +1,99 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class CrossEncoderReranker:
+    """
+    Re-scores retrieved chunks against the query with a small local cross-encoder.
+
+    All uncached (query, chunk) pairs of a request are scored in a single batch on
+    CPU, and scores are cached by (query hash, chunk id) so retries, follow-ups and
+    repeated questions do not pay for the model again.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+        device: str = "cpu",
+        max_length: int = 256,
+        max_cache_entries: int = 20000,
+    ):
+        self.model_name = model_name
+        self.device = device
+        self.max_length = max_length
+        self.max_cache_entries = max_cache_entries
+
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._scores: OrderedDict[tuple, float] = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @property
+    def model(self):
+        # Loaded on first use: sentence-transformers and torch are only needed when reranking is on
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+
+                    self._model = CrossEncoder(self.model_name, device=self.device, max_length=self.max_length)
+        return self._model
+
+    @staticmethod
+    def query_hash(query: str) -> str:
+        return hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: tuple):
+        with self._cache_lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def _cache_put(self, key: tuple, score: float):
+        with self._cache_lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.max_cache_entries:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, hits: list, top_n: int) -> tuple:
+        """
+        Sort hits by cross-encoder score and keep the best `top_n`.
+
+        Each returned hit gets a `rerank_score`. Returns (hits, info) where info holds
+        the rerank latency and how many pairs were scored vs served from cache.
+        """
+        start = time.perf_counter()
+        qhash = self.query_hash(query)
+
+        scores = [None] * len(hits)
+        to_score = []
+        for i, hit in enumerate(hits):
+            key = (qhash, hit.get("id"))
+            if hit.get("id") is not None:
+                scores[i] = self._cache_get(key)
+            if scores[i] is None:
+                to_score.append(i)
+
+        if to_score:
+            pairs = [(query, hits[i].get("chunk", "")) for i in to_score]
+            predicted = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            for i, score in zip(to_score, predicted):
+                scores[i] = float(score)
+                if hits[i].get("id") is not None:
+                    self._cache_put((qhash, hits[i]["id"]), scores[i])
+
+        ranked = sorted(
+            ({**hit, "rerank_score": score} for hit, score in zip(hits, scores)),
+            key=lambda hit: hit["rerank_score"],
+            reverse=True,
+        )
+        info = {
+            "latency": time.perf_counter() - start,
+            "scored": len(to_score),
+            "cached": len(hits) - len(to_score),
+        }
+        return ranked[:top_n], info
@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class RetrievalUnavailable(Exception):
+    """Retrieval cannot be served right now (circuit open, deadline exceeded or every replica failed)."""
+
+
+class DeadlineExceeded(RetrievalUnavailable):
+    pass
+
+
+class CircuitOpenError(RetrievalUnavailable):
+    pass
+
+
+class Deadline:
+    """Absolute time budget of a request, shared by every call made on its behalf."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def restart(self):
+        """Start the budget over from now, for work that waited in a queue before running."""
+        self.expires_at = time.monotonic() + self.seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"deadline of {self.seconds:.2f}s exceeded")
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls are
+    rejected for `reset_timeout` seconds; then a single probe call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+
+    `available()` only peeks; `allow()` claims the probe, so it must be followed by
+    `record_success()` or `record_failure()`. `call()` does all three around a call.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 15.0, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            if self.on_change is not None:
+                self.on_change(self.name, state)
+
+    def available(self) -> bool:
+        """Whether a call would be let through right now, without claiming the half-open probe."""
+        with self._lock:
+            if self.state == "open":
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return self.state == "closed" or not self._probing
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state("half_open")
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state("closed")
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state("open")
+
+    def call(self, fn, deadline: Deadline = None):
+        """
+        Run `fn()` through the breaker and record its outcome. The probe is only
+        claimed once the call really starts: an expired deadline or a closed gate
+        raises without touching the breaker.
+        """
+        if deadline is not None:
+            deadline.check()
+        if not self.allow():
+            raise CircuitOpenError(f"circuit '{self.name}' is {self.state}")
+        try:
+            result = fn()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+
+class LatencyWindow:
+    """Recent successful call latencies, for percentile-based hedging thresholds."""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, pct: float) -> float | None:
+        with self._lock:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Hedger:
+    """
+    Runs a call against a primary and, if it has not answered once the hedge delay
+    (the window's p95, at least `min_delay`) has passed or it failed, against a
+    second replica too; the first success wins. Everything is bounded by the deadline.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_delay: float = 0.05, min_samples: int = 20, max_workers: int = 16, on_hedge=None):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.on_hedge = on_hedge
+        self.latencies = LatencyWindow()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def hedge_delay(self, deadline: Deadline) -> float:
+        p = self.latencies.percentile(self.percentile)
+        if p is None or len(self.latencies.samples) < self.min_samples:
+            # No reliable p95 yet: wait for half the remaining budget
+            return max(self.min_delay, deadline.remaining() / 2)
+        return max(self.min_delay, p)
+
+    def run(self, attempts: list, deadline: Deadline):
+        """`attempts` are zero-argument callables, one per replica in preference order."""
+        deadline.check()
+        start = time.monotonic()
+        pending = {self._executor.submit(attempts[0])}
+        backups = list(attempts[1:])
+        error = None
+
+        while pending:
+            timeout = deadline.remaining()
+            if backups:
+                timeout = min(timeout, max(0.0, self.hedge_delay(deadline) - (time.monotonic() - start)))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                self.latencies.record(time.monotonic() - start)
+                return result
+
+            if deadline.expired():
+                raise DeadlineExceeded(f"no replica answered within {deadline.seconds:.2f}s") from error
+            if backups and (not pending or not done):
+                # The primary is slow (past the hedge delay) or failed: try the next replica
+                if self.on_hedge is not None:
+                    self.on_hedge("failover" if not pending else "slow")
+                pending.add(self._executor.submit(backups.pop(0)))
+
+        raise RetrievalUnavailable(f"every replica failed: {error}") from error
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass
+class CacheEntry:
+    embedding: np.ndarray
+    filters_key: tuple
+    answer: str
+    version: str
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SemanticCache:
+    """
+    Answer cache keyed on the query embedding plus the inferred filters.
+
+    A lookup returns the stored answer of the most similar cached query when the
+    cosine similarity reaches `threshold`, the filters are identical and the entry
+    was stored against the same collection version. Entries are evicted in LRU
+    order once `max_entries` is reached, and expire after `ttl` seconds.
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024, ttl: float = 3600.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._entries: OrderedDict[int, CacheEntry] = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _filters_key(filters: dict) -> tuple:
+        return tuple(sorted((filters or {}).items()))
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl is not None and now - entry.created_at > self.ttl
+
+    def lookup(self, embedding, filters: dict, version: str) -> str | None:
+        """Return the cached answer for a similar query, or None on a miss."""
+        query_vector = self._normalize(embedding)
+        filters_key = self._filters_key(filters)
+        now = time.monotonic()
+
+        with self._lock:
+            best_id, best_score = None, -1.0
+            stale = []
+            for entry_id, entry in self._entries.items():
+                if entry.version != version or self._expired(entry, now):
+                    stale.append(entry_id)
+                    continue
+                if entry.filters_key != filters_key:
+                    continue
+                score = float(np.dot(query_vector, entry.embedding))
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            for entry_id in stale:
+                del self._entries[entry_id]
+                self.evictions += 1
+
+            if best_id is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_id)
+                self.hits += 1
+                return self._entries[best_id].answer
+
+            self.misses += 1
+            return None
+
+    def store(self, embedding, filters: dict, answer: str, version: str):
+        """Cache an answer, evicting the least recently used entries if full."""
+        entry = CacheEntry(
+            embedding=self._normalize(embedding),
+            filters_key=self._filters_key(filters),
+            answer=answer,
+            version=version,
+        )
+        with self._lock:
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
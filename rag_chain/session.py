@@ -0,0 +1,166 @@
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+
+from filter_router import normalize_text
+
+
+# Words that say nothing about the topic of a follow-up ("and for parallel RLC?")
+STOPWORDS = {
+    "and", "the", "for", "what", "how", "why", "with", "this", "that", "then", "about", "does", "are", "can",
+    "les", "des", "une", "pour", "avec", "dans", "est", "que", "qui", "quoi", "quel", "quelle", "comment",
+    "pourquoi", "cas", "aussi", "sur", "par", "ce", "cette", "et", "ou", "du", "de", "la", "le",
+}
+
+
+def content_terms(text: str) -> set:
+    """Normalized words of a text that carry meaning (3+ letters, not stopwords)."""
+    return {word for word in re.findall(r"\w+", normalize_text(text)) if len(word) > 2 and word not in STOPWORDS}
+
+
+def compact_answer(answer: str, max_chars: int) -> str:
+    """First sentences of an answer, cut at `max_chars`."""
+    text = " ".join(answer.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    return cut[: end + 1] if end > max_chars // 2 else cut.rstrip() + "…"
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str  # compacted
+
+
+class ConversationSession:
+    """
+    Retrieval state of one conversation.
+
+    Keeps the filters of the current topic, the chunks retrieved so far (by id, at
+    most `max_hits`) and the last `max_turns` question/answer pairs, with answers
+    cut to `answer_chars`. Everything is bounded, so a session's size does not
+    grow with the length of the conversation.
+    """
+
+    def __init__(self, session_id: str, max_turns: int = 4, max_hits: int = 30, answer_chars: int = 240, summary_chars: int = 800):
+        self.session_id = session_id
+        self.max_hits = max_hits
+        self.answer_chars = answer_chars
+        self.summary_chars = summary_chars
+
+        self.filters: dict = {}
+        self.hits: OrderedDict = OrderedDict()
+        self.turns: deque = deque(maxlen=max_turns)
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def subject(self) -> str | None:
+        return self.filters.get("subject_code")
+
+    @property
+    def chunk_ids(self) -> list:
+        return list(self.hits)
+
+    def has_history(self) -> bool:
+        return bool(self.turns)
+
+    def summary(self) -> str:
+        """Rolling summary of the last turns, oldest dropped first to stay under `summary_chars`."""
+        lines = [f"Q: {turn.question}\nA: {turn.answer}" for turn in self.turns]
+        while lines and sum(len(line) + 1 for line in lines) > self.summary_chars:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def search_query(self, query: str) -> str:
+        """Follow-ups are usually elliptical: search with the previous question as context."""
+        if not self.turns:
+            return query
+        return f"{self.turns[-1].question} {query}"
+
+    def rank_hits(self, query: str) -> list:
+        """Retained chunks sorted by how many of the query's terms they contain."""
+        terms = content_terms(query)
+        scored = []
+        for hit in self.hits.values():
+            overlap = len(terms & content_terms(hit.get("chunk", ""))) / len(terms) if terms else 0.0
+            scored.append(({**hit, "session_score": overlap}, overlap))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return [hit for hit, _ in scored]
+
+    @staticmethod
+    def coverage(query: str, hits: list) -> float:
+        """Share of the query's terms found in at least one of `hits`."""
+        terms = content_terms(query)
+        if not terms:
+            return 1.0
+        found = set()
+        for hit in hits:
+            found |= terms & content_terms(hit.get("chunk", ""))
+        return len(found) / len(terms)
+
+    def remember(self, query: str, answer: str, filters: dict, hits: list):
+        """Record a finished turn: its filters, the chunks it used and a compact answer."""
+        self.filters = dict(filters or {})
+        for hit in hits:
+            key = hit.get("id")
+            if key is None:
+                continue
+            self.hits[key] = {k: v for k, v in hit.items() if k not in ("rerank_score", "session_score")}
+            self.hits.move_to_end(key)
+        while len(self.hits) > self.max_hits:
+            self.hits.popitem(last=False)
+        self.turns.append(Turn(question=query, answer=compact_answer(answer or "", self.answer_chars)))
+        self.last_used = time.monotonic()
+
+    def reset(self):
+        """Forget the topic (filters, chunks and turns), e.g. when the subject changes."""
+        self.filters = {}
+        self.hits.clear()
+        self.turns.clear()
+
+
+class SessionStore:
+    """
+    Conversation sessions by id, evicted in LRU order beyond `max_sessions` and after
+    `ttl` seconds of inactivity, so memory stays flat with many concurrent users.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 1800.0, **session_options):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.session_options = session_options
+        self._sessions: OrderedDict[str, ConversationSession] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str = None) -> ConversationSession:
+        """Return the session with this id, creating it (with a new id if None) when needed."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if now - s.last_used > self.ttl]
+            for sid in expired:
+                del self._sessions[sid]
+
+            if session_id is None:
+                session_id = uuid.uuid4().hex
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = ConversationSession(session_id, **self.session_options)
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_sessions": self.max_sessions}
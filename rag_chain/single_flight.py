@@ -0,0 +1,107 @@
+import threading
+from concurrent.futures import Future
+
+
+class _Broadcast:
+    """Events of one in-flight stream, replayed to every subscriber from the start."""
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def publish(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def finish(self, error: BaseException = None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.events) and not self.done:
+                    self.condition.wait()
+                if index < len(self.events):
+                    event = self.events[index]
+                    index += 1
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            yield event
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller for a key runs the work,
+    callers arriving while it is in flight wait for and share its result (or its
+    exception). Nothing is kept once the call completes, so this is not a cache.
+    """
+
+    def __init__(self):
+        self._calls: dict = {}
+        self._streams: dict = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn) -> tuple:
+        """Return (result of fn(), whether it was shared from another caller's call)."""
+        with self._lock:
+            call = self._calls.get(key)
+            joined = call is not None
+            if not joined:
+                call = self._calls[key] = Future()
+        if joined:
+            return call.result(), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                del self._calls[key]
+            call.set_exception(e)
+            raise
+        with self._lock:
+            del self._calls[key]
+        call.set_result(result)
+        return result, False
+
+    def stream(self, key, make_stream) -> tuple:
+        """
+        Return (event iterator, whether it joined an in-flight stream).
+
+        The first caller's `make_stream()` generator is consumed on a background
+        thread so that one slow or disconnected reader does not stall the others;
+        every subscriber receives all events from the beginning.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            joined = broadcast is not None
+            if not joined:
+                broadcast = self._streams[key] = _Broadcast()
+
+        if not joined:
+            def produce():
+                error = None
+                try:
+                    for event in make_stream():
+                        broadcast.publish(event)
+                except BaseException as e:
+                    error = e
+                finally:
+                    with self._lock:
+                        del self._streams[key]
+                    broadcast.finish(error)
+
+            threading.Thread(target=produce, name="single-flight-stream", daemon=True).start()
+        return broadcast.subscribe(), joined
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._streams)
@@ -0,0 +1,142 @@
+import os
+import sys
+import threading
+import time
+
+# Allow running this file directly as well as through pytest
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from resilience import CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, Hedger, RetrievalUnavailable
+
+
+def fail():
+    raise ConnectionError("replica down")
+
+
+def open_breaker(reset_timeout: float = 0.05, wait: bool = True) -> CircuitBreaker:
+    """A breaker opened by two failures, by default waited on until its reset timeout passed."""
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=reset_timeout)
+    for _ in range(2):
+        try:
+            breaker.call(fail)
+        except ConnectionError:
+            pass
+    assert breaker.state == "open"
+    if wait:
+        time.sleep(reset_timeout * 1.5)
+    return breaker
+
+
+def test_breaker_opens_after_threshold_and_rejects_calls():
+    breaker = open_breaker(reset_timeout=60, wait=False)
+    assert not breaker.available()
+    try:
+        breaker.call(lambda: "never runs")
+        assert False, "an open circuit must reject calls"
+    except CircuitOpenError:
+        pass
+
+
+def test_available_does_not_claim_the_probe():
+    breaker = open_breaker()
+    for _ in range(5):
+        assert breaker.available()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.available()
+    assert not breaker.allow()
+
+
+def test_probe_outcome_closes_or_reopens():
+    breaker = open_breaker()
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+    breaker = open_breaker()
+    try:
+        breaker.call(fail)
+    except ConnectionError:
+        pass
+    assert breaker.state == "open"
+
+
+def test_deadline_restart_gives_the_full_budget_again():
+    deadline = Deadline(0.05)
+    time.sleep(0.06)
+    assert deadline.expired()
+    deadline.restart()
+    assert not deadline.expired() and deadline.remaining() > 0.04
+
+
+def test_expired_deadline_does_not_claim_the_probe():
+    breaker = open_breaker()
+    deadline = Deadline(0.0)
+    try:
+        breaker.call(lambda: "too late", deadline)
+        assert False, "an expired deadline must raise"
+    except DeadlineExceeded:
+        pass
+    assert breaker.available()
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_hedger_past_deadline_leaves_half_open_breakers_usable():
+    breakers = [open_breaker(), open_breaker()]
+    attempts = [lambda b=b: b.call(lambda: "ok") for b in breakers]
+    try:
+        Hedger().run(attempts, Deadline(0.0))
+        assert False, "an expired deadline must raise"
+    except DeadlineExceeded:
+        pass
+    assert all(b.available() for b in breakers)
+
+
+def test_unused_hedge_backup_does_not_claim_its_probe():
+    primary = CircuitBreaker("primary")
+    backup = open_breaker()
+    hedger = Hedger(min_delay=1.0)
+    result = hedger.run([lambda: primary.call(lambda: "primary"), lambda: backup.call(lambda: "backup")], Deadline(2.0))
+    assert result == "primary"
+    assert backup.available()
+    assert backup.call(lambda: "ok") == "ok"
+
+
+def test_hedger_fails_over_and_hedges_slow_primary():
+    hedges = []
+    # One recorded latency is enough for a p95, so slow calls are hedged after min_delay
+    hedger = Hedger(min_delay=0.05, min_samples=1, on_hedge=hedges.append)
+    assert hedger.run([fail, lambda: "backup"], Deadline(1.0)) == "backup"
+
+    release = threading.Event()
+
+    def slow():
+        release.wait(1.0)
+        return "slow"
+
+    start = time.monotonic()
+    assert hedger.run([slow, lambda: "fast"], Deadline(1.0)) == "fast"
+    assert time.monotonic() - start < 0.3
+    release.set()
+    assert hedges == ["failover", "slow"]
+
+
+def test_hedger_raises_when_every_replica_fails_or_times_out():
+    try:
+        Hedger(min_delay=0.01).run([fail, fail], Deadline(1.0))
+        assert False, "every replica failed"
+    except RetrievalUnavailable as e:
+        assert not isinstance(e, DeadlineExceeded)
+
+    try:
+        Hedger().run([lambda: time.sleep(0.5)], Deadline(0.05))
+        assert False, "the deadline must bound the call"
+    except DeadlineExceeded:
+        pass
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
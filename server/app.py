@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+# The RAG chain is a flat directory of modules next to this one
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rag_chain"))
+
+import rag_pipeline_v2 as rag
+from metrics import metrics
+from resilience import RetrievalUnavailable
+from request_queue import QueueFull, RequestQueue
+
+# -------------------------------
+# Configuration
+# -------------------------------
+# Requests running the chain at once (worker threads); stage limits inside the chain
+# (RETRIEVAL_SLOTS, LLM_SLOTS) further cap the expensive parts
+SERVER_MAX_IN_FLIGHT = int(os.getenv("SERVER_MAX_IN_FLIGHT", "32"))
+# Requests allowed to wait for a worker; beyond this they are shed at once
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "64"))
+# When shedding, answer from the semantic cache if possible instead of a bare 429
+SERVER_DEGRADE_ON_OVERLOAD = os.getenv("SERVER_DEGRADE_ON_OVERLOAD", "true").lower() == "true"
+# Time (seconds) the cache lookup of a shed request may take before answering 429 instead
+SERVER_SHED_LOOKUP_TIMEOUT = float(os.getenv("SERVER_SHED_LOOKUP_TIMEOUT", "0.05"))
+SERVER_WARMUP = os.getenv("SERVER_WARMUP", "true").lower() == "true"
+
+executor = ThreadPoolExecutor(max_workers=SERVER_MAX_IN_FLIGHT, thread_name_prefix="rag")
+request_queue: RequestQueue = None
+
+
+class ChatRequest(BaseModel):
+    query: str
+    session_id: str | None = None
+    stream: bool = False
+    # True: excerpts only (no LLM), False: never degrade, None: degrade under overload
+    degraded: bool | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global request_queue
+    request_queue = RequestQueue(SERVER_MAX_IN_FLIGHT, SERVER_MAX_QUEUE, metrics)
+    if SERVER_WARMUP:
+        await asyncio.get_running_loop().run_in_executor(executor, rag.warmup)
+    yield
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(title="Estin Chat", lifespan=lifespan)
+
+
+# -------------------------------
+# Helpers
+# -------------------------------
+async def shed(request: ChatRequest, reason: str):
+    """
+    Answer an overloaded request right away: from the semantic cache if it answers
+    within SERVER_SHED_LOOKUP_TIMEOUT, else 429.
+    """
+    if SERVER_DEGRADE_ON_OVERLOAD:
+        try:
+            answer = await asyncio.wait_for(asyncio.to_thread(rag.lookup_cached_answer, request.query), SERVER_SHED_LOOKUP_TIMEOUT)
+        except Exception:
+            answer = None
+        if answer is not None:
+            metrics.inc("shed_response", kind="cached")
+            return JSONResponse({"answer": answer, "session_id": request.session_id, "degraded": True, "degraded_reason": "cache"})
+
+    metrics.inc("shed_response", kind="rejected")
+    return JSONResponse(
+        {"error": "overloaded", "detail": reason},
+        status_code=429,
+        headers={"Retry-After": str(request_queue.retry_after())},
+    )
+
+
+def unavailable(error: Exception) -> JSONResponse:
+    return JSONResponse(
+        {"error": "retrieval_unavailable", "detail": str(error)},
+        status_code=503,
+        headers={"Retry-After": str(int(rag.MILVUS_BREAKER_RESET))},
+    )
+
+
+def internal_error(error: Exception) -> JSONResponse:
+    """Same body as the stream's "internal" error event."""
+    return JSONResponse({"error": "internal", "detail": str(error)}, status_code=500)
+
+
+def run_chain(request: ChatRequest, session, loop: asyncio.AbstractEventLoop) -> dict:
+    """
+    Run the chain to completion and return its final "done" event (which says whether it degraded).
+    Releases the request's admission slot once the chain is done, even if the client left before.
+    """
+    try:
+        for event in rag.rag_respond_stream(request.query, session=session, degraded=request.degraded):
+            if event["type"] == "done":
+                return event
+    finally:
+        loop.call_soon_threadsafe(request_queue.release)
+
+
+def stream_events(request: ChatRequest, session, loop: asyncio.AbstractEventLoop) -> tuple:
+    """
+    Run rag_respond_stream on a worker thread, forwarding its events to an asyncio queue
+    (ended by the returned sentinel). Like run_chain, releases the admission slot when done.
+    """
+    events = asyncio.Queue()
+    done = object()
+
+    def pump():
+        try:
+            for event in rag.rag_respond_stream(request.query, session=session, degraded=request.degraded):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+        except RetrievalUnavailable as e:
+            loop.call_soon_threadsafe(events.put_nowait, {"type": "error", "error": "retrieval_unavailable", "detail": str(e)})
+        except Exception as e:
+            loop.call_soon_threadsafe(events.put_nowait, {"type": "error", "error": "internal", "detail": str(e)})
+        finally:
+            loop.call_soon_threadsafe(events.put_nowait, done)
+            loop.call_soon_threadsafe(request_queue.release)
+
+    loop.run_in_executor(executor, pump)
+    return events, done
+
+
+# -------------------------------
+# Endpoints
+# -------------------------------
+@app.post("/v1/chat")
+async def chat(request: ChatRequest):
+    """
+    Answer a student question. With `session_id`, follow-up questions reuse the
+    conversation's state. With `stream`, events are sent as server-sent events
+    (the `rag_respond_stream` retrieval/token/done dicts).
+    """
+    try:
+        queue_wait = await request_queue.acquire()
+    except QueueFull as e:
+        return await shed(request, str(e))
+
+    session = rag.sessions.get(request.session_id) if request.session_id else None
+    loop = asyncio.get_running_loop()
+
+    if request.stream:
+        events, done = stream_events(request, session, loop)
+
+        async def body():
+            yield f"data: {json.dumps({'type': 'queued', 'queue_wait': queue_wait})}\n\n"
+            while True:
+                event = await events.get()
+                if event is done:
+                    break
+                yield f"data: {json.dumps(event, default=str)}\n\n"
+
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    start = time.perf_counter()
+    try:
+        result = await loop.run_in_executor(executor, run_chain, request, session, loop)
+    except RetrievalUnavailable as e:
+        return unavailable(e)
+    except Exception as e:
+        return internal_error(e)
+
+    return {
+        "answer": result["answer"],
+        "session_id": request.session_id,
+        "degraded": result["degraded"] is not None,
+        "degraded_reason": result["degraded"],
+        "queue_wait": queue_wait,
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+@app.get("/v1/status")
+async def status():
+    """Queue depth/wait and stage occupancy, for autoscaling and dashboards."""
+    return {
+        "queue": request_queue.status(),
+        "stages": {
+            "retrieval": rag.retrieval_slots.status(),
+            "llm": rag.llm_slots.status(),
+        },
+        "overload": rag.overload.status(rag.llm_slots.waiting),
+        "milvus_circuits": {name: breaker.state for name, breaker in rag.milvus_breakers.items()},
+        "sessions": rag.sessions.stats(),
+    }
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.prometheus_text(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics.json")
+async def metrics_json():
+    return metrics.snapshot()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("SERVER_HOST", "0.0.0.0"), port=int(os.getenv("SERVER_PORT", "8080")))
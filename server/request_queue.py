@@ -0,0 +1,80 @@
+import asyncio
+import math
+import time
+from collections import deque
+
+
+class QueueFull(Exception):
+    """The request queue is at capacity; the request should be shed."""
+
+
+class RequestQueue:
+    """
+    Admission control for the chat service (one instance per event loop).
+
+    At most `max_in_flight` requests run at once; up to `max_queue` more wait for
+    a slot, and anything beyond that is rejected immediately with QueueFull rather
+    than waiting until it times out. Queue depth and waiting times are published
+    to the metrics registry (`queue_depth`, `queue_in_flight` gauges and the
+    `queue_wait` histogram).
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, metrics):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.metrics = metrics
+        self.waiting = 0
+        self.in_flight = 0
+        self.recent_waits = deque(maxlen=512)
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    def _publish(self):
+        self.metrics.set_gauge("queue_depth", self.waiting)
+        self.metrics.set_gauge("queue_in_flight", self.in_flight)
+
+    async def acquire(self) -> float:
+        """Wait for a slot and return the time spent queued; raises QueueFull if the queue is full."""
+        if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue:
+            self.metrics.inc("shed", reason="queue_full")
+            raise QueueFull(f"{self.waiting} requests already queued")
+
+        start = time.perf_counter()
+        self.waiting += 1
+        self._publish()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+            self._publish()
+
+        wait = time.perf_counter() - start
+        self.in_flight += 1
+        self._publish()
+        self.recent_waits.append(wait)
+        self.metrics.observe("queue_wait", wait)
+        return wait
+
+    def release(self):
+        self.in_flight -= 1
+        self._publish()
+        self._slots.release()
+
+    def wait_percentile(self, pct: float) -> float | None:
+        ordered = sorted(self.recent_waits)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))]
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait before retrying (the recent p95 queue wait, at least 1)."""
+        return max(1, math.ceil(self.wait_percentile(95) or 1))
+
+    def status(self) -> dict:
+        return {
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "wait_p50": self.wait_percentile(50),
+            "wait_p95": self.wait_percentile(95),
+        }